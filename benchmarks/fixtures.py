@@ -0,0 +1,105 @@
+import json
+import random
+
+from bitflyer.recorder import FrameReplayer
+
+PRODUCT = 'FX_BTC_JPY'
+
+
+def synthetic_snapshot(mid_price=1_000_000, depth=300, seed=0):
+    rng = random.Random(seed)
+    bids, asks = [], []
+    price = mid_price
+    for _ in range(depth):
+        price -= rng.randint(1, 30)
+        bids.append({'price': float(price), 'size': round(rng.uniform(0.01, 3), 3)})
+    price = mid_price
+    for _ in range(depth):
+        price += rng.randint(1, 30)
+        asks.append({'price': float(price), 'size': round(rng.uniform(0.01, 3), 3)})
+    return {'mid_price': float(mid_price), 'bids': bids, 'asks': asks}
+
+
+def synthetic_board_updates(n=50_000, mid_price=1_000_000, seed=0):
+    # random walk of the mid with 0-3 level changes per side, a third of them removing the level.
+    rng = random.Random(seed)
+    updates = []
+    for _ in range(n):
+        mid_price += rng.randint(-5, 5)
+        updates.append({
+            'mid_price': float(mid_price),
+            'bids': [{'price': float(mid_price - rng.randint(1, 300)), 'size': rng.choice([0, 0.01, 0.1, 1.5])}
+                     for _ in range(rng.randint(0, 3))],
+            'asks': [{'price': float(mid_price + rng.randint(1, 300)), 'size': rng.choice([0, 0.01, 0.1, 1.5])}
+                     for _ in range(rng.randint(0, 3))]
+        })
+    return updates
+
+
+def synthetic_order_events(num_orders=1_000, executions_per_order=10, seed=0):
+    # <order_id:messages> as expected by fetch_order_status, in arrival order.
+    rng = random.Random(seed)
+    events = {}
+    for i in range(num_orders):
+        order_id = f'JRF20200501-{i:06d}'
+        size = 0.01 * executions_per_order
+        messages = [{'child_order_acceptance_id': order_id, 'event_type': 'ORDER',
+                     'event_date': '2020-05-01T10:00:00.0000000Z', 'size': size}]
+        outstanding_size = size
+        for j in range(executions_per_order):
+            outstanding_size -= 0.01
+            messages.append({'child_order_acceptance_id': order_id, 'event_type': 'EXECUTION',
+                             'event_date': f'2020-05-01T10:00:{j + 1:02d}.{rng.randint(0, 9999999):07d}Z',
+                             'size': 0.01, 'price': 1_000_000 + rng.randint(-100, 100),
+                             'outstanding_size': round(outstanding_size, 8)})
+        events[order_id] = messages
+    return events
+
+
+def synthetic_executions(n=20_000, mid_price=1_000_000, seed=0):
+    # lightning_executions messages of 1-20 executions, a burst of ~5000 executions per second.
+    rng = random.Random(seed)
+    messages, exec_id, t = [], 0, 0.0
+    while exec_id < n:
+        message = []
+        for _ in range(rng.randint(1, 20)):
+            exec_id += 1
+            t += rng.uniform(0, 0.0004)
+            mid_price += rng.randint(-5, 5)
+            second, fraction = divmod(t, 1)
+            message.append({'id': exec_id, 'side': rng.choice(['BUY', 'SELL']), 'price': float(mid_price),
+                            'size': rng.choice([0.01, 0.05, 0.1, 0.5]),
+                            'exec_date': f'2020-05-01T10:{int(second) // 60:02d}:{int(second) % 60:02d}.'
+                                         f'{int(fraction * 1e7):07d}Z'})
+        messages.append(message)
+    return messages
+
+
+def raw_frames(snapshot, updates):
+    # JSON-RPC frames as received by ClientRPC.on_message.
+    frames = [json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {
+        'channel': f'lightning_board_snapshot_{PRODUCT}', 'message': snapshot}})]
+    frames.extend(json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {
+        'channel': f'lightning_board_{PRODUCT}', 'message': update}}) for update in updates)
+    return frames
+
+
+def recorded_board(path, product=PRODUCT):
+    # (snapshot, updates, raw frames) from a FrameRecorder log.
+    snapshot, updates, frames = None, [], []
+    for _, channel, payload in FrameReplayer(path).frames():
+        message = json.loads(payload)
+        if channel == '':
+            if not isinstance(message, dict) or message.get('method') != 'channelMessage':  # e.g. a batch of acks.
+                continue
+            frames.append(payload)
+            channel, message = message['params']['channel'], message['params']['message']
+        if channel == f'lightning_board_snapshot_{product}' and snapshot is None:
+            snapshot = message
+        elif channel == f'lightning_board_{product}' and snapshot is not None:
+            updates.append(message)
+    if snapshot is None:
+        raise ValueError(f'No {product} snapshot in {path}.')
+    if len(frames) == 0:
+        frames = raw_frames(snapshot, updates)
+    return snapshot, updates, frames
@@ -0,0 +1,258 @@
+# Benchmarks of the hot paths: order book updates and queries, order status and message decoding.
+#
+#   python benchmarks/run.py                         # synthetic fixtures, results saved in benchmarks/results/
+#   python benchmarks/run.py --recording session.rec # board messages recorded with FrameRecorder
+#   python benchmarks/run.py --compare benchmarks/results/<commit>.json
+#   python benchmarks/run.py --filter order_book.book_update
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from queue import Queue
+from time import perf_counter_ns, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fixtures  # noqa: E402
+from bitflyer.decoding import DECODERS, board_delta  # noqa: E402
+from bitflyer.handoff import Handoff  # noqa: E402
+from bitflyer.latency import LatencyTracker  # noqa: E402
+from bitflyer.ord_status import OrderStateStore, fetch_order_status  # noqa: E402
+from bitflyer.order_book import ENGINES, OrderBook  # noqa: E402
+from bitflyer.rpc import ClientRPC  # noqa: E402
+from bitflyer.trades import TradeAggregator  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+QUANTITIES = [0.01, 0.1, 0.5, 1, 2, 3, 5, 10, 25, 50]
+MEMORY_SAMPLE = 10_000  # tracemalloc is slow: the peak memory is measured on the first calls only.
+
+
+def _new_book(engine, snapshot):
+    ob = OrderBook(enable_qos=True, enable_statistics=True, engine=engine)
+    ob.snapshot_update(snapshot)
+    return ob
+
+
+def make_benchmarks(data):
+    # <name:factory>. A factory returns (step, inputs) with a fresh state: step(x) is timed for every x.
+    snapshot, updates, frames, order_events = data['snapshot'], data['updates'], data['frames'], data['order_events']
+    executions = data['executions']
+    benchmarks = {}
+    for engine in ENGINES:
+        def book_update(engine=engine):
+            return _new_book(engine, snapshot).book_update, updates
+
+        def snapshot_update(engine=engine):
+            return _new_book(engine, snapshot).snapshot_update, [snapshot] * 200
+
+        def liquidity_for(engine=engine):
+            ob = _new_book(engine, snapshot)
+
+            def step(_):
+                ob.bid_version += 1  # invalidates the depth curves, as an update of both sides would.
+                ob.ask_version += 1
+                ob.liquidity_for(QUANTITIES)
+
+            return step, range(5_000)
+
+        def update_then_liquidity(engine=engine):
+            # the strategy pattern: every update is followed by a query of the top of the book.
+            ob = _new_book(engine, snapshot)
+
+            def step(update):
+                ob.book_update(update)
+                ob.liquidity_for(1)
+
+            return step, updates
+
+        def best_bid_ask(engine=engine):
+            ob = _new_book(engine, snapshot)
+
+            def step(_):
+                return ob.best_bid, ob.best_ask
+
+            return step, range(100_000)
+
+        def apply_delta(engine=engine):
+            return _new_book(engine, snapshot).apply_delta, [board_delta(update) for update in updates]
+
+        benchmarks[f'order_book.book_update[{engine}]'] = book_update
+        benchmarks[f'order_book.snapshot_update[{engine}]'] = snapshot_update
+        benchmarks[f'order_book.liquidity_for[{engine}]'] = liquidity_for
+        benchmarks[f'order_book.update_then_liquidity[{engine}]'] = update_then_liquidity
+        benchmarks[f'order_book.best_bid_ask[{engine}]'] = best_bid_ask
+        benchmarks[f'order_book.apply_delta[{engine}]'] = apply_delta
+
+    def legacy_fetch_order_status():
+        def step(order_id):
+            return fetch_order_status(order_events, order_id)
+
+        return step, list(order_events)
+
+    def order_state_store():
+        store = OrderStateStore()
+        messages = [message for order in order_events.values() for message in order]
+        return store.update_one, messages
+
+    def rpc_on_message(decoder=None):
+        client = ClientRPC(decoder=decoder)
+        client.register_handler(lambda message: None)
+
+        def step(frame):
+            client.on_message(None, frame)
+
+        return step, frames
+
+    def decode_board_delta():
+        return board_delta, updates
+
+    def rpc_on_message_latency():
+        client = ClientRPC(latency=LatencyTracker())
+        client.register_handler(lambda message: None)
+
+        def step(frame):
+            client.on_message(None, frame)
+
+        return step, frames
+
+    def trade_aggregator_update():
+        return TradeAggregator().update, executions
+
+    def queue_put_get():
+        # one batch put by the receive thread and taken by the consumer.
+        queue = Queue()
+
+        def step(message):
+            queue.put(message)
+            queue.get()
+
+        return step, range(100_000)
+
+    def handoff_put_drain():
+        handoff = Handoff()
+
+        def step(message):
+            handoff.put(message)
+            handoff.drain()
+
+        return step, range(100_000)
+
+    benchmarks['ord_status.fetch_order_status'] = legacy_fetch_order_status
+    benchmarks['ord_status.OrderStateStore.update'] = order_state_store
+    benchmarks['rpc.ClientRPC.on_message'] = rpc_on_message
+    for decoder in DECODERS:
+        benchmarks[f'rpc.ClientRPC.on_message[{decoder}]'] = lambda decoder=decoder: rpc_on_message(decoder)
+    benchmarks['decoding.board_delta'] = decode_board_delta
+    benchmarks['rpc.ClientRPC.on_message[latency]'] = rpc_on_message_latency
+    benchmarks['trades.TradeAggregator.update'] = trade_aggregator_update
+    benchmarks['queue.Queue.put_get'] = queue_put_get
+    benchmarks['handoff.Handoff.put_drain'] = handoff_put_drain
+    return benchmarks
+
+
+def run_benchmark(factory):
+    step, inputs = factory()
+    latencies = np.empty(len(inputs), dtype=np.int64)
+    start = perf_counter_ns()
+    for i, x in enumerate(inputs):
+        t = perf_counter_ns()
+        step(x)
+        latencies[i] = perf_counter_ns() - t
+    elapsed = (perf_counter_ns() - start) / 1e9
+
+    step, inputs = factory()
+    tracemalloc.start()
+    for i, x in enumerate(inputs):
+        if i == MEMORY_SAMPLE:
+            break
+        step(x)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9]) / 1e3
+    return {
+        'calls': len(latencies),
+        'messages_per_sec': len(latencies) / elapsed,
+        'p50_us': p50,
+        'p90_us': p90,
+        'p99_us': p99,
+        'p999_us': p999,
+        'max_us': latencies.max() / 1e3,
+        'peak_memory_kb': peak_memory / 1024
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(RESULTS_DIR), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results, baseline=None):
+    header = f'{"benchmark":<46} {"msg/s":>12} {"p50 us":>9} {"p99 us":>9} {"p99.9 us":>9} {"peak KB":>9}'
+    if baseline is not None:
+        header += f' {"vs base":>8}'
+    print(header)
+    for name, r in results.items():
+        line = f'{name:<46} {r["messages_per_sec"]:>12,.0f} {r["p50_us"]:>9.2f} {r["p99_us"]:>9.2f} ' \
+               f'{r["p999_us"]:>9.2f} {r["peak_memory_kb"]:>9.1f}'
+        if baseline is not None and name in baseline:
+            line += f' {r["messages_per_sec"] / baseline[name]["messages_per_sec"]:>7.2f}x'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the bitflyer hot paths.')
+    parser.add_argument('--recording', help='FrameRecorder log to take the board messages from.')
+    parser.add_argument('--filter', default='', help='Only run the benchmarks whose name contains this.')
+    parser.add_argument('--updates', type=int, default=50_000, help='Number of synthetic board updates.')
+    parser.add_argument('--compare', help='Results file to compare with.')
+    parser.add_argument('--output', help='Where to save the results. Default: benchmarks/results/<commit>.json.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    if args.recording is not None:
+        snapshot, updates, frames = fixtures.recorded_board(args.recording)
+    else:
+        snapshot = fixtures.synthetic_snapshot()
+        updates = fixtures.synthetic_board_updates(args.updates)
+        frames = fixtures.raw_frames(snapshot, updates)
+    data = {'snapshot': snapshot, 'updates': updates, 'frames': frames,
+            'order_events': fixtures.synthetic_order_events(), 'executions': fixtures.synthetic_executions()}
+
+    results = {}
+    for name, factory in make_benchmarks(data).items():
+        if args.filter in name:
+            results[name] = run_benchmark(factory)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as r:
+            baseline = json.load(r)['results']
+    print_results(results, baseline)
+
+    if not args.no_save:
+        commit = git_commit()
+        output = args.output if args.output is not None else os.path.join(RESULTS_DIR, f'{commit}.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as w:
+            json.dump({
+                'commit': commit,
+                'timestamp': time(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'recording': args.recording,
+                'results': results
+            }, w, indent=2)
+        print(f'Results saved to {output}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+from bitflyer.decoding import get_decoder
+from bitflyer.reconnect import ReconnectManager
+from bitflyer.rpc import END_POINT, JSON_RPC_ID_AUTH, READY_TIMEOUT, Subscriptions, auth_params
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClientRPC:
+    # asyncio JSON-RPC client. Public and private channels share one connection and
+    # the handlers are called from the event loop, with no thread in between.
+    # Handlers take the channel message and can be plain functions or coroutines.
+
+    def __init__(self, key=None, secret=None, end_point=END_POINT, recorder=None, latency=None, decoder=None):
+        self.end_point = end_point
+        self.key = key
+        self.secret = secret
+        self.private_channels = []
+        self.public_channels = []
+        self.handler = None
+        self.handlers = {}  # <channel:handler>
+        self.subscriptions = Subscriptions()
+        self.ready = None
+        self.reconnect = ReconnectManager()
+        self.recorder = recorder  # FrameRecorder.
+        self.latency = latency  # LatencyTracker.
+        self.decode = get_decoder(decoder)  # fastest installed JSON decoder by default.
+        self._session = None
+        self._ws = None
+        self._closing = False
+
+    def register_channels(self, private_channels=(), public_channels=()):
+        self.private_channels = list(private_channels)
+        self.public_channels = list(public_channels)
+
+    def register_handler(self, handler, channel=None):
+        # channel=None: handler receives the messages of every channel without a dedicated handler.
+        if channel is None:
+            self.handler = handler
+        else:
+            self.handlers[channel] = handler
+
+    def register_disconnect_handler(self, handler):
+        self.reconnect.register_disconnect_handler(handler)
+
+    def register_reconnect_handler(self, handler):
+        self.reconnect.register_reconnect_handler(handler)
+
+    async def connect(self):
+        if self.ready is None:
+            self.ready = asyncio.Event()
+        self.ready.clear()
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        self._ws = await self._session.ws_connect(self.end_point, heartbeat=30)
+        logger.info('Websocket connected.')
+        self.reconnect.on_connected()
+        self.subscriptions.reset(self.public_channels + self.private_channels)
+        if len(self.public_channels) > 0:
+            await self._ws.send_str(json.dumps(self.subscriptions.subscribe_params(self.public_channels)))
+        if len(self.private_channels) > 0:
+            await self._ws.send_str(json.dumps(auth_params(self.key, self.secret)))
+
+    async def run(self):
+        # receives and dispatches the messages until the connection is closed.
+        if self._ws is None or self._ws.closed:
+            await self.connect()
+        async for msg in self._ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                await self.on_message(msg.data)
+            elif msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                break
+        logger.info('Websocket closed.')
+
+    async def run_forever(self):
+        # like run() but reconnects with backoff. Auth and subscriptions are sent again on each connection.
+        while not self._closing:
+            try:
+                await self.run()
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logger.warning(f'Websocket error: {e}.')
+            if self._closing:
+                break
+            self.ready.clear()
+            self.reconnect.on_disconnected()
+            delay = self.reconnect.next_delay()
+            logger.info(f'Reconnecting in {delay:.2f}s.')
+            await asyncio.sleep(delay)
+
+    async def start_and_wait_for_stream(self, wait_for_first_message=False, timeout=READY_TIMEOUT):
+        # starts receiving in a background task and returns it once every channel is subscribed
+        # (and has received a message if wait_for_first_message). Raises asyncio.TimeoutError after timeout
+        # seconds (None: no timeout) and SubscribeFailed if the server refused a subscription.
+        self.subscriptions.wait_for_first_message = wait_for_first_message
+        await self.connect()
+        task = asyncio.ensure_future(self.run_forever())
+        await asyncio.wait_for(self.ready.wait(), timeout)
+        self.subscriptions.check()
+        return task
+
+    async def on_message(self, message):
+        latency = self.latency
+        if latency is not None:
+            latency.on_receive()
+        if self.recorder is not None:
+            self.recorder.record(message)
+        messages = self.decode(message)
+        if latency is not None:
+            latency.on_decoded()
+        if isinstance(messages, list):  # responses to a batch.
+            for response in messages:
+                await self.on_response(response)
+            return
+        if 'id' in messages:
+            await self.on_response(messages)
+            return
+        if messages.get('method') != 'channelMessage':
+            return
+        params = messages['params']
+        if self.subscriptions.on_channel_message(params['channel']):
+            self._update_ready()
+        handler = self.handlers.get(params['channel'], self.handler)
+        if handler is not None:
+            try:
+                result = handler(params['message'])
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:  # a failing handler must not stop the receive loop, and the reconnects with it.
+                logger.exception(f'Handler failed ({params["channel"]}).')
+        if latency is not None:
+            latency.on_handled(params['message'])
+
+    async def on_response(self, response):
+        if response.get('id') == JSON_RPC_ID_AUTH:
+            if 'error' in response:
+                logger.error(f'auth error: {response["error"]}')
+            elif response.get('result'):
+                logger.info('auth success.')
+                await self._ws.send_str(json.dumps(self.subscriptions.subscribe_params(self.private_channels)))
+        elif self.subscriptions.on_response(response):
+            self._update_ready()
+
+    def _update_ready(self):
+        if self.subscriptions.ready and not self.ready.is_set():
+            self.reconnect.on_subscribed()
+        if self.subscriptions.done:
+            self.ready.set()
+
+    async def close(self):
+        self._closing = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
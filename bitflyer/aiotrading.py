@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+import urllib.parse
+
+import aiohttp
+from yarl import URL
+
+from bitflyer.rate_limit import classify
+from bitflyer.trading import ExecutionCache, OrderResult, QuoteResult, coalescing_key, \
+    executed_quantity_and_average_price, limit_order_params, market_order_params, not_sent_quote, order_status, \
+    position_quantity, wrap_new_order
+
+logger = logging.getLogger(__name__)
+
+API_URL = 'https://api.bitflyer.jp'
+
+
+class AsyncBitflyerRestAPI:
+    # asyncio counterpart of BitflyerRestAPI, with the same methods as coroutines.
+    # Requests share one aiohttp session: the connections stay open (keep-alive) and are reused,
+    # so an order does not pay for a TCP/TLS handshake. warm_up() opens them ahead of time.
+    #
+    #   async with AsyncBitflyerRestAPI(credentials={'apiKey': key, 'secret': secret}, timeout=1) as api:
+    #       await api.warm_up(2)
+    #       buy, sell = await asyncio.gather(api.create_limit_buy_order('FX_BTC_JPY', 0.01, bid),
+    #                                        api.create_limit_sell_order('FX_BTC_JPY', 0.01, ask))
+
+    def __init__(self, credentials={}, timeout=None, api_url=API_URL, pool_size=10, keepalive_timeout=60,
+                 scheduler=None, execution_cache=None):
+        self.api_key = credentials.get('apiKey')
+        self.api_secret = credentials.get('secret')
+        self.timeout = timeout
+        self.api_url = api_url
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._secret = self.api_secret.encode('utf-8') if self.api_secret is not None else None
+        self.scheduler = scheduler  # RequestScheduler, can be shared with a BitflyerRestAPI.
+        self.execution_cache = execution_cache if execution_cache is not None else ExecutionCache()
+        self._session = None
+
+    @property
+    def session(self):
+        # created on first use: aiohttp wants a running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def warm_up(self, connections=1):
+        # opens connections to the API concurrently, so that they are ready in the pool for the next requests.
+        await asyncio.gather(*[self.request('/v1/gethealth') for _ in range(connections)])
+
+    def _headers(self, method, path, body):
+        if self._secret is None:
+            return None
+        timestamp = str(time.time())
+        sign = hmac.new(self._secret, (timestamp + method + path + body).encode('utf-8'), hashlib.sha256).hexdigest()
+        return {
+            'ACCESS-KEY': self.api_key,
+            'ACCESS-TIMESTAMP': timestamp,
+            'ACCESS-SIGN': sign,
+            'Content-Type': 'application/json'
+        }
+
+    async def request(self, endpoint, method='GET', params=None):
+        if self.scheduler is None:
+            return await self._request(endpoint, method, params)
+        priority, buckets = classify(endpoint, method)
+        return await self.scheduler.call_async(lambda: self._request(endpoint, method, params), priority, buckets,
+                                               coalescing_key(endpoint, method, params))
+
+    async def _request(self, endpoint, method='GET', params=None):
+        # the query string and the body are encoded once, and are exactly what is signed.
+        if method == 'POST':
+            path, body = endpoint, json.dumps(params)
+        else:
+            path, body = endpoint + ('?' + urllib.parse.urlencode(params) if params else ''), ''
+        headers = self._headers(method, path, body)
+        try:
+            # encoded=True: aiohttp must not re-quote the signed query string.
+            async with self.session.request(method, URL(self.api_url + path, encoded=True), data=body or None,
+                                            headers=headers) as response:
+                content = await response.read()
+        except (aiohttp.ClientError, OSError) as e:
+            logger.error(f'{method} {endpoint} failed: {e}.')
+            raise
+        if len(content) == 0:
+            return ''
+        return json.loads(content)
+
+    async def ticker(self, **params):
+        return await self.request('/v1/ticker', params=params)
+
+    async def board(self, **params):
+        return await self.request('/v1/board', params=params)
+
+    async def executions(self, **params):
+        return await self.request('/v1/executions', params=params)
+
+    async def getchildorders(self, **params):
+        return await self.request('/v1/me/getchildorders', params=params)
+
+    async def getexecutions(self, **params):
+        return await self.request('/v1/me/getexecutions', params=params)
+
+    async def sendchildorder(self, **params):
+        return await self.request('/v1/me/sendchildorder', 'POST', params=params)
+
+    async def cancelchildorder(self, **params):
+        return await self.request('/v1/me/cancelchildorder', 'POST', params=params)
+
+    async def cancelallchildorders(self, **params):
+        return await self.request('/v1/me/cancelallchildorders', 'POST', params=params)
+
+    async def create_limit_buy_order(self, ticker, quantity, price, params={}):
+        return await self._create_order(limit_order_params(ticker, quantity, price, 'BUY', params))
+
+    async def create_limit_sell_order(self, ticker, quantity, price, params={}):
+        return await self._create_order(limit_order_params(ticker, quantity, price, 'SELL', params))
+
+    async def create_market_buy_order(self, ticker, quantity, params={}):
+        return await self._create_order(market_order_params(ticker, quantity, 'BUY'))
+
+    async def create_market_sell_order(self, ticker, quantity, params={}):
+        return await self._create_order(market_order_params(ticker, quantity, 'SELL'))
+
+    async def _create_order(self, order_params):
+        resp = await self.sendchildorder(**order_params)
+        try:
+            return wrap_new_order(resp)
+        except Exception:
+            return resp
+
+    async def fetch_order(self, order_id, symbol):
+        return await self.getchildorders(child_order_acceptance_id=order_id, product_code=symbol)
+
+    async def cancel_order(self, order_id, symbol, params={}):
+        return await self.cancelchildorder(product_code=symbol, child_order_acceptance_id=order_id)
+
+    @staticmethod
+    async def _result(action, order_id, coroutine):
+        try:
+            return OrderResult.of(action, order_id, response=await coroutine)
+        except Exception as e:
+            return OrderResult.of(action, order_id, exception=e)
+
+    async def cancel_orders(self, order_ids, symbol):
+        # cancels the acceptance ids concurrently. Returns one OrderResult per id, in order.
+        return list(await asyncio.gather(*[self._result('cancel', order_id, self.cancel_order(order_id, symbol))
+                                           for order_id in order_ids]))
+
+    async def cancel_all_orders(self, symbol):
+        return await self.cancelallchildorders(product_code=symbol)
+
+    async def replace_quote(self, symbol, quantity, bid_price=None, ask_price=None, cancel_ids=(),
+                            cancel_first=False, params={}):
+        # same as BitflyerRestAPI.replace_quote().
+        cancels = [self._result('cancel', order_id, self.cancel_order(order_id, symbol)) for order_id in cancel_ids]
+        if cancel_first:
+            cancels = list(await asyncio.gather(*cancels))
+            if not all(cancel.ok for cancel in cancels):
+                return not_sent_quote(cancels, bid_price, ask_price)
+        orders = []
+        if bid_price is not None:
+            orders.append(self._result('buy', None, self.create_limit_buy_order(symbol, quantity, bid_price, params)))
+        if ask_price is not None:
+            orders.append(self._result('sell', None, self.create_limit_sell_order(symbol, quantity, ask_price, params)))
+        if cancel_first:
+            orders = list(await asyncio.gather(*orders))
+        else:
+            results = await asyncio.gather(*cancels, *orders)
+            cancels, orders = list(results[:len(cancels)]), list(results[len(cancels):])
+        bid = orders.pop(0) if bid_price is not None else None
+        ask = orders.pop(0) if ask_price is not None else None
+        return QuoteResult(cancels=cancels, bid=bid, ask=ask)
+
+    async def fetch_executions(self, order_id, symbol):
+        # same as BitflyerRestAPI.fetch_executions().
+        before = None
+        while True:
+            page = await self.getexecutions(**self.execution_cache.page_params(order_id, symbol, before))
+            before = self.execution_cache.merge(order_id, page)
+            if before is None:
+                return self.execution_cache.executions(order_id)
+
+    async def fetch_order_status(self, order_id, symbol):  # does not handle partial fills.
+        order, trades = await asyncio.gather(self.fetch_order(order_id, symbol),
+                                             self.fetch_executions(order_id, symbol))
+        return order_status(order, trades)
+
+    async def fetch_executed_size(self, order_id, symbol):
+        return float(sum(float(trade['size']) for trade in await self.fetch_executions(order_id, symbol)))
+
+    async def fetch_executed_quantity_and_average_price(self, order_id, symbol):
+        return executed_quantity_and_average_price(await self.fetch_executions(order_id, symbol))
+
+    async def fetch_positions(self, symbol='FX_BTC_JPY'):
+        return await self.request('/v1/me/getpositions', params={'product_code': symbol})
+
+    async def get_positions(self):
+        return position_quantity(await self.fetch_positions('FX_BTC_JPY'))
@@ -0,0 +1,210 @@
+import logging
+import multiprocessing
+from collections import namedtuple
+from threading import Event, RLock, Thread
+from time import sleep, time
+
+from bitflyer.order_book import OrderBook
+from bitflyer.rpc import ClientRPC, END_POINT
+
+logger = logging.getLogger(__name__)
+
+# qos: OrderBook.qos, None unless enabled.
+BookTop = namedtuple('BookTop', ['product', 'best_bid', 'best_ask', 'mid_price', 'bids', 'asks', 'timestamp', 'qos'],
+                     defaults=[None])
+
+
+def board_channels(product):
+    return [f'lightning_board_snapshot_{product}', f'lightning_board_{product}']
+
+
+class BookFeed:
+    # order books of several products maintained over one JSON-RPC connection.
+    # publish(BookTop) is called at most once per publish_interval per product, and a product
+    # that changed is always published within publish_interval (bounded staleness).
+    # A valid book that did not change is published again every heartbeat_interval, so that a quiet
+    # book is not mistaken for a stale one (heartbeat_interval=None: no heartbeat).
+    # publish() is never called concurrently.
+
+    def __init__(self, products, publish, depth=10, publish_interval=0.01, engine='sorted_dict', end_point=END_POINT,
+                 latency=None, enable_qos=False, heartbeat_interval=1.0):
+        self.products = list(products)
+        self.books = {product: OrderBook(enable_qos=enable_qos, engine=engine) for product in self.products}
+        self.depth = depth
+        self.publish_interval = publish_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._publish = publish
+        self._last_publish = {product: 0.0 for product in self.products}
+        self._dirty = set()
+        # the books, _dirty and publish() are shared by the receive thread and the flush thread.
+        self._lock = RLock()
+        self.latency = latency  # LatencyTracker.
+        self.rpc = ClientRPC(end_point=end_point, latency=latency)
+        channels = []
+        for product in self.products:
+            snapshot_channel, board_channel = board_channels(product)
+            channels.extend([snapshot_channel, board_channel])
+            self.rpc.register_handler(self._snapshot_handler(product), channel=snapshot_channel)
+            self.rpc.register_handler(self._board_handler(product), channel=board_channel)
+        self.rpc.register_channels(public_channels=channels)
+        self.rpc.register_disconnect_handler(self._on_disconnect)
+
+    def start(self):
+        self.rpc.start_and_wait_for_stream()
+        if self.publish_interval > 0 or self.heartbeat_interval is not None:
+            Thread(target=self._flush_forever, daemon=True).start()
+
+    def stop(self):
+        self.rpc.close()
+
+    def top(self, product):
+        with self._lock:
+            book = self.books[product]
+            return BookTop(product=product,
+                           best_bid=book.best_bid,
+                           best_ask=book.best_ask,
+                           mid_price=book.mid_price,
+                           bids=book.bid_order_book.levels(self.depth),
+                           asks=book.ask_order_book.levels(self.depth),
+                           timestamp=time(),
+                           qos=book.qos if book.enable_qos else None)
+
+    def _snapshot_handler(self, product):
+        def on_snapshot(message):
+            with self._lock:
+                self.books[product].snapshot_update(message)
+                if self.latency is not None:
+                    self.latency.on_applied()
+                self._on_change(product)
+
+        return on_snapshot
+
+    def _board_handler(self, product):
+        def on_board(message):
+            with self._lock:
+                book = self.books[product]
+                book.book_update(message)
+                if self.latency is not None:
+                    self.latency.on_applied()
+                if book.snapshot_received:
+                    self._on_change(product)
+
+        return on_board
+
+    def _on_change(self, product):
+        # with the lock held.
+        now = time()
+        if now - self._last_publish[product] >= self.publish_interval:
+            self._last_publish[product] = now
+            self._dirty.discard(product)
+            self._publish(self.top(product))
+        else:
+            self._dirty.add(product)
+
+    def _flush_forever(self):
+        # publish_interval=0 publishes every change from the receive thread: only the heartbeats are left here.
+        periods = [self.publish_interval, self.heartbeat_interval]
+        period = min(p for p in periods if p is not None and p > 0)
+        while True:
+            sleep(period)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not publish the order books.')
+
+    def flush(self):
+        # publishes the books changed since their last publish, and the heartbeats of the valid books.
+        now = time()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for product in self.products:
+                if not self.books[product].snapshot_received:
+                    continue
+                heartbeat = self.heartbeat_interval is not None and \
+                    now - self._last_publish[product] >= self.heartbeat_interval
+                if product in dirty or heartbeat:
+                    self._last_publish[product] = now
+                    self._publish(self.top(product))
+
+    def _on_disconnect(self):
+        with self._lock:
+            for book in self.books.values():
+                book.on_disconnect()
+
+
+def _run_feed(products, queue, depth, publish_interval, engine, end_point, heartbeat_interval):
+    feed = BookFeed(products, queue.put, depth, publish_interval, engine, end_point,
+                    heartbeat_interval=heartbeat_interval)
+    feed.start()
+    Event().wait()
+
+
+class BookManager:
+    # subscribes to the boards of N products. processes=0 runs every book in this process,
+    # otherwise the products are sharded across worker processes that publish their top of book back.
+
+    def __init__(self, products, processes=0, depth=10, publish_interval=0.01, engine='sorted_dict',
+                 end_point=END_POINT, heartbeat_interval=1.0):
+        self.products = list(products)
+        self.processes = processes
+        self._tops = {}
+        self._feed = None
+        self._workers = []
+        if processes == 0:
+            self._feed = BookFeed(self.products, self._on_top, depth, publish_interval, engine, end_point,
+                                  heartbeat_interval=heartbeat_interval)
+        else:
+            self._queue = multiprocessing.Queue()
+            shards = [self.products[i::processes] for i in range(processes)]
+            for shard in shards:
+                if len(shard) == 0:
+                    continue
+                self._workers.append(multiprocessing.Process(
+                    target=_run_feed, args=(shard, self._queue, depth, publish_interval, engine, end_point,
+                                            heartbeat_interval),
+                    daemon=True))
+
+    def start(self):
+        if self._feed is not None:
+            self._feed.start()
+            return
+        for worker in self._workers:
+            worker.start()
+        Thread(target=self._consume, daemon=True).start()
+
+    def stop(self):
+        if self._feed is not None:
+            self._feed.stop()
+        for worker in self._workers:
+            worker.terminate()
+
+    def top(self, product, max_staleness=None):
+        # latest BookTop of product. None if not received yet or older than max_staleness seconds.
+        # A valid book is published at least every heartbeat_interval: max_staleness should be above it.
+        if product not in self.products:
+            raise KeyError(f'Unknown product: {product}. Subscribed: {self.products}.')
+        top = self._tops.get(product)
+        if top is None:
+            return None
+        if max_staleness is not None and time() - top.timestamp > max_staleness:
+            return None
+        return top
+
+    def best_bid_ask(self, product, max_staleness=None):
+        top = self.top(product, max_staleness)
+        if top is None:
+            return None, None
+        return top.best_bid, top.best_ask
+
+    def order_book(self, product):
+        # only available when the books run in this process.
+        if self._feed is None:
+            raise ValueError('The order books run in worker processes. Use top() instead.')
+        return self._feed.books[product]
+
+    def _on_top(self, top):
+        self._tops[top.product] = top
+
+    def _consume(self):
+        while True:
+            self._on_top(self._queue.get())
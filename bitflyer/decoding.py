@@ -0,0 +1,50 @@
+import json
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional.
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional.
+    ujson = None
+
+# <name:loads>, fastest first. orjson and ujson are only listed when installed.
+DECODERS = {}
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+if ujson is not None:
+    DECODERS['ujson'] = ujson.loads
+DECODERS['json'] = json.loads
+
+# a board message (delta or snapshot) as arrays: prices are int64, sizes float64. A zero size removes the level.
+BoardDelta = namedtuple('BoardDelta', ['mid_price', 'bid_prices', 'bid_sizes', 'ask_prices', 'ask_sizes'])
+
+
+def get_decoder(decoder=None):
+    # decoder: None (fastest installed), a name of DECODERS or a callable taking the raw frame.
+    if decoder is None:
+        return next(iter(DECODERS.values()))
+    if callable(decoder):
+        return decoder
+    if decoder not in DECODERS:
+        raise ValueError(f'Unknown or not installed JSON decoder: {decoder}. Available: {list(DECODERS)}.')
+    return DECODERS[decoder]
+
+
+def levels_to_arrays(levels):
+    n = len(levels)
+    prices = np.fromiter((level['price'] for level in levels), dtype=np.float64, count=n)
+    sizes = np.fromiter((level['size'] for level in levels), dtype=np.float64, count=n)
+    return prices.astype(np.int64), sizes
+
+
+def board_delta(message):
+    # decoded board message -> BoardDelta, for OrderBook.apply_delta() and OrderBook.snapshot_update().
+    bid_prices, bid_sizes = levels_to_arrays(message['bids'])
+    ask_prices, ask_sizes = levels_to_arrays(message['asks'])
+    return BoardDelta(message['mid_price'], bid_prices, bid_sizes, ask_prices, ask_sizes)
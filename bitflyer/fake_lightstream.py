@@ -0,0 +1,228 @@
+import asyncio
+import hmac
+import json
+import logging
+import random
+from hashlib import sha256
+from threading import Event, Thread
+from time import time
+
+import socketio
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PRIVATE_CHANNELS = ('child_order_events', 'parent_order_events')
+
+
+class FakeLightstream:
+    # local stand-in for the bitFlyer lightstream: JSON-RPC (ws://host:port/json-rpc) and
+    # Socket.IO (http://host:port) on the same port, with auth, subscribe and channel messages.
+    # It runs its own event loop in a background thread. Every method can be called from any thread.
+    #
+    #   server = FakeLightstream(key='key', secret='secret').start()
+    #   client = ClientRPC('key', 'secret', end_point=server.rpc_url)
+    #   server.publish('lightning_board_FX_BTC_JPY', {...})
+
+    def __init__(self, host='127.0.0.1', port=0, key=None, secret=None, seed=None):
+        self.host = host
+        self.port = port
+        self.key = key
+        self.secret = secret  # None: any credentials are accepted.
+        self.num_published = 0
+        self._random = random.Random(seed)  # which connections drop_connections() closes.
+        self._loop = None
+        self._runner = None
+        self._rpc_clients = {}  # <ws:{'authenticated': bool, 'channels': set}>
+        self._sio = socketio.AsyncServer(async_mode='aiohttp')
+        self._sio_clients = {}  # <sid:aiohttp request>
+        self._sio_authenticated = set()
+        self._sio_channels = {}  # <channel:set of sid>
+        self._started = Event()
+        self._sio.on('connect', self._on_sio_connect)
+        self._sio.on('auth', self._on_sio_auth)
+        self._sio.on('subscribe', self._on_sio_subscribe)
+        self._sio.on('disconnect', self._on_sio_disconnect)
+
+    @property
+    def rpc_url(self):
+        return f'ws://{self.host}:{self.port}/json-rpc'
+
+    @property
+    def socketio_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        Thread(target=self._run, daemon=True).start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        self._call(self._stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def publish(self, channel, message):
+        self._loop.call_soon_threadsafe(asyncio.ensure_future, self._publish(channel, message))
+
+    def play(self, messages, rate=None):
+        # messages: iterable of (channel, message). rate: messages per second, None: as fast as possible.
+        # Blocks until every message is sent.
+        return self._call(self._play(messages, rate))
+
+    def play_recording(self, replayer, speed=1.0):
+        # replays the channel messages of a FrameReplayer log with their original pacing divided by speed.
+        return self._call(self._play_recording(replayer, speed))
+
+    def drop_connections(self, fraction=1.0):
+        # closes the connections of a random fraction of the clients (disconnect storm).
+        return self._call(self._drop_connections(fraction))
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._started.set()
+        self._loop.run_forever()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get('/json-rpc', self._on_rpc_connection)
+        self._sio.attach(app)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def _stop(self):
+        await self._runner.cleanup()
+        # the background tasks of the Socket.IO server would be destroyed pending with the loop.
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _check_auth(self, params):
+        if self.secret is None:
+            return True
+        sign = hmac.new(self.secret.encode('utf-8'),
+                        ''.join([str(params.get('timestamp')), str(params.get('nonce'))]).encode('utf-8'),
+                        sha256).hexdigest()
+        return params.get('api_key') == self.key and hmac.compare_digest(sign, str(params.get('signature')))
+
+    async def _on_rpc_connection(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = self._rpc_clients[ws] = {'authenticated': False, 'channels': set()}
+        try:
+            async for msg in ws:
+                if msg.type != web.WSMsgType.TEXT:
+                    continue
+                requests = json.loads(msg.data)
+                is_batch = isinstance(requests, list)
+                responses = []
+                for r in requests if is_batch else [requests]:
+                    response = self._on_rpc_request(client, r)
+                    if response is not None and 'id' in r:
+                        responses.append(dict(response, jsonrpc='2.0', id=r['id']))
+                if is_batch and len(responses) > 0:  # a batch is answered with one array, as JSON-RPC 2.0.
+                    await ws.send_str(json.dumps(responses))
+                elif len(responses) > 0:
+                    await ws.send_str(json.dumps(responses[0]))
+        finally:
+            self._rpc_clients.pop(ws, None)
+        return ws
+
+    def _on_rpc_request(self, client, r):
+        method = r.get('method')
+        params = r.get('params', {})
+        if method == 'auth':
+            if self._check_auth(params):
+                client['authenticated'] = True
+                return {'result': True}
+            return {'error': {'code': -32600, 'message': 'Invalid signature.'}}
+        if method == 'subscribe':
+            channel = params['channel']
+            if channel in PRIVATE_CHANNELS and not client['authenticated']:
+                return {'error': {'code': -32600, 'message': 'Authentication required.'}}
+            client['channels'].add(channel)
+            return {'result': True}
+        if method == 'unsubscribe':
+            client['channels'].discard(params['channel'])
+            return {'result': True}
+        return {'error': {'code': -32601, 'message': f'Method not found: {method}.'}}
+
+    async def _on_sio_connect(self, sid, environ):
+        self._sio_clients[sid] = environ['aiohttp.request']
+
+    async def _on_sio_auth(self, sid, params):
+        if self._check_auth(params):
+            self._sio_authenticated.add(sid)
+            return (None,)
+        return ('Invalid signature.',)
+
+    async def _on_sio_subscribe(self, sid, channel):
+        if channel in PRIVATE_CHANNELS and sid not in self._sio_authenticated:
+            return
+        self._sio_channels.setdefault(channel, set()).add(sid)
+
+    async def _on_sio_disconnect(self, sid):
+        self._sio_clients.pop(sid, None)
+        self._sio_authenticated.discard(sid)
+        for sids in self._sio_channels.values():
+            sids.discard(sid)
+
+    async def _publish(self, channel, message):
+        self.num_published += 1
+        frame = json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage',
+                            'params': {'channel': channel, 'message': message}})
+        for ws, client in list(self._rpc_clients.items()):
+            if channel in client['channels'] and not ws.closed:
+                await ws.send_str(frame)
+        # AsyncServer.emit() of python-socketio 4.x passes coroutines to asyncio.wait(), which python 3.11 rejects.
+        # _emit_internal() is private: python-socketio is pinned to 4.6.0 (setup.py, requirements.txt).
+        for sid in list(self._sio_channels.get(channel, ())):
+            await self._sio._emit_internal(sid, channel, message, '/')
+
+    async def _play(self, messages, rate):
+        start = time()
+        num_messages = 0
+        for channel, message in messages:
+            if rate is not None:
+                delay = num_messages / rate - (time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._publish(channel, message)
+            num_messages += 1
+        return num_messages
+
+    async def _play_recording(self, replayer, speed):
+        start = time()
+        first_timestamp = None
+        num_messages = 0
+        for timestamp, channel, message in replayer.channel_messages():
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._publish(channel, message)
+            num_messages += 1
+        return num_messages
+
+    async def _drop_connections(self, fraction):
+        num_dropped = 0
+        for ws in list(self._rpc_clients):
+            if self._random.random() < fraction:
+                await ws.close()
+                num_dropped += 1
+        for sid, request in list(self._sio_clients.items()):
+            if self._random.random() < fraction:
+                # drops the TCP connection: a clean socketio disconnect would not make the client reconnect.
+                request.transport.close()
+                num_dropped += 1
+        logger.info(f'Dropped {num_dropped} connections.')
+        return num_dropped
@@ -0,0 +1,175 @@
+import logging
+from collections import OrderedDict, deque
+from queue import Empty
+from threading import Event
+from time import time
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'  # the producer waits for room. Nothing is lost but the receive thread stalls.
+DROP_OLDEST = 'drop_oldest'  # the oldest item is dropped to make room.
+CONFLATE = 'conflate'  # an item replaces the pending item of the same key (the latest value wins).
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, CONFLATE)
+
+
+class Handoff:
+    # bounded single producer / single consumer handoff, e.g. from the receive thread to a strategy thread.
+    # put() and get()/drain() rely on the atomic deque (OrderedDict for conflate) operations: no lock is
+    # taken, and an Event is only touched when the other side is waiting.
+    # Drop-in for the queue.Queue get()/get_nowait()/qsize()/empty() of the consumer.
+    #
+    #   handoff = Handoff(capacity=10_000, overflow='drop_oldest')
+    #   handoff.put(message)                             # receive thread.
+    #   messages = handoff.drain(max_n=100, timeout=1)   # strategy thread, up to 100 at once.
+    #   handoff.as_dict()                                # occupancy and drops: is the strategy keeping up?
+
+    def __init__(self, capacity=10_000, overflow=DROP_OLDEST, key=None):
+        # key: item -> conflation key, for overflow=conflate. None: every item conflates into the latest one.
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}. Available: {OVERFLOW_POLICIES}.')
+        self.capacity = capacity
+        self.overflow = overflow
+        self.key = key
+        if overflow == CONFLATE:
+            self._items = OrderedDict()
+        elif overflow == DROP_OLDEST:
+            self._items = deque(maxlen=capacity)  # append() drops the oldest item atomically.
+        else:
+            self._items = deque()
+        self._not_empty = Event()
+        self._not_full = Event()
+        self._consumer_waiting = False
+        self._producer_waiting = False
+        self.num_put = 0
+        self.num_taken = 0  # by the consumer.
+        self._num_dropped = 0
+        self.num_conflated = 0
+        self.num_blocked = 0  # puts that had to wait for room.
+        self.max_occupancy = 0
+        self._warned = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return len(self._items) == 0
+
+    @property
+    def num_dropped(self):
+        if self.overflow == DROP_OLDEST:
+            # the deque drops silently and the consumer can drain between a length check and the append:
+            # derived from the counts instead. Exact once put() and get()/drain() return.
+            return max(self.num_put - self.num_taken - len(self._items), 0)
+        return self._num_dropped
+
+    @property
+    def occupancy(self):
+        # in [0, 1].
+        return len(self._items) / self.capacity
+
+    def put(self, item):
+        items = self._items
+        n = len(items)
+        if self.overflow == DROP_OLDEST:
+            if n >= self.capacity and not self._warned:
+                self._warned = True
+                logger.warning(f'Handoff full ({self.capacity} items): dropping the oldest. The consumer is '
+                               f'too slow.')
+            items.append(item)
+        elif self.overflow == CONFLATE:
+            key = self.key(item) if self.key is not None else None
+            if key in items:
+                self.num_conflated += 1
+            elif n >= self.capacity:
+                try:
+                    items.popitem(last=False)
+                    self._num_dropped += 1
+                except KeyError:  # drained by the consumer since n was read: there is room now.
+                    pass
+            items[key] = item
+        else:
+            if n >= self.capacity:
+                self._wait_for_room()
+            items.append(item)
+        self.num_put += 1
+        n = len(items)
+        if n > self.max_occupancy:
+            self.max_occupancy = n
+        if self._consumer_waiting:
+            self._not_empty.set()
+
+    def _wait_for_room(self):
+        self.num_blocked += 1
+        while len(self._items) >= self.capacity:
+            # cleared before the flag is raised and the size checked: a pop in between sets it again.
+            self._not_full.clear()
+            self._producer_waiting = True
+            if len(self._items) >= self.capacity:
+                self._not_full.wait(1)
+            self._producer_waiting = False
+
+    def _pop(self):
+        # raises IndexError/KeyError when empty.
+        if self.overflow == CONFLATE:
+            item = self._items.popitem(last=False)[1]
+        else:
+            item = self._items.popleft()
+        self.num_taken += 1
+        if self._producer_waiting:
+            self._not_full.set()
+        return item
+
+    def _wait_for_item(self, timeout):
+        # True once an item is available, False on timeout.
+        deadline = None if timeout is None else time() + timeout
+        while len(self._items) == 0:
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._not_empty.clear()
+            self._consumer_waiting = True
+            if len(self._items) == 0:
+                self._not_empty.wait(remaining)
+            self._consumer_waiting = False
+        return True
+
+    def get(self, block=True, timeout=None):
+        # same as queue.Queue.get(): raises queue.Empty when there is no item (on timeout if block).
+        if len(self._items) == 0 and (not block or not self._wait_for_item(timeout)):
+            raise Empty
+        try:
+            return self._pop()
+        except (IndexError, KeyError):  # conflated away meanwhile, cannot happen with one consumer.
+            raise Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self, max_n=None, timeout=0):
+        # up to max_n items (all by default), oldest first. timeout: seconds to wait for the first item,
+        # None to wait forever. Returns [] on timeout.
+        if len(self._items) == 0 and (timeout == 0 or not self._wait_for_item(timeout)):
+            return []
+        n = len(self._items) if max_n is None else min(max_n, len(self._items))
+        items = []
+        try:
+            for _ in range(n):
+                items.append(self._pop())
+        except (IndexError, KeyError):
+            pass
+        return items
+
+    def as_dict(self):
+        return {
+            'occupancy': self.occupancy,
+            'size': len(self._items),
+            'max_size': self.max_occupancy,
+            'capacity': self.capacity,
+            'put': self.num_put,
+            'dropped': self.num_dropped,
+            'conflated': self.num_conflated,
+            'blocked': self.num_blocked
+        }
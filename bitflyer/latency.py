@@ -0,0 +1,263 @@
+import json
+import logging
+from calendar import timegm
+from functools import lru_cache
+from threading import Lock, Thread, local
+from time import sleep, strptime, time_ns
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# pipeline stages, in nanoseconds:
+# wire: exchange event_date/exec_date -> socket receive (includes the clock offset with the exchange).
+# decode: socket receive -> JSON decoded.
+# apply: JSON decoded -> OrderBook/OrderStateStore updated.
+# handler: updated (or decoded if there is no update) -> handler returned.
+# total: socket receive -> handler returned.
+STAGES = ('wire', 'decode', 'apply', 'handler', 'total')
+
+
+class LatencyHistogram:
+    # HDR-style histogram: values in [0, max_value] are counted in log-linear buckets with a relative
+    # error below 2 ** -(sub_bucket_bits - 1). Recording is O(1) and the memory is fixed.
+    # Not synchronised: record() from one thread only (LatencyTracker keeps one histogram per thread).
+
+    def __init__(self, max_value=60_000_000_000, sub_bucket_bits=7):
+        self.max_value = max_value
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._sub_bucket_half = self._sub_bucket_count >> 1
+        self.counts = [0] * (self._index(max_value) + 1)  # a list: incrementing a NumPy item costs ~10x more.
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.num_negatives = 0  # clocked before the exchange: the wire latency of a skewed clock.
+        self.num_overflows = 0
+
+    def _index(self, value):
+        if value < self._sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self._sub_bucket_count + (shift - 1) * self._sub_bucket_half + (value >> shift) - self._sub_bucket_half
+
+    def _value_at(self, index):
+        # highest value counted in the bucket index.
+        if index < self._sub_bucket_count:
+            return index
+        shift, sub_bucket = divmod(index - self._sub_bucket_count, self._sub_bucket_half)
+        shift += 1
+        return ((sub_bucket + self._sub_bucket_half + 1) << shift) - 1
+
+    def record(self, value):
+        # value: int (nanoseconds).
+        if value < 0:
+            self.num_negatives += 1
+            value = 0
+        elif value > self.max_value:
+            self.num_overflows += 1
+            value = self.max_value
+        if value < self._sub_bucket_count:
+            self.counts[value] += 1
+        else:
+            shift = value.bit_length() - self.sub_bucket_bits
+            self.counts[self._sub_bucket_count + (shift - 1) * self._sub_bucket_half + (value >> shift)
+                        - self._sub_bucket_half] += 1
+        self.count += 1
+        self.total += value
+        if self.count == 1:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        # q in [0, 100]. Returns the upper bound of the bucket holding the q-th percentile, 0 if empty.
+        if self.count == 0:
+            return 0
+        counts = np.array(self.counts)
+        rank = max(int(np.ceil(q / 100 * counts.sum())), 1)
+        index = int(np.searchsorted(np.cumsum(counts), rank))
+        return min(self._value_at(index), self.max)
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.num_negatives += other.num_negatives
+        self.num_overflows += other.num_overflows
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.num_negatives = 0
+        self.num_overflows = 0
+
+    def as_dict(self, percentiles=(50, 90, 99, 99.9)):
+        # in microseconds.
+        d = {'count': self.count, 'mean_us': self.mean / 1e3,
+             'min_us': (self.min or 0) / 1e3, 'max_us': (self.max or 0) / 1e3}
+        for q in percentiles:
+            d[f'p{q}_us'] = self.percentile(q) / 1e3
+        if self.num_negatives > 0:
+            d['negatives'] = self.num_negatives
+        return d
+
+
+@lru_cache(maxsize=1024)
+def _epoch_seconds(date_time):
+    return timegm(strptime(date_time, '%Y-%m-%dT%H:%M:%S'))
+
+
+def exchange_time_ns(date):
+    # '2020-05-01T10:00:00.1234567Z' (UTC, up to 7 fractional digits) -> nanoseconds since epoch.
+    # A UTC offset instead of the Z ('+00:00', '+09:00') is also accepted, as in the REST API dates.
+    # The seconds are cached: messages of the same second only parse the fraction.
+    seconds = _epoch_seconds(date[:19])
+    rest = date[19:]
+    if len(rest) >= 6 and rest[-6] in '+-':
+        offset = int(rest[-5:-3]) * 3600 + int(rest[-2:]) * 60
+        seconds -= offset if rest[-6] == '+' else -offset
+        rest = rest[:-6]
+    fraction = rest[1:].rstrip('Z')
+    if len(fraction) == 0:
+        return seconds * 1_000_000_000
+    return seconds * 1_000_000_000 + int(fraction[:9].ljust(9, '0'))
+
+
+def message_exchange_time_ns(message):
+    # exchange timestamp of a channel message: exec_date of executions, event_date of order events.
+    # None for the messages without one (board, snapshot).
+    if isinstance(message, list):
+        if len(message) == 0:
+            return None
+        message = message[-1]
+    if not isinstance(message, dict):
+        return None
+    date = message.get('exec_date') or message.get('event_date')
+    if date is None:
+        return None
+    return exchange_time_ns(date)
+
+
+class LatencyTracker:
+    # per-stage latency histograms of the messages of a client (see STAGES).
+    # The client calls on_receive(), on_decoded() and on_handled() around its handler.
+    # The handler calls on_applied() once the book/store is updated, if it updates one.
+    # Each thread records in its own histograms, merged when queried: one tracker can be shared by
+    # several clients and recording takes no lock.
+    #
+    #   latency = LatencyTracker()
+    #   client = ClientRPC(latency=latency)
+    #   latency.start_dump(interval=60)  # logs the histograms every minute.
+    #   latency.percentile('wire', 99), latency.percentile('total', 99)
+
+    def __init__(self, max_value=60_000_000_000, sub_bucket_bits=7):
+        self.max_value = max_value
+        self.sub_bucket_bits = sub_bucket_bits
+        self._stamps = local()  # stamps of the message in flight and histograms of the thread.
+        self._thread_histograms = []
+        self._lock = Lock()
+        self._dump_thread = None
+
+    def _new_thread_histograms(self):
+        histograms = {stage: LatencyHistogram(self.max_value, self.sub_bucket_bits) for stage in STAGES}
+        with self._lock:
+            self._thread_histograms.append(histograms)
+        self._stamps.histograms = histograms
+        return histograms
+
+    def on_receive(self, timestamp=None):
+        stamps = self._stamps
+        stamps.received = time_ns() if timestamp is None else timestamp
+        stamps.decoded = None
+        stamps.applied = None
+        if not hasattr(stamps, 'histograms'):
+            self._new_thread_histograms()
+
+    def on_decoded(self):
+        stamps = self._stamps
+        stamps.decoded = time_ns()
+        stamps.histograms['decode'].record(stamps.decoded - stamps.received)
+
+    def on_applied(self):
+        stamps = self._stamps
+        if getattr(stamps, 'received', None) is None:
+            return  # not called from an instrumented client.
+        stamps.applied = time_ns()
+        stamps.histograms['apply'].record(stamps.applied - (stamps.decoded or stamps.received))
+
+    def on_handled(self, message=None):
+        # message: the channel message, for its exchange timestamp (wire latency).
+        stamps = self._stamps
+        now = time_ns()
+        histograms = stamps.histograms
+        histograms['handler'].record(now - (stamps.applied or stamps.decoded or stamps.received))
+        histograms['total'].record(now - stamps.received)
+        if message is not None:
+            exchange_time = message_exchange_time_ns(message)
+            if exchange_time is not None:
+                histograms['wire'].record(stamps.received - exchange_time)
+        stamps.received = None
+
+    def histogram(self, stage):
+        # merged histogram of every thread.
+        merged = LatencyHistogram(self.max_value, self.sub_bucket_bits)
+        with self._lock:
+            for histograms in self._thread_histograms:
+                merged.merge(histograms[stage])
+        return merged
+
+    def percentile(self, stage, q):
+        # in nanoseconds.
+        return self.histogram(stage).percentile(q)
+
+    def as_dict(self):
+        d = {}
+        for stage in STAGES:
+            histogram = self.histogram(stage)
+            if histogram.count > 0:
+                d[stage] = histogram.as_dict()
+        return d
+
+    def reset(self):
+        with self._lock:
+            for histograms in self._thread_histograms:
+                for histogram in histograms.values():
+                    histogram.reset()
+
+    def dump(self, path=None):
+        # appends one JSON line to path, or logs it.
+        line = json.dumps(dict(self.as_dict(), timestamp=time_ns() / 1e9))
+        if path is None:
+            logger.info(f'Latency: {line}')
+        else:
+            with open(path, 'a') as w:
+                w.write(line + '\n')
+
+    def start_dump(self, interval=60, path=None, reset=True):
+        # dumps every interval seconds. reset=True: each dump covers the last interval only.
+        def dump_forever():
+            while True:
+                sleep(interval)
+                self.dump(path)
+                if reset:
+                    self.reset()
+
+        self._dump_thread = Thread(target=dump_forever, daemon=True)
+        self._dump_thread.start()
@@ -1,12 +1,18 @@
+import asyncio
 import json
 import logging
-from queue import Queue
+from enum import IntEnum
+from json.encoder import encode_basestring
+from threading import Condition
+from time import time
 
 import attr
-from iso8601 import iso8601
+import numpy as np
 
-from bitflyer.rpc import ClientRPC
-from bitflyer.socketio import WebSocketIO
+from bitflyer.handoff import Handoff
+from bitflyer.latency import exchange_time_ns
+from bitflyer.rpc import ClientRPC, END_POINT as RPC_END_POINT
+from bitflyer.socketio import WebSocketIO, END_POINT as SOCKETIO_END_POINT
 
 logger = logging.getLogger(__name__)
 
@@ -19,71 +25,410 @@ class CancelFailed(Exception):
     pass
 
 
-@attr.s
+class StatusCode(IntEnum):
+    OPEN = 0
+    FULLY_FILL = 1
+    PARTIAL_FILL = 2
+    CANCEL = 3
+    EXPIRE = 4
+    CANCEL_FAILED = 5
+
+    @property
+    def label(self):
+        return _STATUS_LABELS[self]
+
+    def __str__(self):
+        return _STATUS_LABELS[self]
+
+
+_STATUS_LABELS = ('open', 'full_fill', 'partial_fill', 'cancel', 'expire', 'cancel_failed')
+
+
+def _status_codes(statuses):
+    # a status or a list of them, as StatusCode or labels ('cancel'). Raises ValueError if unknown.
+    if isinstance(statuses, (str, int)):
+        statuses = (statuses,)
+    codes = []
+    for status in statuses:
+        if isinstance(status, str):
+            if status not in _STATUS_LABELS:
+                raise ValueError(f'Unknown order status: {status}. Available: {_STATUS_LABELS}.')
+            status = _STATUS_LABELS.index(status)
+        codes.append(StatusCode(status))
+    return tuple(codes)
+
+
+@attr.s(slots=True, frozen=True)
 class OrderStatus:
-    OPEN = 'open'
-    FULLY_FILL = 'full_fill'
-    PARTIAL_FILL = 'partial_fill'
-    CANCEL = 'cancel'
-    EXPIRE = 'expire'
-    CANCEL_FAILED = 'cancel_failed'
+    OPEN = StatusCode.OPEN
+    FULLY_FILL = StatusCode.FULLY_FILL
+    PARTIAL_FILL = StatusCode.PARTIAL_FILL
+    CANCEL = StatusCode.CANCEL
+    EXPIRE = StatusCode.EXPIRE
+    CANCEL_FAILED = StatusCode.CANCEL_FAILED
 
     order_id = attr.ib(type=str)
-    status = attr.ib(type=str)
+    status = attr.ib(type=StatusCode)
     avg_price = attr.ib(type=float)
     executed_quantity = attr.ib(type=float)
     outstanding_size = attr.ib(type=float)
     event_date = attr.ib(type=str)
 
     def __str__(self):
-        if self.outstanding_size is not None:
-            os = round(self.outstanding_size * 100000) / 100000
-        else:
-            os = 'N/A'
-        return f'Order status (id={self.order_id}, ' \
-               f'status={self.status}, ' \
-               f'event_date={self.event_date}, ' \
-               f'avg_px={round(self.avg_price * 100000) / 100000}, ' \
-               f'execQty={round(self.executed_quantity * 100000) / 100000}, ' \
-               f'outstandingSize={os})'
+        os = round(self.outstanding_size, 5) if self.outstanding_size is not None else 'N/A'
+        return f'Order status (id={self.order_id}, status={_STATUS_LABELS[self.status]}, ' \
+               f'event_date={self.event_date}, avg_px={round(self.avg_price, 5)}, ' \
+               f'execQty={round(self.executed_quantity, 5)}, outstandingSize={os})'
 
     def json(self):
-        return json.dumps({
-            'order_id': self.order_id,
-            'status': self.status,
-            'event_date': self.event_date,
-            'avg_price': self.avg_price,
-            'executed_quantity': self.executed_quantity,
-            'outstanding_size': self.outstanding_size
-        })
+        # same output as json.dumps() of the fields (status as its label), formatted directly.
+        # avg_price and executed_quantity are finite: sums of the executions.
+        os = repr(self.outstanding_size) if self.outstanding_size is not None else 'null'
+        ed = encode_basestring(self.event_date) if self.event_date is not None else 'null'
+        return f'{{"order_id": {encode_basestring(self.order_id)}, "status": "{_STATUS_LABELS[self.status]}", ' \
+               f'"event_date": {ed}, "avg_price": {self.avg_price!r}, ' \
+               f'"executed_quantity": {self.executed_quantity!r}, "outstanding_size": {os}}}'
+
+
+# columnar export of OrderStatus: to_records(). Acceptance ids are ASCII (JRF20200501-000000-000000).
+ORDER_STATUS_DTYPE = np.dtype([('order_id', 'S32'), ('status', 'i1'), ('avg_price', 'f8'),
+                               ('executed_quantity', 'f8'), ('outstanding_size', 'f8'), ('event_time', 'i8')])
+
+
+def to_records(order_statuses):
+    # OrderStatus -> NumPy record array of ORDER_STATUS_DTYPE, 65 bytes per order.
+    # outstanding_size: NaN if unknown. event_time: exchange time in ns, 0 if unknown.
+    records = np.empty(len(order_statuses), dtype=ORDER_STATUS_DTYPE)
+    records['order_id'] = [order_status.order_id for order_status in order_statuses]
+    records['status'] = [order_status.status for order_status in order_statuses]
+    records['avg_price'] = [order_status.avg_price for order_status in order_statuses]
+    records['executed_quantity'] = [order_status.executed_quantity for order_status in order_statuses]
+    records['outstanding_size'] = [order_status.outstanding_size if order_status.outstanding_size is not None
+                                   else np.nan for order_status in order_statuses]
+    records['event_time'] = [exchange_time_ns(order_status.event_date) if order_status.event_date else 0
+                             for order_status in order_statuses]
+    return records.view(np.recarray)
+
+
+_STATUS_BY_EVENT_TYPE = {
+    'ORDER': StatusCode.OPEN,
+    'CANCEL': StatusCode.CANCEL,
+    'CANCEL_FAILED': StatusCode.CANCEL_FAILED,
+    'EXECUTION': StatusCode.OPEN,
+    'EXPIRE': StatusCode.EXPIRE
+}
+
+
+def _resolve_status(status, executed_quantity, order_quantity, outstanding_size):
+    if float(executed_quantity) > 0:
+        status = OrderStatus.PARTIAL_FILL
+    if order_quantity is not None:
+        if abs(float(executed_quantity) - float(order_quantity)) < 1e-6:
+            status = OrderStatus.FULLY_FILL
+    else:
+        if outstanding_size == 0 and status == OrderStatus.OPEN:
+            status = OrderStatus.FULLY_FILL
+        else:
+            logger.warning('Could not fetch the order quantity. That means we never received the '
+                           'ORDER message but directly some executions. Bitflyer sometimes does this.'
+                           'Bug ahead.')
+    return status
+
+
+class _OrderState:
+    # dates are kept as exchange nanoseconds (ints): cheaper to parse and to keep than datetimes.
+    # The OrderStatus is only built when asked for, and cached until the next event.
+    __slots__ = ('order_id', 'status', 'resolved_status', 'order_quantity', 'outstanding_size',
+                 'executed_quantity', 'executed_value', 'last_date', 'last_event_date', 'last_status_date',
+                 'last_size_date', 'failed_messages', '_order_status')
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.status = None
+        self.resolved_status = None
+        self.order_quantity = None
+        self.outstanding_size = None
+        self.executed_quantity = 0
+        self.executed_value = 0
+        self.last_date = None
+        self.last_event_date = None
+        self.last_status_date = None
+        self.last_size_date = None
+        self.failed_messages = None
+        self._order_status = None
+
+    def apply(self, message):
+        # events can arrive out of order. Executions are additive so their order does not matter.
+        # For the rest, an event only wins over the events received so far if it is not older than them.
+        et = message['event_type']
+        ed = message['event_date']
+        date = exchange_time_ns(ed)
+        if self.last_date is None or date >= self.last_date:
+            self.last_date = date
+            self.last_event_date = ed
+        if et == 'ORDER_FAILED':
+            if self.failed_messages is None:
+                self.failed_messages = []
+            self.failed_messages.append(message)
+            return
+        if et == 'ORDER':
+            self.order_quantity = message.get('size')
+            if self.last_size_date is None or date >= self.last_size_date:
+                self.last_size_date = date
+                self.outstanding_size = self.order_quantity
+        elif et == 'EXECUTION':
+            self.executed_value += message['size'] * message['price']
+            self.executed_quantity += message['size']
+            if self.last_size_date is None or date >= self.last_size_date:
+                self.last_size_date = date
+                self.outstanding_size = message['outstanding_size']
+        status = _STATUS_BY_EVENT_TYPE.get(et)
+        if status is not None and (self.last_status_date is None or date >= self.last_status_date):
+            self.last_status_date = date
+            self.status = status
+        self.resolved_status = _resolve_status(self.status, self.executed_quantity, self.order_quantity,
+                                               self.outstanding_size)
+        self._order_status = None
+
+    @property
+    def order_status(self):
+        if self._order_status is None and self.resolved_status is not None:
+            executed_quantity = self.executed_quantity
+            avg_price = float(self.executed_value) / float(executed_quantity) if executed_quantity != 0 else 0
+            self._order_status = OrderStatus(
+                order_id=self.order_id,
+                event_date=self.last_event_date,
+                status=self.resolved_status,
+                avg_price=avg_price,
+                executed_quantity=executed_quantity,
+                outstanding_size=self.outstanding_size
+            )
+        return self._order_status
+
+
+class OrderStateStore:
+    # Keeps the state of every order up to date as the events arrive.
+    # Each event is applied in O(1) and status() returns the cached OrderStatus.
+    # Waiters, futures and listeners are woken directly by the thread feeding the events.
 
+    def __init__(self):
+        self._states = {}
+        self._cond = Condition()
+        self._version = 0
+        self._listeners = []
+        self._futures = {}  # <order_id:[(statuses, loop, future)]>
 
-class OrderEventsRPC:  # works the best.
+    def __contains__(self, order_id):
+        return order_id in self._states
 
-    def __init__(self, key, secret):
-        self.message_queue = Queue()
-        ws = ClientRPC(key, secret)
+    def __len__(self):
+        return len(self._states)
 
-        def on_ord_status(messages):
-            self.message_queue.put(messages)
+    def update(self, messages):
+        previous_by_order_id = {}
+        listening = len(self._listeners) > 0  # the previous OrderStatus is only built for the listeners.
+        with self._cond:
+            for message in messages:
+                # https://bf-lightning-api.readme.io/docs/realtime-child-order-events
+                # parent order events (no child id: TRIGGER, COMPLETE...) are not child order states.
+                order_id = message.get('child_order_acceptance_id')
+                if order_id is None:
+                    continue
+                state = self._states.get(order_id)
+                if state is None:
+                    state = self._states[order_id] = _OrderState(order_id)
+                if order_id not in previous_by_order_id:
+                    previous_by_order_id[order_id] = (state.resolved_status, state.failed_messages is not None,
+                                                      state.order_status if listening else None)
+                state.apply(message)
+            self._version += 1
+            self._cond.notify_all()
+        for order_id, (previous_status, failed, previous) in previous_by_order_id.items():
+            state = self._states.get(order_id)
+            if state is None:
+                continue
+            if state.failed_messages is not None:
+                if not failed:
+                    self._notify(order_id, previous)
+            elif state.resolved_status is not None and previous_status != state.resolved_status:
+                self._notify(order_id, previous)
+
+    def update_one(self, message):
+        self.update([message])
+
+    def status(self, order_id):
+        state = self._states.get(order_id)
+        if state is None:
+            return None
+        if state.failed_messages is not None:
+            raise OrderFailed(state.failed_messages)
+        return state.order_status
+
+    def to_records(self):
+        # statuses of the known orders, failed ones excluded, as a NumPy record array (see to_records()).
+        with self._cond:
+            order_statuses = [state.order_status for state in self._states.values()
+                              if state.failed_messages is None and state.resolved_status is not None]
+        return to_records(order_statuses)
+
+    def discard(self, order_id):
+        self._states.pop(order_id, None)
+
+    def wait_for(self, order_id, statuses, timeout=None):
+        # returns the order status as soon as it is in statuses.
+        # On timeout, returns the last known status (None if the order is unknown).
+        statuses = _status_codes(statuses)
+        deadline = None if timeout is None else time() + timeout
+        with self._cond:
+            while True:
+                order_status = self.status(order_id)
+                if order_status is not None and order_status.status in statuses:
+                    return order_status
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        return order_status
+                    self._cond.wait(remaining)
+
+    @property
+    def version(self):
+        return self._version
+
+    def wait_for_update(self, timeout=None, version=None):
+        # blocks until a batch of events is applied after version (default: now). Returns False on timeout.
+        with self._cond:
+            if version is None:
+                version = self._version
+            return self._cond.wait_for(lambda: self._version != version, timeout)
+
+    def future(self, order_id, statuses, loop=None):
+        # asyncio future resolved with the order status as soon as it is in statuses.
+        statuses = _status_codes(statuses)
+        loop = loop if loop is not None else asyncio.get_event_loop()
+        future = loop.create_future()
+        with self._cond:
+            self._futures.setdefault(order_id, []).append((statuses, loop, future))
+        self._notify_futures(order_id)
+        return future
+
+    def add_listener(self, callback):
+        # callback(order_id, previous_order_status, order_status) is called on every status transition.
+        # It runs on the thread receiving the events so it should return quickly.
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _notify(self, order_id, previous):
+        if order_id in self._futures:
+            self._notify_futures(order_id)
+        if len(self._listeners) == 0:
+            return
+        try:
+            order_status = self.status(order_id)
+        except OrderFailed:
+            order_status = None
+        for listener in list(self._listeners):
+            try:
+                listener(order_id, previous, order_status)
+            except Exception:
+                logger.exception('Order status listener failed.')
+
+    def _notify_futures(self, order_id):
+        with self._cond:
+            waiters = self._futures.get(order_id)
+            if waiters is None:
+                return
+            try:
+                order_status, error = self.status(order_id), None
+            except OrderFailed as e:
+                order_status, error = None, e
+            remaining = []
+            for statuses, loop, future in waiters:
+                if error is not None:
+                    loop.call_soon_threadsafe(_resolve_future, future, None, error)
+                elif order_status is not None and order_status.status in statuses:
+                    loop.call_soon_threadsafe(_resolve_future, future, order_status, None)
+                elif not future.done():
+                    remaining.append((statuses, loop, future))
+            if len(remaining) > 0:
+                self._futures[order_id] = remaining
+            else:
+                del self._futures[order_id]
+
+
+def _resolve_future(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class OrderEvents:
+
+    def __init__(self, latency=None, handoff=None):
+        # message_queue: the event batches for a consumer thread, get() or drain(). Default: the oldest
+        # batches are dropped past 100k pending (message_queue.as_dict() reports it); the store is always updated.
+        self.message_queue = handoff if handoff is not None else Handoff(capacity=100_000)
+        self.store = OrderStateStore()
+        self.latency = latency  # LatencyTracker.
+        self.ws = None
+        self._handlers = []
+
+    def register_handler(self, handler):
+        # handler(messages) receives the raw events too, after the store is updated (e.g. PositionTracker.update).
+        self._handlers.append(handler)
+
+    def register_disconnect_handler(self, handler):
+        # events can be missed while disconnected.
+        self.ws.register_disconnect_handler(handler)
+
+    def on_ord_status(self, messages):
+        # child and parent order events. Only the child ones update the store; the handlers and the queue get both.
+        try:
+            self.store.update(messages)
+        except Exception:
+            logger.exception(f'Could not apply the order events: {messages}.')
+        if self.latency is not None:
+            self.latency.on_applied()
+        for handler in self._handlers:
+            handler(messages)
+        self.message_queue.put(messages)
+
+    def fetch_order_status(self, order_id):
+        return self.store.status(order_id)
+
+    def wait_for(self, order_id, statuses, timeout=None):
+        return self.store.wait_for(order_id, statuses, timeout)
+
+    def wait_for_update(self, timeout=None, version=None):
+        return self.store.wait_for_update(timeout, version)
+
+
+class OrderEventsRPC(OrderEvents):  # works the best.
+
+    def __init__(self, key, secret, end_point=RPC_END_POINT, latency=None, handoff=None):
+        super().__init__(latency, handoff)
+        ws = self.ws = ClientRPC(key, secret, end_point=end_point, latency=latency)
 
         ws.register_channels(['child_order_events', 'parent_order_events'])
-        ws.register_handler(on_ord_status)
+        ws.register_handler(self.on_ord_status)
         ws.start_and_wait_for_stream()
 
 
-class OrderEventsSocketIO:  # does not seem to work well.
+class OrderEventsSocketIO(OrderEvents):  # does not seem to work well.
 
-    def __init__(self, key, secret):
-        self.message_queue = Queue()
-        ws = WebSocketIO('https://io.lightstream.bitflyer.com', key, secret)
+    def __init__(self, key, secret, end_point=SOCKETIO_END_POINT, latency=None, handoff=None):
+        super().__init__(latency, handoff)
+        ws = self.ws = WebSocketIO(end_point, key, secret, latency=latency)
         ws.start_auth()
 
-        def on_ord_status(messages):
-            self.message_queue.put(messages)
-
         for private_channel in ['child_order_events', 'parent_order_events']:
-            ws.register_handler(channel=private_channel, handler=on_ord_status)
+            ws.register_handler(channel=private_channel, handler=self.on_ord_status)
 
 
 def fetch_order_status(order_status_by_parent_order_id: dict, order_id: str):
@@ -92,7 +437,7 @@ def fetch_order_status(order_status_by_parent_order_id: dict, order_id: str):
     if order_id not in order_status_by_parent_order_id:
         return None
     messages = order_status_by_parent_order_id[order_id]
-    sorted_messages = sorted(messages, key=lambda tup: iso8601.parse_date(tup['event_date']))
+    sorted_messages = sorted(messages, key=lambda tup: exchange_time_ns(tup['event_date']))
     executed_quantity = 0
     executed_value = 0
     status = None
@@ -119,18 +464,7 @@ def fetch_order_status(order_status_by_parent_order_id: dict, order_id: str):
             outstanding_size = message['outstanding_size']
         elif et == 'EXPIRE':
             status = OrderStatus.EXPIRE
-    if float(executed_quantity) > 0:
-        status = OrderStatus.PARTIAL_FILL
-    if order_quantity is not None:
-        if abs(float(executed_quantity) - float(order_quantity)) < 1e-6:
-            status = OrderStatus.FULLY_FILL
-    else:
-        if outstanding_size == 0 and status == OrderStatus.OPEN:
-            status = OrderStatus.FULLY_FILL
-        else:
-            logger.warning('Could not fetch the order quantity. That means we never received the '
-                           'ORDER message but directly some executions. Bitflyer sometimes does this.'
-                           'Bug ahead.')
+    status = _resolve_status(status, executed_quantity, order_quantity, outstanding_size)
     avg_price = float(executed_value) / float(executed_quantity) if executed_quantity != 0 else 0
     return OrderStatus(
         order_id=order_id,
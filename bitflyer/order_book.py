@@ -1,45 +1,143 @@
 import logging
-from collections import deque
-from time import time
+from collections import namedtuple
 
 import numpy as np
 from sortedcontainers import SortedDict
 
+from bitflyer.decoding import BoardDelta, levels_to_arrays
+from bitflyer.price_ladder import PriceLadder
+from bitflyer.stats import BookStats, EwmaRate
+
 logger = logging.getLogger(__name__)
 
+DepthCurve = namedtuple('DepthCurve', ['prices', 'cum_size', 'cum_notional'])
+CURVE_LEVELS = 32  # levels of a depth curve built for a quantity, deepened 4x at a time while too shallow.
+
 
-class NumUpdatesPerSeconds:
+class NumUpdatesPerSeconds(EwmaRate):
+    # kept for backward compatibility, with its former signature. The rate is now an EwmaRate with the default
+    # half life: max_num_updates is accepted but no longer used.
 
     def __init__(self, max_num_updates=1000):
-        self.c = 0
+        super().__init__()
         self.max_num_updates = max_num_updates
-        self.timer = None
-        self.rate = 0
-        self.timer = None
 
-    def count(self):
-        if self.c == 0:
-            self.timer = time()
-        self.c += 1
-        if self.c == self.max_num_updates:
-            self.rate = self.c / (time() - self.timer)
-            self.c = 0
+
+def _diff_levels(book, prices, sizes):
+    current = dict(zip(*(a.tolist() for a in book.arrays())))
+    changes = []
+    for price, size in zip(prices.tolist(), sizes.tolist()):
+        if size == 0:
+            continue
+        if current.pop(price, None) != size:
+            changes.append({'price': price, 'size': size})
+    changes.extend({'price': price, 'size': 0} for price in current)
+    return changes
+
+
+class SortedBookSide(SortedDict):
+    # zero size levels are removed on update. The best price is cached and only
+    # recomputed when the best level itself is removed.
+
+    def __init__(self, is_bid=True):
+        super().__init__()
+        self.is_bid = is_bid
+        self._best = None
+        self._best_valid = True
+
+    @property
+    def best(self):
+        if not self._best_valid:
+            self._best = self.peekitem(-1 if self.is_bid else 0)[0] if len(self) > 0 else None
+            self._best_valid = True
+        return self._best
+
+    def set_level(self, price, size):
+        if size == 0:
+            if self.pop(price, None) is not None and price == self._best:
+                self._best_valid = False
+            return
+        self[price] = size
+        if self._best_valid:
+            best = self._best
+            if best is None or (price > best if self.is_bid else price < best):
+                self._best = price
+
+    def set_levels(self, prices, sizes):
+        for price, size in zip(prices.tolist(), sizes.tolist()):
+            self.set_level(price, size)
+
+    def levels(self, n=None):
+        # live levels, best first. n: only the n best levels.
+        items = self.items()
+        if n is None:
+            levels = list(items)
+        else:
+            levels = items[-n:] if self.is_bid else items[:n]
+        if self.is_bid:
+            levels.reverse()
+        return levels
+
+    def iter_levels(self):
+        # live levels, best first, lazily.
+        for price in (reversed(self) if self.is_bid else iter(self)):
+            yield price, self[price]
+
+    def load(self, prices, sizes, mid_price=None):
+        # replaces all the levels at once.
+        live = sizes != 0
+        self.clear()
+        self.update(zip(prices[live].tolist(), sizes[live].tolist()))
+        self._best_valid = False
+
+    def arrays(self, n=None):
+        # prices and sizes as arrays, best first. n: only the n best levels.
+        if n is not None:
+            levels = self.levels(n)
+            return (np.fromiter((price for price, _ in levels), dtype=np.int64, count=len(levels)),
+                    np.fromiter((size for _, size in levels), dtype=np.float64, count=len(levels)))
+        prices = np.fromiter(self.keys(), dtype=np.int64, count=len(self))
+        sizes = np.fromiter(self.values(), dtype=np.float64, count=len(self))
+        if self.is_bid:
+            return prices[::-1], sizes[::-1]
+        return prices, sizes
+
+    def needs_recenter(self, price):
+        return False
+
+    def recenter(self, price):
+        pass
+
+
+ENGINES = {
+    'sorted_dict': SortedBookSide,
+    'ladder': PriceLadder
+}
 
 
 class OrderBook:
 
-    def __init__(self, enable_qos=True, enable_statistics=True):
-        self.bid_order_book = SortedDict()
-        self.ask_order_book = SortedDict()
+    def __init__(self, enable_qos=True, enable_statistics=True, engine='sorted_dict'):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown order book engine: {engine}. Available: {list(ENGINES)}.')
+        self._book_side = ENGINES[engine]
+        self.engine = engine
+        self.bid_order_book = self._book_side(is_bid=True)
+        self.ask_order_book = self._book_side(is_bid=False)
         self.snapshot_received = False
-        self._cond_len = 1000
-        self._mid_price_cond = deque(maxlen=self._cond_len)
-        self._bid_ask_cond = deque(maxlen=self._cond_len)
+        # deltas received without a valid snapshot (startup, after a disconnect). They are not kept: the
+        # snapshots carry no sequence number to tell which deltas are newer, and the snapshot replaces them.
+        self.discarded_updates = 0
+        self._discarded_at_snapshot = 0
+        self.version = 0  # incremented on every book change.
+        self.bid_version = 0  # incremented when the bids change.
+        self.ask_version = 0  # incremented when the asks change.
+        self._depth_curves = {}  # <is_bid:(side version, DepthCurve, whole side)>
         self.best_adjusted_bid = None
         self.best_adjusted_ask = None
         self.mid_price = None
-        self.qos = 1.0  # 1.0: perfect synchronised stream, <0.9 degraded stream.
-        self.ups = NumUpdatesPerSeconds()
+        self.stats = BookStats()
+        self.ups = self.stats.updates
         self.enable_qos = enable_qos
         self.enable_statistics = enable_statistics
 
@@ -47,111 +145,203 @@ class OrderBook:
     def best_bid(self):
         if self.best_adjusted_bid is not None:
             return self.best_adjusted_bid
-        try:
-            i = -1
-            while True:
-                val = self.bid_order_book.peekitem(i)
-                if val[1] != 0:
-                    return val[0]
-                i -= 1
-        except IndexError:
-            return None
+        return self.bid_order_book.best
 
     @property
     def best_ask(self):
         if self.best_adjusted_ask is not None:
             return self.best_adjusted_ask
-        try:
-            i = 0
-            while True:
-                val = self.ask_order_book.peekitem(i)
-                if val[1] != 0:
-                    return val[0]
-                i += 1
-        except IndexError:
-            return None
+        return self.ask_order_book.best
+
+    @property
+    def qos(self):
+        return self.stats.qos
 
     def updates_per_second(self):
         return self.ups.rate
 
-    def liquidity_for(self, quantity: float):
-        if not self.snapshot_received:
-            return 0, 0, 0, 0
-        bid_total_value = 0
-        bid_total_quantity = 0
-        level_price = 0
-        for i in range(-1, -len(self.bid_order_book), -1):
-            level_price, liquidity = self.bid_order_book.peekitem(i)
-            if bid_total_quantity < quantity:
-                bid_total_value += level_price * liquidity
-                bid_total_quantity += liquidity
-            else:
-                break
-        bid_average_price = int(bid_total_value / bid_total_quantity)
-        bid_lowest_price = level_price
-
-        ask_total_value = 0
-        ask_total_quantity = 0
-        for i in range(len(self.ask_order_book)):
-            level_price, liquidity = self.ask_order_book.peekitem(i)
-            if ask_total_quantity < quantity:
-                ask_total_value += level_price * liquidity
-                ask_total_quantity += liquidity
-            else:
+    def depth_curve(self, is_bid=True, quantity=None):
+        # cumulative size and notional from the best level outwards. quantity: the curve only goes as deep as
+        # needed to fill it (the whole side if None). Cached until that side changes.
+        version = self.bid_version if is_bid else self.ask_version
+        cached = self._depth_curves.get(is_bid)
+        num_levels = CURVE_LEVELS
+        if cached is not None and cached[0] == version:
+            _, curve, whole_side = cached
+            if whole_side or (quantity is not None and len(curve.cum_size) > 0 and curve.cum_size[-1] >= quantity):
+                return curve
+            num_levels = 4 * len(curve.prices)
+        book = self.bid_order_book if is_bid else self.ask_order_book
+        while True:
+            prices, sizes = book.arrays(None if quantity is None else num_levels)
+            whole_side = quantity is None or len(prices) < num_levels
+            curve = DepthCurve(prices=prices, cum_size=np.cumsum(sizes), cum_notional=np.cumsum(prices * sizes))
+            if whole_side or curve.cum_size[-1] >= quantity:
                 break
-        ask_average_price = int(ask_total_value / ask_total_quantity)
-        ask_highest_price = level_price
+            num_levels *= 4
+        self._depth_curves[is_bid] = (version, curve, whole_side)
+        return curve
+
+    def liquidity_for(self, quantity):
+        # quantity: a float or a list of floats.
+        # Returns the average and worst prices to trade quantity on each side.
+        # If a side is too thin, the whole side is used. An empty side returns 0.
+        is_scalar = np.ndim(quantity) == 0
+        if is_scalar:
+            if not self.snapshot_received:
+                return 0, 0, 0, 0
+            bid_average_price, bid_lowest_price = self._walk_levels(self.bid_order_book, quantity)
+            ask_average_price, ask_highest_price = self._walk_levels(self.ask_order_book, quantity)
+            return bid_average_price, ask_average_price, bid_lowest_price, ask_highest_price
+        quantities = np.atleast_1d(np.asarray(quantity, dtype=np.float64))
+        if not self.snapshot_received:
+            zeros = np.zeros(len(quantities), dtype=np.int64)
+            bid_average_price = ask_average_price = bid_lowest_price = ask_highest_price = zeros
+        else:
+            max_quantity = float(quantities.max()) if len(quantities) > 0 else 0.0
+            bid_average_price, bid_lowest_price = self._walk_depth_curve(
+                self.depth_curve(is_bid=True, quantity=max_quantity), quantities)
+            ask_average_price, ask_highest_price = self._walk_depth_curve(
+                self.depth_curve(is_bid=False, quantity=max_quantity), quantities)
         return bid_average_price, ask_average_price, bid_lowest_price, ask_highest_price
 
-    def snapshot_update(self, snapshot):
+    @staticmethod
+    def _walk_levels(book, quantity):
+        # one quantity: walks from the best level, no deeper than needed. Same result as _walk_depth_curve.
+        total_size = total_notional = price = 0
+        for price, size in book.iter_levels():
+            total_size += size
+            total_notional += price * size
+            if total_size >= quantity:
+                break
+        if total_size == 0:
+            return 0, 0
+        return int(total_notional / total_size), int(price)
+
+    @staticmethod
+    def _walk_depth_curve(curve, quantities):
+        num_levels = len(curve.prices)
+        if num_levels == 0:
+            zeros = np.zeros(len(quantities), dtype=np.int64)
+            return zeros, zeros
+        # index of the last level needed to fill each quantity.
+        i = np.minimum(np.searchsorted(curve.cum_size, quantities, side='left'), num_levels - 1)
+        average_price = (curve.cum_notional[i] / curve.cum_size[i]).astype(np.int64)
+        return average_price, curve.prices[i].astype(np.int64)
+
+    def snapshot_update(self, snapshot, diff=False):
+        # snapshot: the message as received or a BoardDelta. The levels are loaded in bulk.
+        # Per level statistics are skipped.
+        # diff=True returns the levels that changed, in the same format as a book update.
+        self.version += 1
+        self.bid_version += 1
+        self.ask_version += 1
         if self.enable_statistics:
             self.ups.count()
         self.best_adjusted_bid = None
         self.best_adjusted_ask = None
-        self.mid_price = snapshot['mid_price']
-        self.bid_order_book = SortedDict()
-        self.ask_order_book = SortedDict()
-        for bid in snapshot['bids']:
-            self._single_book_update(bid['price'], bid['size'], is_bid=True)
-        for ask in snapshot['asks']:
-            self._single_book_update(ask['price'], ask['size'], is_bid=False)
-        assert self.best_bid <= snapshot['mid_price'] <= self.best_ask
+        if isinstance(snapshot, BoardDelta):
+            self.mid_price = snapshot.mid_price
+            bid_prices, bid_sizes = snapshot.bid_prices, snapshot.bid_sizes
+            ask_prices, ask_sizes = snapshot.ask_prices, snapshot.ask_sizes
+        else:
+            self.mid_price = snapshot['mid_price']
+            bid_prices, bid_sizes = levels_to_arrays(snapshot['bids'])
+            ask_prices, ask_sizes = levels_to_arrays(snapshot['asks'])
+        if self.discarded_updates > self._discarded_at_snapshot:
+            logger.info(f'Snapshot received. {self.discarded_updates - self._discarded_at_snapshot} updates were '
+                        f'discarded while waiting for it.')
+            self._discarded_at_snapshot = self.discarded_updates
+        changes = None
+        if diff:
+            changes = {
+                'mid_price': self.mid_price,
+                'bids': _diff_levels(self.bid_order_book, bid_prices, bid_sizes),
+                'asks': _diff_levels(self.ask_order_book, ask_prices, ask_sizes)
+            }
+        self.bid_order_book.load(bid_prices, bid_sizes, self.mid_price)
+        self.ask_order_book.load(ask_prices, ask_sizes, self.mid_price)
+        assert self.best_bid <= self.mid_price <= self.best_ask
         self.snapshot_received = True
+        return changes
 
     def _single_book_update(self, price, size, is_bid=True):
-        if self.enable_statistics:
-            self.ups.count()
         price = int(price)
-        book = self.bid_order_book if is_bid else self.ask_order_book
-        book[price] = size
+        if is_bid:
+            self.bid_version += 1
+            self.bid_order_book.set_level(price, size)
+        else:
+            self.ask_version += 1
+            self.ask_order_book.set_level(price, size)
+
+    def on_disconnect(self):
+        # deltas were missed: the book is invalid until the next snapshot.
+        self.snapshot_received = False
 
     def book_update(self, update: dict):
+        if not self.snapshot_received:
+            self.discarded_updates += 1
+            return
+        bids, asks, mid_price = update['bids'], update['asks'], update['mid_price']
+        self._begin_update(mid_price, len(bids) + len(asks))
+        if len(bids) > 0:
+            self.bid_version += 1
+            set_level = self.bid_order_book.set_level
+            for bid in bids:
+                set_level(int(bid['price']), bid['size'])
+        if len(asks) > 0:
+            self.ask_version += 1
+            set_level = self.ask_order_book.set_level
+            for ask in asks:
+                set_level(int(ask['price']), ask['size'])
+        self._end_update(mid_price)
+
+    def apply_delta(self, delta: BoardDelta):
+        # same as book_update() for a delta already decoded into arrays: the levels of each side are set in bulk.
+        if not self.snapshot_received:
+            self.discarded_updates += 1
+            return
+        self._begin_update(delta.mid_price, len(delta.bid_prices) + len(delta.ask_prices))
+        if len(delta.bid_prices) > 0:
+            self.bid_version += 1
+            self.bid_order_book.set_levels(delta.bid_prices, delta.bid_sizes)
+        if len(delta.ask_prices) > 0:
+            self.ask_version += 1
+            self.ask_order_book.set_levels(delta.ask_prices, delta.ask_sizes)
+        self._end_update(delta.mid_price)
+
+    def _begin_update(self, mid_price, num_levels):
+        self.version += 1
         self.best_adjusted_bid = None
         self.best_adjusted_ask = None
-        self.mid_price = update['mid_price']
-        for bid in update['bids']:
-            self._single_book_update(bid['price'], bid['size'], is_bid=True)
-        for ask in update['asks']:
-            self._single_book_update(ask['price'], ask['size'], is_bid=False)
+        self.mid_price = mid_price
+        if self.bid_order_book.needs_recenter(mid_price):
+            self.bid_order_book.recenter(mid_price)
+        if self.ask_order_book.needs_recenter(mid_price):
+            self.ask_order_book.recenter(mid_price)
+        if self.enable_statistics:
+            self.ups.count(num_levels)
 
+    def _end_update(self, mid_price):
+        # the adjusted prices were reset by _begin_update(): the best prices are the ones of the book sides.
+        best_bid = self.bid_order_book.best
+        best_ask = self.ask_order_book.best
         if self.enable_qos:
-            self._mid_price_cond.append(self.best_bid <= update["mid_price"] <= self.best_ask)
-            self._bid_ask_cond.append(self.best_bid <= self.best_ask)
+            self.stats.mid_price.append(best_bid <= mid_price <= best_ask)
+            self.stats.bid_ask.append(best_bid <= best_ask)
 
         # It should never happen in practice.
         # But sometimes the messages don't arrive sequentially.
-        if self.best_bid >= update["mid_price"]:
-            self.best_adjusted_bid = update["mid_price"] - 1
-        if update["mid_price"] >= self.best_ask:
-            self.best_adjusted_ask = update["mid_price"] + 1
-        if self.best_bid >= self.best_ask:
-            self.best_adjusted_bid = update["mid_price"] - 1
-        if self.best_ask <= self.best_bid:
-            self.best_adjusted_ask = update["mid_price"] + 1
-        assert self.best_bid < self.best_ask
-        assert self.best_bid <= update["mid_price"] <= self.best_ask
-        if self.enable_qos and len(self._mid_price_cond) == self._cond_len:
-            self.qos = (0.5 * np.mean(self._bid_ask_cond) + 0.5 * np.mean(self._mid_price_cond))
+        if best_bid >= mid_price:
+            best_bid = self.best_adjusted_bid = mid_price - 1
+        if mid_price >= best_ask:
+            best_ask = self.best_adjusted_ask = mid_price + 1
+        if best_bid >= best_ask:
+            best_bid = self.best_adjusted_bid = mid_price - 1
+        if best_ask <= best_bid:
+            best_ask = self.best_adjusted_ask = mid_price + 1
+        assert best_bid < best_ask
+        assert best_bid <= mid_price <= best_ask
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+import logging
+from collections import deque
+from threading import Event, Lock, Thread
+from time import time
+
+from bitflyer.trading import position_quantity_and_average_price
+
+logger = logging.getLogger(__name__)
+
+
+class PositionTracker:
+    # net position, average entry price and PnL of one product, kept up to date from the EXECUTION
+    # events of child_order_events. Reading them is a memory read, no REST call.
+    # REST is only used to reconcile: every reconcile_interval seconds, and right away after a disconnect
+    # of the event stream (executions may have been missed).
+    #
+    #   tracker = PositionTracker('FX_BTC_JPY', order_book=ticker.order_book)
+    #   order_events.register_handler(tracker.update)
+    #   order_events.register_disconnect_handler(tracker.request_reconcile)
+    #   tracker.start_reconcile(rest_api, interval=60)
+    #   tracker.position, tracker.unrealized_pnl()
+
+    def __init__(self, product='FX_BTC_JPY', order_book=None, tolerance=1e-8, max_exec_ids=10_000):
+        self.product = product
+        self.order_book = order_book  # its mid price values the open position.
+        self.tolerance = tolerance  # position drift tolerated before REST is trusted over the events.
+        self.position = 0.0  # signed: > 0 long, < 0 short.
+        self.average_price = 0.0  # of the open position.
+        self.realized_pnl = 0.0
+        self.commission = 0.0  # as reported by the executions.
+        self.num_executions = 0
+        self.num_corrections = 0
+        self.last_reconcile = None
+        self._exec_ids = set()  # executions can be delivered twice around a reconnection.
+        self._exec_id_order = deque()
+        self._max_exec_ids = max_exec_ids
+        self._lock = Lock()
+        self._reconcile_requested = Event()
+
+    def update(self, messages):
+        # messages: a list of child order events. Only the executions of this product are used.
+        for message in messages:
+            if message.get('event_type') == 'EXECUTION' and message.get('product_code', self.product) == self.product:
+                self.on_execution(message)
+
+    def on_execution(self, message):
+        exec_id = message.get('exec_id')
+        with self._lock:
+            if exec_id is not None:
+                if exec_id in self._exec_ids:
+                    return
+                self._exec_ids.add(exec_id)
+                self._exec_id_order.append(exec_id)
+                if len(self._exec_id_order) > self._max_exec_ids:
+                    self._exec_ids.discard(self._exec_id_order.popleft())
+            size = message['size'] if message['side'] == 'BUY' else -message['size']
+            self._fill(size, message['price'])
+            self.commission += message.get('commission') or 0
+            self.num_executions += 1
+
+    def _fill(self, size, price):
+        position = self.position
+        if position == 0 or (position > 0) == (size > 0):
+            # opens or increases the position.
+            self.average_price = (self.average_price * abs(position) + price * abs(size)) / (abs(position) + abs(size))
+            self.position = round(position + size, 8)
+            return
+        # reduces, closes or flips the position.
+        closed = min(abs(size), abs(position))
+        self.realized_pnl += closed * (price - self.average_price) * (1 if position > 0 else -1)
+        self.position = round(position + size, 8)
+        if self.position == 0:
+            self.average_price = 0.0
+        elif (self.position > 0) != (position > 0):
+            self.average_price = price
+
+    def unrealized_pnl(self, mid_price=None):
+        # mid_price: default to the mid of order_book.
+        if mid_price is None:
+            mid_price = self.order_book.mid_price if self.order_book is not None else None
+        if mid_price is None or self.position == 0:
+            return 0.0
+        return self.position * (mid_price - self.average_price)
+
+    def total_pnl(self, mid_price=None):
+        return self.realized_pnl + self.unrealized_pnl(mid_price)
+
+    def reconcile(self, rest_api):
+        # compares with the positions of REST. If they differ by more than the tolerance, REST wins.
+        # Returns the drift (REST - local) found, None if executions came in during the REST call:
+        # REST may or may not include them, the comparison is left to the next reconcile.
+        num_executions = self.num_executions
+        positions = rest_api.fetch_positions(self.product)
+        position, average_price = position_quantity_and_average_price(positions)
+        with self._lock:
+            if self.num_executions != num_executions:
+                return None
+            drift = round(position - self.position, 8)
+            self.last_reconcile = time()
+            if abs(drift) > self.tolerance:
+                logger.warning(f'{self.product} position drift: local={self.position}, REST={position}. '
+                               f'Using the REST position.')
+                self.position = position
+                self.average_price = average_price
+                self.num_corrections += 1
+        return drift
+
+    def request_reconcile(self):
+        # reconciles now instead of at the next interval (e.g. on a disconnect of the event stream).
+        self._reconcile_requested.set()
+
+    def start_reconcile(self, rest_api, interval=60):
+        def reconcile_forever():
+            while True:
+                self._reconcile_requested.wait(interval)
+                self._reconcile_requested.clear()
+                try:
+                    self.reconcile(rest_api)
+                except Exception as e:
+                    logger.warning(f'Could not reconcile the {self.product} position: {e}.')
+
+        Thread(target=reconcile_forever, daemon=True).start()
+
+    def as_dict(self):
+        return {
+            'product': self.product,
+            'position': self.position,
+            'average_price': self.average_price,
+            'realized_pnl': self.realized_pnl,
+            'unrealized_pnl': self.unrealized_pnl(),
+            'commission': self.commission,
+            'executions': self.num_executions,
+            'corrections': self.num_corrections
+        }
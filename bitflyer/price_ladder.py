@@ -0,0 +1,247 @@
+import numpy as np
+from sortedcontainers import SortedDict
+
+BULK_MIN_LEVELS = 64  # set_levels() below this size loops over set_level(): NumPy calls cost more than they save.
+WALK_CELLS = 256  # iter_levels() walks this many cells from the best one in Python before scanning the rest.
+
+
+class PriceLadder:
+    # One side of the book stored as an array of sizes indexed by (price - anchor).
+    # Prices are integers (1 yen tick). Levels falling outside the ladder are kept in a small SortedDict
+    # until the ladder is re-centered around them.
+
+    def __init__(self, is_bid=True, size=1 << 16):
+        self.is_bid = is_bid
+        self.size = size
+        self.sizes = np.zeros(size, dtype=np.float64)  # also seen through a memoryview by set_level().
+        self.anchor = None  # price of index 0.
+        self._recenter_bounds = (float('-inf'), float('inf'))  # needs_recenter() outside, set with the anchor.
+        self.overflow = SortedDict()
+        self._overflow_best = None
+        self._best = -1  # index of the best level in the ladder. -1 when the ladder is empty.
+        self._best_price = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count + len(self.overflow)
+
+    @property
+    def sizes(self):
+        return self._sizes
+
+    @sizes.setter
+    def sizes(self, sizes):
+        self._sizes = sizes
+        # single levels are read and written as Python floats: about half the cost of NumPy scalars.
+        self._cells = memoryview(sizes)
+
+    @property
+    def best(self):
+        return self._best_price
+
+    def _refresh_best(self):
+        ladder_best = self.anchor + self._best if self._best >= 0 else None
+        overflow_best = self._overflow_best
+        if overflow_best is None:
+            self._best_price = ladder_best
+        elif ladder_best is None:
+            self._best_price = overflow_best
+        else:
+            self._best_price = max(ladder_best, overflow_best) if self.is_bid else min(ladder_best, overflow_best)
+
+    def set_level(self, price, size):
+        if self.anchor is None:
+            self._set_anchor(price - self.size // 2)
+        i = price - self.anchor
+        if i < 0 or i >= self.size:
+            if size == 0:
+                self.overflow.pop(price, None)
+            else:
+                self.overflow[price] = size
+            if len(self.overflow) == 0:
+                self._overflow_best = None
+            else:
+                self._overflow_best = self.overflow.peekitem(-1 if self.is_bid else 0)[0]
+            self._refresh_best()
+            return
+        cells = self._cells
+        previous_size = cells[i]
+        cells[i] = size
+        if size != 0:
+            if previous_size == 0:
+                self._count += 1
+                best = self._best
+                if best < 0 or (i > best if self.is_bid else i < best):
+                    self._best = i
+                    self._refresh_best()
+        elif previous_size != 0:
+            self._count -= 1
+            if i == self._best:
+                self._best = self._scan_from(i)
+                self._refresh_best()
+
+    def set_levels(self, prices, sizes):
+        # prices (int64) and sizes arrays, applied in order. Small deltas are cheaper level by level.
+        if len(prices) < BULK_MIN_LEVELS or self.anchor is None:
+            for price, size in zip(prices.tolist(), sizes.tolist()):
+                self.set_level(price, size)
+            return
+        indices = prices - self.anchor
+        in_ladder = (indices >= 0) & (indices < self.size)
+        for price, size in zip(prices[~in_ladder].tolist(), sizes[~in_ladder].tolist()):
+            self.set_level(price, size)
+        indices, sizes = indices[in_ladder], sizes[in_ladder]
+        # the last update of a price wins.
+        _, last = np.unique(indices[::-1], return_index=True)
+        keep = len(indices) - 1 - last
+        indices, sizes = indices[keep], sizes[keep]
+        previous_sizes = self.sizes[indices]
+        self.sizes[indices] = sizes
+        added = sizes != 0
+        self._count += int(np.count_nonzero(added & (previous_sizes == 0)))
+        self._count -= int(np.count_nonzero(~added & (previous_sizes != 0)))
+        if self._best >= 0 and self.sizes[self._best] == 0:
+            self._best = self._scan_from(self._best)
+        if added.any():
+            best = int(indices[added].max() if self.is_bid else indices[added].min())
+            if self._best < 0 or (best > self._best if self.is_bid else best < self._best):
+                self._best = best
+        self._refresh_best()
+
+    def levels(self, n=None):
+        # live levels, best first. n: only the n best levels.
+        if n is None or self._best < 0:
+            indices = np.flatnonzero(self.sizes != 0)
+        else:
+            indices = self._scan_n_from(self._best, n)
+        sizes = self.sizes[indices]
+        levels = list(zip((indices + self.anchor).tolist(), sizes.tolist())) if self.anchor is not None else []
+        if len(self.overflow) > 0:
+            levels.extend(self.overflow.items())
+            levels.sort()
+        if self.is_bid:
+            levels.reverse()
+        return levels if n is None else levels[:n]
+
+    def iter_levels(self):
+        # live levels, best first, lazily: the cells next to the best one are walked one by one, the rest scanned.
+        if len(self.overflow) > 0 or self._best < 0:
+            yield from self.levels()
+            return
+        cells, anchor, best = self._cells, self.anchor, self._best
+        if self.is_bid:
+            near = range(best, max(-1, best - WALK_CELLS), -1)
+        else:
+            near = range(best, min(self.size, best + WALK_CELLS))
+        for i in near:
+            size = cells[i]
+            if size != 0:
+                yield anchor + i, size
+        if self.is_bid:
+            far = np.flatnonzero(self.sizes[:near.stop + 1] != 0)[::-1]
+        else:
+            far = near.stop + np.flatnonzero(self.sizes[near.stop:] != 0)
+        yield from zip((far + anchor).tolist(), self.sizes[far].tolist())
+
+    def _scan_n_from(self, best, n):
+        # indices of the (at least) n non empty levels starting from the best one, in ascending order.
+        chunk = max(4 * n, 64)
+        while True:
+            if self.is_bid:
+                lo, hi = max(0, best + 1 - chunk), best + 1
+            else:
+                lo, hi = best, min(self.size, best + chunk)
+            indices = lo + np.flatnonzero(self.sizes[lo:hi] != 0)
+            if len(indices) >= n or hi - lo >= self.size or (lo == 0 if self.is_bid else hi == self.size):
+                return indices
+            chunk *= 4
+
+    def load(self, prices, sizes, mid_price=None):
+        # replaces all the levels at once.
+        live = sizes != 0
+        prices, sizes = prices[live], sizes[live]
+        if mid_price is None:
+            mid_price = int(prices[len(prices) // 2]) if len(prices) > 0 else self.anchor
+        self.sizes[:] = 0
+        self.overflow = SortedDict()
+        self._overflow_best = None
+        self._best = -1
+        self._best_price = None
+        self._count = 0
+        if mid_price is None:
+            return
+        self._set_anchor(int(mid_price) - self.size // 2)
+        indices = prices - self.anchor
+        in_ladder = (indices >= 0) & (indices < self.size)
+        ladder_indices = indices[in_ladder]
+        self.sizes[ladder_indices] = sizes[in_ladder]
+        self._count = len(ladder_indices)
+        if self._count > 0:
+            self._best = int(ladder_indices.max() if self.is_bid else ladder_indices.min())
+        out_of_ladder = ~in_ladder
+        if out_of_ladder.any():
+            self.overflow.update(zip(prices[out_of_ladder].tolist(), sizes[out_of_ladder].tolist()))
+            self._overflow_best = self.overflow.peekitem(-1 if self.is_bid else 0)[0]
+        self._refresh_best()
+
+    def arrays(self, n=None):
+        # prices and sizes as arrays, best first. n: only the n best levels.
+        if n is not None:
+            if len(self.overflow) == 0:  # the best levels are all in the ladder: only they are scanned.
+                if self._best < 0:
+                    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+                indices = self._scan_n_from(self._best, n)
+                indices = indices[::-1][:n] if self.is_bid else indices[:n]
+                return indices.astype(np.int64) + self.anchor, self.sizes[indices]
+            prices, sizes = self.arrays()
+            return prices[:n], sizes[:n]
+        indices = np.flatnonzero(self.sizes != 0)
+        sizes = self.sizes[indices]
+        prices = indices.astype(np.int64) + (self.anchor if self.anchor is not None else 0)
+        if len(self.overflow) > 0:
+            prices = np.concatenate([prices, np.fromiter(self.overflow.keys(), dtype=np.int64)])
+            sizes = np.concatenate([sizes, np.fromiter(self.overflow.values(), dtype=np.float64)])
+            order = np.argsort(prices, kind='stable')
+            prices, sizes = prices[order], sizes[order]
+        if self.is_bid:
+            return prices[::-1], sizes[::-1]
+        return prices, sizes
+
+    def recenter(self, price):
+        # moves the ladder so that price sits in its middle. O(size), only called when the price drifts.
+        prices, sizes = self.arrays()
+        self.load(prices, sizes, price)
+
+    def needs_recenter(self, price):
+        # price more than a quarter of the ladder away from its middle.
+        low, high = self._recenter_bounds
+        return price < low or price > high
+
+    def _set_anchor(self, anchor):
+        self.anchor = anchor
+        middle = anchor + self.size // 2
+        self._recenter_bounds = (middle - self.size // 4, middle + self.size // 4)
+
+    def _scan_from(self, i):
+        # bit-scan for the next non empty level after index i, looking at growing chunks close to i first.
+        sizes = self.sizes
+        chunk = 64
+        if self.is_bid:
+            hi = i
+            while hi > 0:
+                lo = max(0, hi - chunk)
+                non_zero = np.flatnonzero(sizes[lo:hi] != 0)
+                if len(non_zero) > 0:
+                    return lo + int(non_zero[-1])
+                hi = lo
+                chunk *= 4
+        else:
+            lo = i + 1
+            while lo < self.size:
+                hi = min(self.size, lo + chunk)
+                non_zero = np.flatnonzero(sizes[lo:hi] != 0)
+                if len(non_zero) > 0:
+                    return lo + int(non_zero[0])
+                lo = hi
+                chunk *= 4
+        return -1
@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from time import time
+
+from bitflyer.latency import LatencyHistogram
+
+# priority classes, lowest first: cancels go before orders, orders before queries.
+CANCEL = 0
+ORDER = 1
+QUERY = 2
+PRIORITY_NAMES = {CANCEL: 'cancel', ORDER: 'order', QUERY: 'query'}
+
+CANCEL_ENDPOINTS = ('/v1/me/cancelchildorder', '/v1/me/cancelparentorder', '/v1/me/cancelallchildorders')
+ORDER_ENDPOINTS = ('/v1/me/sendchildorder', '/v1/me/sendparentorder')
+
+
+def default_buckets(clock=time):
+    # bitFlyer: ~500 private API calls per 5 minutes, and ~300 order placements per 5 minutes.
+    # A little below the limits, to leave room for the clock differences.
+    return {
+        'api': TokenBucket(capacity=480, period=300, clock=clock),
+        'order': TokenBucket(capacity=290, period=300, clock=clock)
+    }
+
+
+def classify(endpoint, method='GET'):
+    # (priority, buckets) of a REST call.
+    if endpoint in CANCEL_ENDPOINTS:
+        return CANCEL, ('api',)
+    if endpoint in ORDER_ENDPOINTS:
+        return ORDER, ('api', 'order')
+    return QUERY, ('api',)
+
+
+class TokenBucket:
+    # capacity tokens, refilled continuously at capacity / period tokens per second.
+
+    def __init__(self, capacity, period, clock=time):
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    def wait_time(self, n=1):
+        # seconds until n tokens are available. 0 if they are.
+        self._refill()
+        if self._tokens >= n:
+            return 0.0
+        return (n - self._tokens) / self.rate
+
+    def take(self, n=1):
+        self._refill()
+        self._tokens -= n
+
+    def give(self, n=1):
+        # tokens taken for a request that was not sent.
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + n)
+
+
+class RequestScheduler:
+    # sits in front of the REST calls: a request waits for a permit, granted in priority order
+    # (cancel > order > query, FIFO within a class) when every token bucket of the request has a token.
+    # Identical queries in flight are coalesced: the later callers get the result of the first one.
+    # The caller sends the request itself, from its thread or event loop: the scheduler only paces them.
+    #
+    #   scheduler = RequestScheduler()
+    #   api = BitflyerRestAPI(credentials, scheduler=scheduler)
+    #   async_api = AsyncBitflyerRestAPI(credentials, scheduler=scheduler)  # shares the same limits.
+
+    def __init__(self, buckets=None, clock=time):
+        self.buckets = buckets if buckets is not None else default_buckets(clock)
+        self._clock = clock
+        self._queue = []  # heap of (priority, sequence, buckets, future, enqueue time).
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._in_flight = {}  # <key:Future> of the queries being sent.
+        self._in_flight_lock = Lock()
+        self.queue_depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self.num_sent = {priority: 0 for priority in PRIORITY_NAMES}
+        self.num_coalesced = 0
+        self.wait_times = {priority: LatencyHistogram() for priority in PRIORITY_NAMES}  # in ns.
+        self._dispatcher = Thread(target=self._dispatch_forever, daemon=True)
+        self._dispatcher.start()
+
+    def acquire(self, priority=QUERY, buckets=('api',)):
+        # Future resolved once the request can be sent.
+        future = Future()
+        with self._condition:
+            heapq.heappush(self._queue, (priority, next(self._sequence), buckets, future, self._clock()))
+            self.queue_depth[priority] += 1
+            self._condition.notify()
+        return future
+
+    def release(self, permit, buckets=('api',)):
+        # gives up a permit of acquire() whose request is not sent: dropped from the queue if still waiting,
+        # its tokens given back if already granted.
+        if permit.cancel():
+            return
+        with self._condition:
+            for name in buckets:
+                self.buckets[name].give()
+            self._condition.notify()
+
+    def call(self, fn, priority=QUERY, buckets=('api',), key=None):
+        # runs fn() once permitted. key: coalescing key of a query, None for requests that must all be sent.
+        if key is not None:
+            with self._in_flight_lock:
+                shared = self._in_flight.get(key)
+                joined = shared is not None
+                if joined:
+                    self.num_coalesced += 1
+                else:
+                    shared = self._in_flight[key] = Future()
+            if joined:  # waited for outside the lock: the other callers can join too.
+                return shared.result()
+        permit = self.acquire(priority, buckets)
+        try:
+            try:
+                permit.result()
+            except BaseException:  # e.g. KeyboardInterrupt while waiting.
+                self.release(permit, buckets)
+                raise
+            result = fn()
+            if key is not None:
+                shared.set_result(result)
+            return result
+        except BaseException as e:  # the joined callers must not wait forever.
+            if key is not None:
+                shared.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                with self._in_flight_lock:
+                    del self._in_flight[key]
+
+    async def call_async(self, coroutine_fn, priority=QUERY, buckets=('api',), key=None):
+        # same as call() for an asyncio client: coroutine_fn() is awaited once permitted.
+        if key is not None:
+            with self._in_flight_lock:
+                shared = self._in_flight.get(key)
+                joined = shared is not None
+                if joined:
+                    self.num_coalesced += 1
+                else:
+                    shared = self._in_flight[key] = Future()
+            if joined:  # shielded: a cancelled caller does not cancel the call of the others.
+                return await asyncio.shield(asyncio.wrap_future(shared))
+        permit = self.acquire(priority, buckets)
+        try:
+            try:
+                await asyncio.wrap_future(permit)
+            except BaseException:  # cancelled while waiting.
+                self.release(permit, buckets)
+                raise
+            result = await coroutine_fn()
+            if key is not None:
+                shared.set_result(result)
+            return result
+        except BaseException as e:  # the joined callers must not wait forever.
+            if key is not None:
+                shared.set_exception(e)
+            raise
+        finally:
+            if key is not None:
+                with self._in_flight_lock:
+                    del self._in_flight[key]
+
+    def _dispatch_forever(self):
+        with self._condition:
+            while True:
+                if len(self._queue) == 0:
+                    self._condition.wait()
+                    continue
+                priority, _, buckets, future, enqueued_at = self._queue[0]
+                wait = max(self.buckets[name].wait_time() for name in buckets)
+                if wait > 0:
+                    # a request of a higher priority can arrive meanwhile and take the head of the queue.
+                    self._condition.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+                self.queue_depth[priority] -= 1
+                if not future.set_running_or_notify_cancel():  # given up by the caller: no token is taken.
+                    continue
+                for name in buckets:
+                    self.buckets[name].take()
+                self.num_sent[priority] += 1
+                self.wait_times[priority].record(int((self._clock() - enqueued_at) * 1e9))
+                future.set_result(None)
+
+    def as_dict(self):
+        with self._condition:
+            return {
+                'queue_depth': {PRIORITY_NAMES[p]: n for p, n in self.queue_depth.items()},
+                'sent': {PRIORITY_NAMES[p]: n for p, n in self.num_sent.items()},
+                'coalesced': self.num_coalesced,
+                'wait_p99_ms': {PRIORITY_NAMES[p]: h.percentile(99) / 1e6 for p, h in self.wait_times.items()},
+                'tokens': {name: bucket.tokens for name, bucket in self.buckets.items()}
+            }
@@ -0,0 +1,110 @@
+import logging
+import random
+from time import time
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    # exponential backoff with jitter: the delay is drawn uniformly in [(1 - jitter) * d, d].
+
+    def __init__(self, initial_delay=0.5, max_delay=30.0, factor=2.0, jitter=0.5):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.initial_delay * self.factor ** self.attempts, self.max_delay)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ReconnectManager:
+    # keeps track of the connection state of a feed: backoff between the attempts,
+    # number of reconnections, downtime and the handlers to call on disconnect/reconnect.
+
+    def __init__(self, backoff=None, clock=time):
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.connected = False
+        self.connections = 0
+        self.disconnects = 0
+        self._clock = clock
+        self._start = clock()
+        self._disconnected_at = None
+        self._downtime = 0.0
+        self._disconnect_handlers = []
+        self._reconnect_handlers = []
+
+    @property
+    def reconnects(self):
+        return max(self.connections - 1, 0)
+
+    @property
+    def downtime(self):
+        # seconds spent disconnected since the first connection.
+        downtime = self._downtime
+        if self._disconnected_at is not None:
+            downtime += self._clock() - self._disconnected_at
+        return downtime
+
+    @property
+    def availability(self):
+        elapsed = self._clock() - self._start
+        return 1.0 - self.downtime / elapsed if elapsed > 0 else 1.0
+
+    def register_disconnect_handler(self, handler):
+        self._disconnect_handlers.append(handler)
+
+    def register_reconnect_handler(self, handler):
+        self._reconnect_handlers.append(handler)
+
+    def on_connected(self):
+        if self.connected:
+            return
+        self.connected = True
+        self.connections += 1
+        if self._disconnected_at is not None:
+            self._downtime += self._clock() - self._disconnected_at
+            self._disconnected_at = None
+        if self.connections > 1:
+            logger.info(f'Reconnected (reconnects={self.reconnects}, downtime={self.downtime:.3f}s).')
+            self._call(self._reconnect_handlers)
+
+    def on_subscribed(self):
+        # the backoff starts over once the subscriptions are acknowledged, not as soon as the socket opens:
+        # a server accepting connections and dropping them before subscribing is still backed off.
+        self.backoff.reset()
+
+    def on_disconnected(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self.disconnects += 1
+        self._disconnected_at = self._clock()
+        logger.warning('Disconnected.')
+        self._call(self._disconnect_handlers)
+
+    def next_delay(self):
+        return self.backoff.next_delay()
+
+    def as_dict(self):
+        return {
+            'connected': self.connected,
+            'reconnects': self.reconnects,
+            'disconnects': self.disconnects,
+            'downtime': self.downtime,
+            'availability': self.availability
+        }
+
+    @staticmethod
+    def _call(handlers):
+        for handler in handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception('Connection handler failed.')
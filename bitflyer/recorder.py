@@ -0,0 +1,150 @@
+import json
+import mmap
+import struct
+import zlib
+from threading import Lock
+from time import sleep, time
+
+# Log layout: MAGIC, then chunks. A chunk is CHUNK_HEADER (compressed size, number of frames)
+# followed by the zlib compressed frames. A frame is FRAME_HEADER (receive time, channel size,
+# payload size) followed by the channel and the raw payload. Raw JSON-RPC frames have an empty channel.
+MAGIC = b'BFREC001'
+CHUNK_HEADER = struct.Struct('<II')
+FRAME_HEADER = struct.Struct('<dHI')
+
+
+class FrameRecorder:
+
+    def __init__(self, path, chunk_size=1 << 20, compression_level=1):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self.num_frames = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._buffer = bytearray()
+        self._buffer_frames = 0
+        self._lock = Lock()
+
+    def record(self, payload, channel='', timestamp=None):
+        if timestamp is None:
+            timestamp = time()
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        channel = channel.encode('utf-8')
+        with self._lock:
+            self._buffer += FRAME_HEADER.pack(timestamp, len(channel), len(payload))
+            self._buffer += channel
+            self._buffer += payload
+            self._buffer_frames += 1
+            self.num_frames += 1
+            if len(self._buffer) >= self.chunk_size:
+                self._write_chunk()
+
+    def flush(self):
+        with self._lock:
+            self._write_chunk()
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def _write_chunk(self):
+        if self._buffer_frames == 0:
+            return
+        compressed = zlib.compress(bytes(self._buffer), self.compression_level)
+        self._file.write(CHUNK_HEADER.pack(len(compressed), self._buffer_frames))
+        self._file.write(compressed)
+        self._buffer = bytearray()
+        self._buffer_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameReplayer:
+
+    def __init__(self, path):
+        self.path = path
+
+    def frames(self):
+        # yields (timestamp, channel, payload) with payload as str.
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'{self.path} is not a frame log.')
+            offset = len(MAGIC)
+            while offset + CHUNK_HEADER.size <= len(mm):
+                compressed_size, num_frames = CHUNK_HEADER.unpack_from(mm, offset)
+                offset += CHUNK_HEADER.size
+                chunk = zlib.decompress(mm[offset:offset + compressed_size])
+                offset += compressed_size
+                position = 0
+                for _ in range(num_frames):
+                    timestamp, channel_size, payload_size = FRAME_HEADER.unpack_from(chunk, position)
+                    position += FRAME_HEADER.size
+                    channel = chunk[position:position + channel_size].decode('utf-8')
+                    position += channel_size
+                    payload = chunk[position:position + payload_size].decode('utf-8')
+                    position += payload_size
+                    yield timestamp, channel, payload
+
+    def replay(self, handler, speed=None):
+        # handler(timestamp, channel, payload). speed=None: as fast as possible.
+        # speed=1.0: original wall clock pacing, 2.0: twice as fast...
+        first_timestamp = None
+        start = time()
+        num_frames = 0
+        for timestamp, channel, payload in self.frames():
+            if speed is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                delay = (timestamp - first_timestamp) / speed - (time() - start)
+                if delay > 0:
+                    sleep(delay)
+            handler(timestamp, channel, payload)
+            num_frames += 1
+        return num_frames
+
+    def replay_rpc(self, client, speed=None):
+        # feeds the raw JSON-RPC frames to ClientRPC.on_message, which dispatches them to its handlers.
+        def on_frame(timestamp, channel, payload):
+            if channel == '':
+                client.on_message(None, payload)
+
+        return self.replay(on_frame, speed)
+
+    def channel_messages(self):
+        # yields (timestamp, channel, message) for the channel messages of both protocols.
+        for timestamp, channel, payload in self.frames():
+            message = json.loads(payload)
+            if channel != '':
+                yield timestamp, channel, message
+            elif isinstance(message, dict) and message.get('method') == 'channelMessage':  # not a batch of acks.
+                yield timestamp, message['params']['channel'], message['params']['message']
+
+    def replay_order_book(self, order_book, product='FX_BTC_JPY'):
+        snapshot_channel = f'lightning_board_snapshot_{product}'
+        board_channel = f'lightning_board_{product}'
+        num_messages = 0
+        for _, channel, message in self.channel_messages():
+            if channel == snapshot_channel:
+                order_book.snapshot_update(message)
+            elif channel == board_channel:
+                order_book.book_update(message)
+            else:
+                continue
+            num_messages += 1
+        return num_messages
+
+    def replay_order_events(self, store):
+        # feeds the child/parent order events to an OrderStateStore.
+        num_messages = 0
+        for _, channel, message in self.channel_messages():
+            if channel in ('child_order_events', 'parent_order_events'):
+                store.update(message)
+                num_messages += 1
+        return num_messages
@@ -3,29 +3,142 @@ import json
 import time
 from hashlib import sha256
 from secrets import token_hex
-from threading import Thread
+from threading import Event, Thread
 
 import websocket
 
+from bitflyer.decoding import get_decoder
+from bitflyer.reconnect import ReconnectManager
+
+END_POINT = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+JSON_RPC_ID_AUTH = 1
+READY_TIMEOUT = 30  # seconds to wait for the subscriptions by default.
+
+
+class SubscribeFailed(Exception):
+    pass
+
+
+def auth_params(key, secret):
+    now = int(time.time())
+    nonce = token_hex(16)
+    sign = hmac.new(secret.encode(
+        'utf-8'), ''.join([str(now), nonce]).encode('utf-8'), sha256).hexdigest()
+    return {'method': 'auth', 'params': {
+        'api_key': key, 'timestamp': now,
+        'nonce': nonce, 'signature': sign
+    }, 'id': JSON_RPC_ID_AUTH}
+
+
+class Subscriptions:
+    # readiness is based on the subscribe acknowledgements of the server (JSON-RPC responses with ids)
+    # and optionally on the first message received on each channel.
+    # The subscribes are sent as a batch: the server answers with one response per request or with an array.
+    FIRST_SUBSCRIBE_ID = 100
+
+    def __init__(self, wait_for_first_message=False):
+        self.wait_for_first_message = wait_for_first_message
+        self.channels = set()
+        self.pending = {}  # <json-rpc id:channel>
+        self.acknowledged = set()
+        self.failed = {}  # <channel:error>
+        self.received = set()
+        self._next_id = self.FIRST_SUBSCRIBE_ID
+
+    def reset(self, channels):
+        self.channels = set(channels)
+        self.pending = {}
+        self.acknowledged = set()
+        self.failed = {}
+        self.received = set()
+
+    def subscribe_params(self, channels):
+        params = []
+        for channel in channels:
+            self.pending[self._next_id] = channel
+            params.append({'method': 'subscribe', 'params': {'channel': channel}, 'id': self._next_id})
+            self._next_id += 1
+        return params
+
+    def on_response(self, messages):
+        # returns False if the response is not a subscribe acknowledgement.
+        channel = self.pending.pop(messages['id'], None)
+        if channel is None:
+            return False
+        if messages.get('result'):
+            self.acknowledged.add(channel)
+        else:
+            self.failed[channel] = messages.get('error')
+            print(f'subscribe error ({channel}): {messages.get("error")}')
+        return True
+
+    def on_channel_message(self, channel):
+        # returns True for the first message of a channel.
+        if channel in self.received:
+            return False
+        self.received.add(channel)
+        return True
+
+    @property
+    def ready(self):
+        if len(self.acknowledged) < len(self.channels):
+            return False
+        return not self.wait_for_first_message or len(self.received) >= len(self.channels)
+
+    @property
+    def done(self):
+        # ready, or a subscribe failed: nothing more to wait for.
+        return self.ready or len(self.failed) > 0
+
+    def check(self):
+        if len(self.failed) > 0:
+            raise SubscribeFailed(self.failed)
+
 
 class ClientRPC:
-    def __init__(self, key, secret):  # only compatible with 0.47.0
-        self.end_point = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+    def __init__(self, key=None, secret=None, recorder=None, end_point=END_POINT,
+                 latency=None, decoder=None):  # only compatible with 0.47.0
+        self.end_point = end_point
         self.private_channels = []
+        self.public_channels = []
         self.key = key
         self.secret = secret
-        self.JSON_RPC_ID_AUTH = 1
+        self.JSON_RPC_ID_AUTH = JSON_RPC_ID_AUTH
         self.handler = None
+        self.handlers = {}  # <channel:handler>
+        self.subscriptions = Subscriptions()
         self.ready = False
+        self._ready_event = Event()
+        self.reconnect = ReconnectManager()
+        self._ws = None
+        self._closing = False
+        self.recorder = recorder  # FrameRecorder.
+        self.latency = latency  # LatencyTracker.
+        self.decode = get_decoder(decoder)  # fastest installed JSON decoder by default.
+
+    def register_channels(self, private_channels=(), public_channels=()):
+        self.private_channels = list(private_channels)
+        self.public_channels = list(public_channels)
 
-    def register_channels(self, private_channels):
-        self.private_channels = private_channels
+    def register_handler(self, handler, channel=None):
+        # channel=None: handler receives the messages of every channel without a dedicated handler.
+        if channel is None:
+            self.handler = handler
+        else:
+            self.handlers[channel] = handler
 
-    def register_handler(self, handler):
-        self.handler = handler
+    def register_disconnect_handler(self, handler):
+        self.reconnect.register_disconnect_handler(handler)
+
+    def register_reconnect_handler(self, handler):
+        self.reconnect.register_reconnect_handler(handler)
 
     def on_open(self, ws):
         print("Websocket connected.")
+        self.reconnect.on_connected()
+        self.subscriptions.reset(self.public_channels + self.private_channels)
+        if len(self.public_channels) > 0:
+            ws.send(json.dumps(self.subscriptions.subscribe_params(self.public_channels)))
         if len(self.private_channels) > 0:
             self.auth(ws)
 
@@ -36,34 +149,57 @@ class ClientRPC:
         print("Websocket closed")
 
     def on_message(self, ws, message):
-        messages = json.loads(message)
-        if 'id' in messages and messages['id'] == self.JSON_RPC_ID_AUTH:
-            if 'error' in messages:
-                print('auth error: {}'.format(messages["error"]))
-            elif 'result' in messages and messages['result']:
-                print('auth success.')
-                params = [{'method': 'subscribe', 'params': {'channel': c}}
-                          for c in self.private_channels]
-                ws.send(json.dumps(params))
-                time.sleep(5)
-                self.ready = True
+        latency = self.latency
+        if latency is not None:
+            latency.on_receive()
+        if self.recorder is not None:
+            self.recorder.record(message)
+        messages = self.decode(message)
+        if latency is not None:
+            latency.on_decoded()
+        if isinstance(messages, list):  # responses to a batch.
+            for response in messages:
+                self.on_response(ws, response)
+            return
+        if 'id' in messages:
+            self.on_response(ws, messages)
+            return
         if 'method' not in messages or messages['method'] != 'channelMessage':
             return
-        self.handler(messages['params']['message'])
+        params = messages['params']
+        if self.subscriptions.on_channel_message(params['channel']):
+            self._update_ready()
+        handler = self.handlers.get(params['channel'], self.handler)
+        if handler is not None:
+            handler(params['message'])
+        if latency is not None:
+            latency.on_handled(params['message'])
+
+    def on_response(self, ws, response):
+        if response.get('id') == self.JSON_RPC_ID_AUTH:
+            if 'error' in response:
+                print('auth error: {}'.format(response["error"]))
+            elif 'result' in response and response['result']:
+                print('auth success.')
+                ws.send(json.dumps(self.subscriptions.subscribe_params(self.private_channels)))
+        elif self.subscriptions.on_response(response):
+            self._update_ready()
+
+    def _update_ready(self):
+        if not self.ready and self.subscriptions.ready:
+            self.ready = True
+            self.reconnect.on_subscribed()
+        if self.subscriptions.done:
+            self._ready_event.set()
 
     def auth(self, ws):
-        now = int(time.time())
-        nonce = token_hex(16)
-        sign = hmac.new(self.secret.encode(
-            'utf-8'), ''.join([str(now), nonce]).encode('utf-8'), sha256).hexdigest()
-        params = {'method': 'auth', 'params': {
-            'api_key': self.key, 'timestamp': now,
-            'nonce': nonce, 'signature': sign
-        }, 'id': self.JSON_RPC_ID_AUTH}
-        ws.send(json.dumps(params))
-
-    def start_and_wait_for_stream(self):
-        ws = websocket.WebSocketApp(
+        ws.send(json.dumps(auth_params(self.key, self.secret)))
+
+    def start_and_wait_for_stream(self, wait_for_first_message=False, timeout=READY_TIMEOUT):
+        # returns True once every channel is subscribed (and has received a message if wait_for_first_message),
+        # False on timeout (None: no timeout). Raises SubscribeFailed if the server refused a subscription.
+        self.subscriptions.wait_for_first_message = wait_for_first_message
+        ws = self._ws = websocket.WebSocketApp(
             self.end_point,
             on_open=self.on_open,
             on_message=self.on_message,
@@ -72,9 +208,27 @@ class ClientRPC:
         )
 
         def wrap_run():
-            while True:
+            while not self._closing:
                 ws.run_forever()
+                if self._closing:
+                    break
+                # auth and subscriptions are sent again by on_open() once reconnected.
+                self.ready = False
+                self._ready_event.clear()
+                self.reconnect.on_disconnected()
+                delay = self.reconnect.next_delay()
+                print(f'Reconnecting in {delay:.2f}s.')
+                time.sleep(delay)
 
         Thread(target=wrap_run).start()
-        while not self.ready:
-            time.sleep(0.01)
+        if not self._ready_event.wait(timeout):
+            print(f'Not subscribed after {timeout}s: {self.subscriptions.channels - self.subscriptions.acknowledged}.')
+            return False
+        self.subscriptions.check()
+        return True
+
+    def close(self):
+        # closes the connection and stops reconnecting.
+        self._closing = True
+        if self._ws is not None:
+            self._ws.close()
@@ -0,0 +1,180 @@
+import logging
+import os
+from multiprocessing import resource_tracker, shared_memory
+from threading import Event, Lock
+from time import time
+
+import numpy as np
+
+from bitflyer.book_manager import BookFeed, BookTop
+from bitflyer.rpc import END_POINT
+
+logger = logging.getLogger(__name__)
+
+# layout of a block, native byte order:
+#   0: sequence (uint64), odd while the writer is writing.
+#   8: timestamp, best_bid, best_ask, mid_price, qos (float64, NaN: None).
+#  48: depth, n_bids, n_asks (int64).
+#  72: bids then asks, depth rows of (price, size) each (float64).
+SEQUENCE_OFFSET = 0
+FLOATS_OFFSET = 8
+INTS_OFFSET = 48
+LEVELS_OFFSET = 72
+MAX_SPINS = 10_000  # reads retried while the writer writes. More means the writer died mid-write.
+
+_written = set()  # names of the blocks written by this process.
+
+
+def block_name(product):
+    return f'bitflyer_book_{product}'
+
+
+def block_size(depth):
+    return LEVELS_OFFSET + 2 * depth * 2 * 8
+
+
+def _float(value):
+    return float('nan') if value is None else value
+
+
+def _value(value):
+    return None if value != value else value
+
+
+class SharedBookWriter:
+    # top of book of one product in a shared memory block, for the readers of other processes.
+    # Sequence lock: the sequence is odd during a write, so a reader retries when it sees an odd
+    # sequence or a sequence that changed while it was copying. The sequence lock allows one writer at a
+    # time: write() takes a lock, so the threads of the writing process can share it.
+    # The stores are assumed to be seen in program order by the other processes (x86).
+
+    def __init__(self, product, depth=10, name=None):
+        self.product = product
+        self.depth = depth
+        self.name = name if name is not None else block_name(product)
+        try:
+            self.shm = shared_memory.SharedMemory(self.name, create=True, size=block_size(depth))
+        except FileExistsError:
+            # left behind by a writer that did not exit cleanly.
+            logger.warning(f'Shared memory {self.name} exists. Replacing it.')
+            stale = shared_memory.SharedMemory(self.name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(self.name, create=True, size=block_size(depth))
+        _written.add(self.name)
+        buf = self.shm.buf
+        self._sequence = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=SEQUENCE_OFFSET)
+        self._floats = np.ndarray((5,), dtype=np.float64, buffer=buf, offset=FLOATS_OFFSET)
+        self._ints = np.ndarray((3,), dtype=np.int64, buffer=buf, offset=INTS_OFFSET)
+        self._bids = np.ndarray((depth, 2), dtype=np.float64, buffer=buf, offset=LEVELS_OFFSET)
+        self._asks = np.ndarray((depth, 2), dtype=np.float64, buffer=buf, offset=LEVELS_OFFSET + depth * 16)
+        self._ints[0] = depth
+        self.sequence = 0
+        self._lock = Lock()
+
+    def write(self, top):
+        # top: BookTop. bids/asks beyond depth are dropped.
+        bids, asks = top.bids[:self.depth], top.asks[:self.depth]
+        with self._lock:
+            self.sequence += 1
+            self._sequence[0] = self.sequence
+            self._floats[:] = (top.timestamp, _float(top.best_bid), _float(top.best_ask), _float(top.mid_price),
+                               _float(top.qos))
+            self._ints[1:] = (len(bids), len(asks))
+            if len(bids) > 0:
+                self._bids[:len(bids)] = bids
+            if len(asks) > 0:
+                self._asks[:len(asks)] = asks
+            self.sequence += 1
+            self._sequence[0] = self.sequence
+
+    def close(self, unlink=True):
+        # unlink: removes the block. The readers attached keep their mapping but see no more updates.
+        del self._sequence, self._floats, self._ints, self._bids, self._asks
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+            _written.discard(self.name)
+
+
+class SharedBookReader:
+    # reads the block of a SharedBookWriter. read() copies the block once (392 bytes at depth 10) and checks the
+    # sequence around the copy: the snapshot is consistent and its arrays are views of that copy.
+    #
+    #   reader = SharedBookReader('FX_BTC_JPY')
+    #   top = reader.read(max_staleness=0.5)  # BookTop, bids/asks as (n, 2) arrays of (price, size).
+
+    def __init__(self, product, name=None):
+        self.product = product
+        self.name = name if name is not None else block_name(product)
+        self.shm = shared_memory.SharedMemory(self.name)
+        # only the writer owns the block: the resource tracker would unlink it when this process exits.
+        if os.name == 'posix' and self.name not in _written:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        buf = self.shm.buf
+        self._sequence = np.ndarray((1,), dtype=np.uint64, buffer=buf, offset=SEQUENCE_OFFSET)
+        self.depth = int(np.ndarray((1,), dtype=np.int64, buffer=buf, offset=INTS_OFFSET)[0])
+        self._raw = np.ndarray((block_size(self.depth),), dtype=np.uint8, buffer=buf)
+        self._best = np.ndarray((2,), dtype=np.float64, buffer=buf, offset=FLOATS_OFFSET + 8)
+        self.num_retries = 0
+
+    @property
+    def sequence(self):
+        return int(self._sequence[0])
+
+    def _copy(self):
+        # consistent copy of the block, None if nothing was written yet or the writer is stuck mid-write.
+        for _ in range(MAX_SPINS):
+            sequence = self._sequence[0]
+            if sequence & 1 == 0:
+                data = self._raw.copy()
+                if self._sequence[0] == sequence:
+                    return (data, int(sequence)) if sequence > 0 else None
+            self.num_retries += 1
+        return None
+
+    def read(self, max_staleness=None):
+        # latest BookTop. None if not written yet or older than max_staleness seconds.
+        copied = self._copy()
+        if copied is None:
+            return None
+        data, _ = copied
+        timestamp, best_bid, best_ask, mid_price, qos = np.frombuffer(data, np.float64, 5, FLOATS_OFFSET).tolist()
+        if max_staleness is not None and time() - timestamp > max_staleness:
+            return None
+        _, n_bids, n_asks = np.frombuffer(data, np.int64, 3, INTS_OFFSET).tolist()
+        levels = np.frombuffer(data, np.float64, 4 * self.depth, LEVELS_OFFSET).reshape(2, self.depth, 2)
+        return BookTop(product=self.product, best_bid=_value(best_bid), best_ask=_value(best_ask),
+                       mid_price=_value(mid_price), bids=levels[0, :n_bids], asks=levels[1, :n_asks],
+                       timestamp=timestamp, qos=_value(qos))
+
+    def best_bid_ask(self):
+        # only the best bid and ask: no copy of the levels.
+        for _ in range(MAX_SPINS):
+            sequence = self._sequence[0]
+            if sequence & 1 == 0:
+                best_bid, best_ask = self._best.tolist()
+                if self._sequence[0] == sequence:
+                    return (_value(best_bid), _value(best_ask)) if sequence > 0 else (None, None)
+            self.num_retries += 1
+        return None, None
+
+    def close(self):
+        del self._sequence, self._raw, self._best
+        self.shm.close()
+
+
+def run_shared_book_feed(products, depth=10, publish_interval=0.0, engine='sorted_dict', end_point=END_POINT,
+                         heartbeat_interval=1.0):
+    # feed process: one connection and one book per product, each published to its shared memory block
+    # on every change (publish_interval=0), from the receive thread. The flush thread only publishes the
+    # heartbeats, under the same feed lock. The readers attach with SharedBookReader(product).
+    writers = {product: SharedBookWriter(product, depth) for product in products}
+    feed = BookFeed(products, lambda top: writers[top.product].write(top), depth, publish_interval, engine,
+                    end_point, enable_qos=True, heartbeat_interval=heartbeat_interval)
+    try:
+        feed.start()
+        Event().wait()
+    finally:
+        for writer in writers.values():
+            writer.close()
@@ -1,30 +1,66 @@
 import hmac
+import json
 import time
 from hashlib import sha256
 from secrets import token_hex
 
 import socketio
 
+from bitflyer.reconnect import ReconnectManager
+
+END_POINT = 'https://io.lightstream.bitflyer.com'
+
 
 class WebSocketIO(object):
-    def __init__(self, end_point, key, secret):
+    def __init__(self, end_point, key, secret, backoff=None, recorder=None, latency=None):
         self._connected = False
+        self._auth_requested = False
         self._auth_completed = False
         self._end_point = end_point
         self._key = key
         self._secret = secret
+        self._channels = []
+        self.recorder = recorder  # FrameRecorder.
+        self.latency = latency  # LatencyTracker. socketio decodes the messages itself: no decode stage.
+        self.reconnect = ReconnectManager(backoff)
 
-        self._sio = socketio.Client()
+        # socketio reconnects by itself with a jittered exponential backoff.
+        backoff = self.reconnect.backoff
+        self._sio = socketio.Client(reconnection=True,
+                                    reconnection_delay=backoff.initial_delay,
+                                    reconnection_delay_max=backoff.max_delay,
+                                    randomization_factor=backoff.jitter)
         self._sio.on('connect', self.on_connect)
+        self._sio.on('disconnect', self.on_disconnect)
         self._sio.connect(self._end_point, transports=['websocket'])
         while not self._connected:
             time.sleep(1)
 
     def on_connect(self):
         print('SocketIO connected')
+        reconnected = self.reconnect.connections > 0
         self._connected = True
+        self.reconnect.on_connected()
+        if reconnected:
+            # runs on the socketio thread: the auth callback subscribes again without blocking here.
+            if self._auth_requested:
+                self._auth_completed = False
+                self._emit_auth(callback=self._on_reauth)
+            else:
+                self._subscribe_all()
 
-    def start_auth(self):
+    def on_disconnect(self):
+        print('SocketIO disconnected')
+        self._connected = False
+        self.reconnect.on_disconnected()
+
+    def register_disconnect_handler(self, handler):
+        self.reconnect.register_disconnect_handler(handler)
+
+    def register_reconnect_handler(self, handler):
+        self.reconnect.register_reconnect_handler(handler)
+
+    def _emit_auth(self, callback):
         now = int(time.time())
         nonce = token_hex(16)
         sign = hmac.new(self._secret.encode('utf-8'),
@@ -32,7 +68,11 @@ class WebSocketIO(object):
                         sha256).hexdigest()
         params = {'api_key': self._key, 'timestamp': now,
                   'nonce': nonce, 'signature': sign}
-        self._sio.emit('auth', params, callback=self.on_auth)
+        self._sio.emit('auth', params, callback=callback)
+
+    def start_auth(self):
+        self._auth_requested = True
+        self._emit_auth(callback=self.on_auth)
         print('Auth process started')
         while not self._auth_completed:
             time.sleep(1)
@@ -41,6 +81,38 @@ class WebSocketIO(object):
         print('Auth process done')
         self._auth_completed = True
 
+    def _on_reauth(self, data):
+        self.on_auth(data)
+        self._subscribe_all()
+
+    def _subscribe_all(self):
+        for channel in self._channels:
+            self._sio.emit('subscribe', channel)
+
     def register_handler(self, channel, handler):
+        self._channels.append(channel)
+        if self.recorder is not None:
+            handler = self._recording_handler(channel, handler)
+        if self.latency is not None:
+            handler = self._timed_handler(handler)
         self._sio.on(channel, handler)
         self._sio.emit('subscribe', channel)
+
+    def _recording_handler(self, channel, handler):
+        def on_message(message):
+            self.recorder.record(json.dumps(message), channel=channel)
+            return handler(message)
+
+        return on_message
+
+    def _timed_handler(self, handler):
+        def on_message(message):
+            self.latency.on_receive()
+            result = handler(message)
+            self.latency.on_handled(message)
+            return result
+
+        return on_message
+
+    def close(self):
+        self._sio.disconnect()
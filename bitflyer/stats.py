@@ -0,0 +1,93 @@
+import math
+from collections import deque
+from time import time
+
+
+class RollingMean:
+    # mean of the last window values, maintained in O(1) with a running sum.
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._values = deque(maxlen=window)
+        self._sum = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def full(self):
+        return len(self._values) == self.window
+
+    @property
+    def mean(self):
+        if len(self._values) == 0:
+            return 0.0
+        return self._sum / len(self._values)
+
+    def append(self, value):
+        if len(self._values) == self.window:
+            self._sum -= self._values[0]
+        self._values.append(value)
+        self._sum += value
+
+
+class EwmaRate:
+    # events per second, exponentially decayed with the given half life (in seconds).
+    # The rate is always fresh: it also decays when no events come in.
+
+    def __init__(self, half_life=1.0, clock=time):
+        self.half_life = half_life
+        self._tau = half_life / math.log(2)
+        self._clock = clock
+        self._start = None
+        self._last = None
+        self._value = 0.0
+        self.total = 0
+
+    def count(self, n=1):
+        now = self._clock()
+        if self._last is None:
+            self._start = self._last = now
+        elif now > self._last:
+            self._value *= math.exp((self._last - now) / self._tau)
+            self._last = now
+        self._value += n
+        self.total += n
+
+    @property
+    def rate(self):
+        if self._last is None:
+            return 0.0
+        now = self._clock()
+        value = self._value * math.exp(min(self._last - now, 0) / self._tau)
+        # corrects the bias of the first seconds, when the average has not seen a full window yet.
+        elapsed = max(now - self._start, 1e-9)
+        return value / (self._tau * (1 - math.exp(-elapsed / self._tau)))
+
+
+class BookStats:
+
+    def __init__(self, window=1000, half_life=1.0):
+        self.bid_ask = RollingMean(window)  # best_bid <= best_ask.
+        self.mid_price = RollingMean(window)  # best_bid <= mid_price <= best_ask.
+        self.updates = EwmaRate(half_life)
+
+    @property
+    def qos(self):
+        # 1.0: perfect synchronised stream, <0.9 degraded stream.
+        if not self.mid_price.full:
+            return 1.0
+        return 0.5 * self.bid_ask.mean + 0.5 * self.mid_price.mean
+
+    @property
+    def updates_per_second(self):
+        return self.updates.rate
+
+    def as_dict(self):
+        return {
+            'qos': self.qos,
+            'bid_ask_ok': self.bid_ask.mean,
+            'mid_price_ok': self.mid_price.mean,
+            'updates_per_second': self.updates_per_second,
+            'total_updates': self.updates.total
+        }
@@ -3,7 +3,7 @@ import time
 from logging import getLogger
 
 from bitflyer.order_book import OrderBook
-from bitflyer.socketio import WebSocketIO
+from bitflyer.socketio import WebSocketIO, END_POINT
 
 logger = getLogger(__name__)
 
@@ -13,19 +13,24 @@ SECRET = ''
 
 class SocketIOFastTickerAPI:
 
-    def __init__(self):
+    def __init__(self, end_point=END_POINT, key=KEY, secret=SECRET, latency=None):
         self.order_book = OrderBook(enable_qos=False, enable_statistics=False)
         self.bbo = None, None
         self.updater = 'TICKER'
 
         def on_order_book_snapshot(message):
             self.order_book.snapshot_update(message)
+            if latency is not None:
+                latency.on_applied()
             self.bbo = self.order_book.best_bid, self.order_book.best_ask
             self.updater = 'SNAPSHOT'
 
         def on_order_book(message):
+            # discarded by the order book until a snapshot is received (counted in discarded_updates).
+            self.order_book.book_update(message)
+            if latency is not None:
+                latency.on_applied()
             if self.order_book.snapshot_received:
-                self.order_book.book_update(message)
                 self.bbo = self.order_book.best_bid, self.order_book.best_ask
                 self.updater = 'OB'
 
@@ -33,8 +38,10 @@ class SocketIOFastTickerAPI:
             self.bbo = message['best_bid'], message['best_ask']
             self.updater = 'TICKER'
 
-        ws = WebSocketIO('https://io.lightstream.bitflyer.com', KEY, SECRET)
+        ws = WebSocketIO(end_point, key, secret, latency=latency)
         ws.start_auth()
+        ws.register_disconnect_handler(self.order_book.on_disconnect)
+        self.reconnect = ws.reconnect
 
         ws.register_handler(
             channel='lightning_ticker_FX_BTC_JPY',
@@ -0,0 +1,285 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from bitflyer.latency import exchange_time_ns
+from bitflyer.rpc import ClientRPC, END_POINT
+
+logger = logging.getLogger(__name__)
+
+# columns of TradeAggregator.trades. time: exchange time in seconds. signed_size: > 0 taker buy, < 0 taker sell,
+# 0 for the executions without a side (itayose).
+TRADE_COLUMNS = ('time', 'id', 'price', 'size', 'signed_size')
+T_TIME, T_ID, T_PRICE, T_SIZE, T_SIGNED_SIZE = range(len(TRADE_COLUMNS))
+
+# columns of Bars. start: start time of the bar in seconds.
+BAR_COLUMNS = ('start', 'open', 'high', 'low', 'close', 'volume', 'vwap', 'buy_volume', 'sell_volume', 'count')
+B_START, B_OPEN, B_HIGH, B_LOW, B_CLOSE, B_VOLUME, B_VWAP, B_BUY_VOLUME, B_SELL_VOLUME, B_COUNT = range(
+    len(BAR_COLUMNS))
+
+Bar = namedtuple('Bar', BAR_COLUMNS)
+
+SIDES = {'BUY': 1.0, 'SELL': -1.0}
+
+
+def executions_channel(product):
+    return f'lightning_executions_{product}'
+
+
+def executions_to_array(executions):
+    # lightning_executions message (list of executions) -> array of TRADE_COLUMNS rows.
+    rows = [(exchange_time_ns(e['exec_date']) / 1e9, e['id'], e['price'], e['size'],
+             SIDES.get(e['side'], 0.0) * e['size']) for e in executions]
+    return np.array(rows, dtype=np.float64).reshape(-1, len(TRADE_COLUMNS))
+
+
+class RingArray:
+    # ring buffer of rows. Every row is stored twice, at i and i + capacity, so that the last n rows
+    # are always contiguous: last(n) is a view, not a copy. The views are live: rows get overwritten
+    # once capacity newer rows were appended.
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, width), dtype=np.float64)
+        self.count = 0  # rows appended since the start, the index of the next row.
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def extend(self, rows):
+        if len(rows) > self.capacity:
+            self.count += len(rows) - self.capacity
+            rows = rows[-self.capacity:]
+        head = self.count % self.capacity
+        n = min(len(rows), self.capacity - head)
+        self.data[head:head + n] = rows[:n]
+        self.data[head + self.capacity:head + self.capacity + n] = rows[:n]
+        if n < len(rows):
+            self.data[:len(rows) - n] = rows[n:]
+            self.data[self.capacity:self.capacity + len(rows) - n] = rows[n:]
+        self.count += len(rows)
+
+    def append(self, row):
+        head = self.count % self.capacity
+        self.data[head] = row
+        self.data[head + self.capacity] = row
+        self.count += 1
+
+    def last(self, n=None):
+        # the n last rows, oldest first.
+        n = len(self) if n is None else min(n, len(self))
+        end = self.count % self.capacity + self.capacity
+        return self.data[end - n:end]
+
+    def since(self, index):
+        # rows from the index-th appended one (must still be in the buffer).
+        return self.last(self.count - index)
+
+
+class Bars:
+    # OHLCV bars of interval seconds, aligned on multiples of interval. A bar is only written in the
+    # ring once closed; the bar in progress is current. Intervals without trades have no bar.
+
+    def __init__(self, interval, capacity=1440):
+        self.interval = interval
+        self.closed = RingArray(capacity, len(BAR_COLUMNS))
+        self._start = None
+        self._end = None
+
+    def _open(self, time, price):
+        self._start = time - time % self.interval
+        self._end = self._start + self.interval
+        self._open_price = self._high = self._low = self._close = price
+        self._volume = self._notional = self._buy_volume = self._sell_volume = 0.0
+        self._count = 0
+
+    def update(self, time, price, size, signed_size):
+        if self._start is None:
+            self._open(time, price)
+        elif time >= self._end:
+            self.closed.append(self._row())
+            self._open(time, price)
+        if price > self._high:
+            self._high = price
+        elif price < self._low:
+            self._low = price
+        self._close = price
+        self._volume += size
+        self._notional += price * size
+        if signed_size > 0:
+            self._buy_volume += size
+        elif signed_size < 0:
+            self._sell_volume += size
+        self._count += 1
+
+    def _row(self):
+        vwap = self._notional / self._volume if self._volume > 0 else self._close
+        return (self._start, self._open_price, self._high, self._low, self._close, self._volume, vwap,
+                self._buy_volume, self._sell_volume, self._count)
+
+    @property
+    def current(self):
+        # the bar in progress, None before the first trade.
+        return Bar(*self._row()) if self._start is not None else None
+
+    def last(self, n=None):
+        # the n last closed bars, oldest first, as a view of BAR_COLUMNS rows.
+        return self.closed.last(n)
+
+    def column(self, name, n=None):
+        return self.last(n)[:, BAR_COLUMNS.index(name)]
+
+
+class RollingWindow:
+    # volume, VWAP and signed flow of the trades of the last seconds (exchange time of the last trade).
+    # Running sums: the trades entering are added, the trades leaving are subtracted.
+
+    def __init__(self, seconds, trades):
+        self.seconds = seconds
+        self._trades = trades  # RingArray shared with the aggregator.
+        self._start = 0  # index of the oldest trade of the window.
+        self.volume = 0.0
+        self.notional = 0.0
+        self.flow = 0.0  # signed volume: taker buys - taker sells.
+        self.count = 0
+
+    def add(self, count, volume, notional, flow):
+        # sums of the trades appended, computed once for all the windows.
+        self.count += count
+        self.volume += volume
+        self.notional += notional
+        self.flow += flow
+
+    def make_room(self, n):
+        # removes the trades that appending n rows would overwrite: the window is then shorter than seconds.
+        overflow = self._trades.count + n - self._trades.capacity - self._start
+        if overflow > 0:
+            self._remove(self._trades.since(self._start)[:overflow])
+
+    def expire(self, now):
+        window = self._trades.since(self._start)
+        n = int(np.searchsorted(window[:, T_TIME], now - self.seconds, side='left'))
+        if n > 0:
+            self._remove(window[:n])
+
+    def _remove(self, rows):
+        self._start += len(rows)
+        self.count -= len(rows)
+        if self.count == 0:  # resets the rounding errors of the running sums.
+            self.volume = self.notional = self.flow = 0.0
+            return
+        self.volume -= float(rows[:, T_SIZE].sum())
+        self.notional -= float(rows[:, T_PRICE] @ rows[:, T_SIZE])
+        self.flow -= float(rows[:, T_SIGNED_SIZE].sum())
+
+    @property
+    def vwap(self):
+        return self.notional / self.volume if self.volume > 0 else None
+
+    @property
+    def imbalance(self):
+        # in [-1, 1]: 1 all taker buys, -1 all taker sells.
+        return self.flow / self.volume if self.volume > 0 else 0.0
+
+    def trades(self):
+        # trades of the window, as a view of TRADE_COLUMNS rows.
+        return self._trades.since(self._start)
+
+    def as_dict(self):
+        return {'volume': self.volume, 'vwap': self.vwap, 'flow': self.flow, 'imbalance': self.imbalance,
+                'count': self.count}
+
+
+class TradeAggregator:
+    # trades of one product in a NumPy ring buffer, with OHLCV bars and rolling windows updated as they come.
+    # A message costs one vectorized write, O(1) work per trade for the bars and amortized O(1) for the
+    # windows. The arrays exposed are views: copy them to keep a stable snapshot.
+    #
+    #   aggregator = TradeAggregator(bar_intervals=(1, 60), windows=(10, 60))
+    #   aggregator.update(executions)  # a lightning_executions message.
+    #   aggregator.bars[60].column('close'), aggregator.windows[10].vwap, aggregator.trades.last(100)
+
+    def __init__(self, product='FX_BTC_JPY', capacity=1 << 16, bar_intervals=(1, 60), bar_capacity=1440,
+                 windows=(1, 10, 60)):
+        self.product = product
+        self.trades = RingArray(capacity, len(TRADE_COLUMNS))
+        self.bars = {interval: Bars(interval, bar_capacity) for interval in bar_intervals}
+        self.windows = {seconds: RollingWindow(seconds, self.trades) for seconds in windows}
+        self.last_id = None
+
+    def update(self, executions):
+        if len(executions) == 0:
+            return
+        self.update_array(executions_to_array(executions))
+
+    def update_array(self, rows):
+        # rows: array of TRADE_COLUMNS, in exchange order.
+        if self.last_id is not None:
+            rows = rows[rows[:, T_ID] > self.last_id]  # replayed after a reconnection.
+            if len(rows) == 0:
+                return
+        self.last_id = rows[-1, T_ID]
+        if len(self.bars) > 0:
+            for time, price, size, signed_size in rows[:, [T_TIME, T_PRICE, T_SIZE, T_SIGNED_SIZE]].tolist():
+                for bars in self.bars.values():
+                    bars.update(time, price, size, signed_size)
+        rows = rows[-self.trades.capacity:]
+        for window in self.windows.values():
+            window.make_room(len(rows))
+        self.trades.extend(rows)
+        if len(self.windows) > 0:
+            now = rows[-1, T_TIME]
+            volume = float(rows[:, T_SIZE].sum())
+            notional = float(rows[:, T_PRICE] @ rows[:, T_SIZE])
+            flow = float(rows[:, T_SIGNED_SIZE].sum())
+            for window in self.windows.values():
+                window.add(len(rows), volume, notional, flow)
+                window.expire(now)
+
+    @property
+    def last_price(self):
+        return self.trades.last(1)[0, T_PRICE] if len(self.trades) > 0 else None
+
+    def as_dict(self):
+        return {
+            'product': self.product,
+            'last_price': self.last_price,
+            'trades': self.trades.count,
+            'windows': {seconds: window.as_dict() for seconds, window in self.windows.items()}
+        }
+
+
+class ExecutionsFeed:
+    # TradeAggregator of several products fed by the lightning_executions channels over one JSON-RPC connection.
+    #
+    #   feed = ExecutionsFeed(['FX_BTC_JPY'])
+    #   feed.start()
+    #   feed.aggregators['FX_BTC_JPY'].windows[60].vwap
+
+    def __init__(self, products, end_point=END_POINT, latency=None, **aggregator_params):
+        self.products = list(products)
+        self.aggregators = {product: TradeAggregator(product, **aggregator_params) for product in self.products}
+        self.latency = latency  # LatencyTracker.
+        self.rpc = ClientRPC(end_point=end_point, latency=latency)
+        for product in self.products:
+            self.rpc.register_handler(self._handler(product), channel=executions_channel(product))
+        self.rpc.register_channels(public_channels=[executions_channel(product) for product in self.products])
+        self.rpc.register_disconnect_handler(self._on_disconnect)
+
+    def start(self):
+        self.rpc.start_and_wait_for_stream()
+
+    def _handler(self, product):
+        aggregator = self.aggregators[product]
+
+        def on_executions(message):
+            aggregator.update(message)
+            if self.latency is not None:
+                self.latency.on_applied()
+
+        return on_executions
+
+    def _on_disconnect(self):
+        # the executions of the disconnection are missed: the bars and windows of that time are incomplete.
+        logger.warning(f'Executions stream disconnected: {self.products} bars may miss trades.')
@@ -1,14 +1,265 @@
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+import attr
 import pybitflyer
 
+from bitflyer.rate_limit import classify
+
+
+def wrap_new_order(resp):
+    resp['id'] = resp['child_order_acceptance_id']
+    return resp
+
+
+def limit_order_params(ticker, quantity, price, side, params):
+    return dict(product_code=ticker,
+                child_order_type='LIMIT',
+                price=price,
+                side=side,
+                size=quantity,
+                minute_to_expire=params['minute_to_expire'] if 'minute_to_expire' in params else None,
+                time_in_force=params['time_in_force'] if 'time_in_force' in params else None)
+
+
+def market_order_params(ticker, quantity, side):
+    return dict(product_code=ticker, child_order_type='MARKET', side=side, size=quantity)
+
+
+def order_status(order, trades):
+    # order: response of getchildorders. trades: getexecutions of the order, only needed if order is empty.
+    if len(order) == 0:  # either executed or canceled.
+        if len(trades) == 0:
+            return 'CANCELED'
+        else:
+            return 'COMPLETED'
+    assert len(order) == 1
+    return order[0]['child_order_state']
+
+
+def executed_quantity_and_average_price(trades):
+    average_price = 0
+    total_size = 0
+    for trade in trades:
+        average_price += trade['size'] * trade['price']
+        total_size += trade['size']
+    if total_size == 0:
+        return 0, 0
+    else:
+        average_price /= total_size
+        return total_size, average_price
+
+
+def position_quantity(positions):
+    quantity = 0.0
+    for position in positions:
+        if position['side'] == 'BUY':
+            quantity += position['size']
+        else:
+            quantity -= position['size']
+    return quantity
+
+
+def position_quantity_and_average_price(positions):
+    # net signed quantity and its average open price. Open positions are all on the same side.
+    quantity = position_quantity(positions)
+    size = sum(position['size'] for position in positions)
+    if size == 0:
+        return 0.0, 0.0
+    return quantity, sum(position['price'] * position['size'] for position in positions) / size
+
+
+def coalescing_key(endpoint, method, params):
+    # identical queries in flight share one request. Orders and cancels are never coalesced.
+    if method != 'GET':
+        return None
+    return endpoint + '?' + urllib.parse.urlencode(sorted(params.items())) if params else endpoint
+
+
+def response_error(resp):
+    # bitFlyer reports errors in the body: {'status': -208, 'error_message': '...'}. None if resp is a success.
+    if isinstance(resp, dict) and isinstance(resp.get('status'), int) and resp['status'] < 0:
+        return f'{resp["status"]}: {resp.get("error_message")}'
+    return None
+
+
+NOT_SENT = 'Not sent: a cancel failed.'  # error of the orders skipped by replace_quote(cancel_first=True).
+
+
+@attr.s
+class OrderResult:
+    # outcome of one request of a batch. error: the exception raised or the error returned by the API.
+    action = attr.ib(type=str)  # 'cancel', 'buy' or 'sell'.
+    order_id = attr.ib(type=str, default=None)
+    response = attr.ib(default=None)
+    error = attr.ib(default=None)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @classmethod
+    def of(cls, action, order_id=None, response=None, exception=None):
+        if exception is not None:
+            return cls(action, order_id, None, exception)
+        error = response_error(response)
+        if error is None and action != 'cancel':
+            if not isinstance(response, dict) or 'child_order_acceptance_id' not in response:
+                error = f'Unexpected response: {response}'
+            else:
+                order_id = response['child_order_acceptance_id']
+        return cls(action, order_id, response, error)
+
+
+@attr.s
+class QuoteResult:
+    # outcome of replace_quote(). bid/ask: None if that side was not posted.
+    cancels = attr.ib(factory=list)
+    bid = attr.ib(default=None)
+    ask = attr.ib(default=None)
+
+    @property
+    def results(self):
+        return self.cancels + [r for r in (self.bid, self.ask) if r is not None]
+
+    @property
+    def ok(self):
+        return all(r.ok for r in self.results)
+
+    @property
+    def errors(self):
+        return [r for r in self.results if not r.ok]
+
+
+def not_sent_quote(cancels, bid_price=None, ask_price=None):
+    return QuoteResult(cancels=cancels, bid=OrderResult('buy', error=NOT_SENT) if bid_price is not None else None,
+                       ask=OrderResult('sell', error=NOT_SENT) if ask_price is not None else None)
+
+
+class ExecutionCache:
+    # executions of the orders, by acceptance id. Only the executions newer than the cached ones are fetched
+    # (after=<last exec id>), page by page (before=<oldest id of the previous page>) as getexecutions
+    # returns the newest first. An interrupted refresh is simply fetched again: executions are merged by id.
+
+    def __init__(self, page_size=100, max_orders=1000):
+        self.page_size = page_size
+        self.max_orders = max_orders  # the least recently used orders are forgotten past this number.
+        self._executions = OrderedDict()  # <acceptance id:<exec id:execution>>
+        self._after = {}  # <acceptance id:id of the newest execution fetched without gap>
+        self._lock = Lock()
+
+    def page_params(self, order_id, symbol, before=None):
+        params = dict(product_code=symbol, child_order_acceptance_id=order_id, count=self.page_size)
+        after = self._after.get(order_id)
+        if after is not None:
+            params['after'] = after
+        if before is not None:
+            params['before'] = before
+        return params
+
+    def merge(self, order_id, page):
+        # merges a page of getexecutions. Returns the before cursor of the next page, None once up to date.
+        if not isinstance(page, list):
+            raise ValueError(f'getexecutions of {order_id} failed: {response_error(page) or page}.')
+        with self._lock:
+            executions = self._executions.get(order_id)
+            if executions is None:
+                executions = self._executions[order_id] = {}
+                if len(self._executions) > self.max_orders:
+                    forgotten, _ = self._executions.popitem(last=False)
+                    self._after.pop(forgotten, None)
+            else:
+                self._executions.move_to_end(order_id)
+            for execution in page:
+                executions[execution['id']] = execution
+            if len(page) < self.page_size:
+                if len(executions) > 0:
+                    self._after[order_id] = max(executions)
+                return None
+        return min(execution['id'] for execution in page)
+
+    def executions(self, order_id):
+        # cached executions of the order, oldest first.
+        with self._lock:
+            executions = self._executions.get(order_id, {})
+            return [executions[exec_id] for exec_id in sorted(executions)]
+
+    def executed_quantity_and_average_price(self, order_id):
+        return executed_quantity_and_average_price(self.executions(order_id))
+
+    def forget(self, order_id):
+        with self._lock:
+            self._executions.pop(order_id, None)
+            self._after.pop(order_id, None)
+
 
 class BitflyerRestAPI(pybitflyer.API):
 
-    def __init__(self, credentials={}, timeout=None):
+    def __init__(self, credentials={}, timeout=None, max_workers=8, scheduler=None, execution_cache=None):
         super().__init__(credentials['apiKey'], credentials['secret'], timeout)
+        self.max_workers = max_workers
+        self.scheduler = scheduler  # RequestScheduler. None: requests are sent right away.
+        self.execution_cache = execution_cache if execution_cache is not None else ExecutionCache()
+        self._executor = None
+
+    def request(self, endpoint, method='GET', params=None):
+        if self.scheduler is None:
+            return super().request(endpoint, method, params)
+        priority, buckets = classify(endpoint, method)
+        key = coalescing_key(endpoint, method, params)
+        return self.scheduler.call(partial(super().request, endpoint, method, params), priority, buckets, key)
+
+    @property
+    def executor(self):
+        # threads for the batch operations, created once and reused.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bitflyer-rest')
+        return self._executor
+
+    @staticmethod
+    def _result(action, order_id, future):
+        try:
+            return OrderResult.of(action, order_id, response=future.result())
+        except Exception as e:
+            return OrderResult.of(action, order_id, exception=e)
+
+    def cancel_orders(self, order_ids, symbol):
+        # cancels the acceptance ids concurrently. Returns one OrderResult per id, in order.
+        futures = [(order_id, self.executor.submit(self.cancel_order, order_id, symbol)) for order_id in order_ids]
+        return [self._result('cancel', order_id, future) for order_id, future in futures]
+
+    def cancel_all_orders(self, symbol):
+        return self.cancelallchildorders(product_code=symbol)
+
+    def replace_quote(self, symbol, quantity, bid_price=None, ask_price=None, cancel_ids=(), cancel_first=False,
+                      params={}):
+        # cancels cancel_ids and posts the new bid and ask (None: side not posted).
+        # cancel_first=False: everything is sent at once, about one round-trip, but the old and the new
+        # orders can briefly be live together. cancel_first=True: the new orders are only sent once the
+        # cancels are acknowledged (two round-trips), and not at all if a cancel failed: the old order may still
+        # be live, so the new ones are returned with the NOT_SENT error.
+        # Otherwise a failure does not stop the other requests: check QuoteResult.ok and QuoteResult.errors.
+        cancels = [(order_id, self.executor.submit(self.cancel_order, order_id, symbol)) for order_id in cancel_ids]
+        if cancel_first:
+            cancels = [self._result('cancel', order_id, future) for order_id, future in cancels]
+            if not all(cancel.ok for cancel in cancels):
+                return not_sent_quote(cancels, bid_price, ask_price)
+        bid = ask = None
+        if bid_price is not None:
+            bid = self.executor.submit(self.create_limit_buy_order, symbol, quantity, bid_price, params)
+        if ask_price is not None:
+            ask = self.executor.submit(self.create_limit_sell_order, symbol, quantity, ask_price, params)
+        if not cancel_first:
+            cancels = [self._result('cancel', order_id, future) for order_id, future in cancels]
+        return QuoteResult(cancels=cancels,
+                           bid=self._result('buy', None, bid) if bid is not None else None,
+                           ask=self._result('sell', None, ask) if ask is not None else None)
 
     def _wrap_new_order(self, resp):
-        resp['id'] = resp['child_order_acceptance_id']
-        return resp
+        return wrap_new_order(resp)
 
     def create_limit_buy_order(self, ticker, quantity, price, params={}):
         return self._create_limit_order(ticker, quantity, price, 'BUY', params)
@@ -29,69 +280,43 @@ class BitflyerRestAPI(pybitflyer.API):
         return self.cancelchildorder(product_code=symbol, child_order_acceptance_id=order_id)
 
     def _create_limit_order(self, ticker, quantity, price, side, params={}):
-        time_in_force = params['time_in_force'] if 'time_in_force' in params else None
-        minute_to_expire = params['minute_to_expire'] if 'minute_to_expire' in params else None
-        resp = self.sendchildorder(product_code=ticker,
-                                   child_order_type='LIMIT',
-                                   price=price,
-                                   side=side,
-                                   size=quantity,
-                                   minute_to_expire=minute_to_expire,
-                                   time_in_force=time_in_force)
+        resp = self.sendchildorder(**limit_order_params(ticker, quantity, price, side, params))
         try:
             return self._wrap_new_order(resp)
         except Exception:
             return resp
 
     def _create_market_order(self, ticker, quantity, side, params={}):
-        resp = self.sendchildorder(product_code=ticker,
-                                   child_order_type='MARKET',
-                                   side=side,
-                                   size=quantity)
+        resp = self.sendchildorder(**market_order_params(ticker, quantity, side))
         try:
             return self._wrap_new_order(resp)
         except Exception:
             return resp
 
+    def fetch_executions(self, order_id, symbol):
+        # executions of the order, oldest first. Only the new ones are downloaded.
+        before = None
+        while True:
+            page = self.getexecutions(**self.execution_cache.page_params(order_id, symbol, before))
+            before = self.execution_cache.merge(order_id, page)
+            if before is None:
+                return self.execution_cache.executions(order_id)
+
     def fetch_order_status(self, order_id, symbol):  # does not handle partial fills.
-        order = self.fetch_order(order_id, symbol)
-        if len(order) == 0:  # either executed or canceled.
-            trades = self.getexecutions(product_code=symbol, child_order_acceptance_id=order_id)
-            if len(trades) == 0:
-                return 'CANCELED'
-            else:
-                return 'COMPLETED'
-        assert len(order) == 1
-        order = order[0]
-        return order['child_order_state']
+        # the order and its executions are fetched concurrently.
+        order = self.executor.submit(self.fetch_order, order_id, symbol)
+        trades = self.fetch_executions(order_id, symbol)
+        return order_status(order.result(), trades)
 
     def fetch_executed_size(self, order_id, symbol):
-        trades = self.getexecutions(product_code=symbol, child_order_acceptance_id=order_id)
-        executed_size = 0.0
-        for trade in trades:
-            executed_size += float(trade['size'])
-        return executed_size
+        return float(sum(float(trade['size']) for trade in self.fetch_executions(order_id, symbol)))
 
     def fetch_executed_quantity_and_average_price(self, order_id, symbol):
-        trades = self.getexecutions(product_code=symbol, child_order_acceptance_id=order_id)
-        average_price = 0
-        total_size = 0
-        for trade in trades:
-            average_price += trade['size'] * trade['price']
-            total_size += trade['size']
-        if total_size == 0:
-            return 0, 0
-        else:
-            average_price /= total_size
-            return total_size, average_price
+        return executed_quantity_and_average_price(self.fetch_executions(order_id, symbol))
 
-    def get_positions(self):
+    def fetch_positions(self, symbol='FX_BTC_JPY'):
         # self.getpositions() => buggy.
-        positions = self.request('/v1/me/getpositions', params={'product_code': 'FX_BTC_JPY'})
-        position_quantity = 0.0
-        for position in positions:
-            if position['side'] == 'BUY':
-                position_quantity += position['size']
-            else:
-                position_quantity -= position['size']
-        return position_quantity
+        return self.request('/v1/me/getpositions', params={'product_code': symbol})
+
+    def get_positions(self):
+        return position_quantity(self.fetch_positions('FX_BTC_JPY'))
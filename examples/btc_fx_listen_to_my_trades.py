@@ -10,8 +10,8 @@ def main():
 
     order_status_io = OrderEventsSocketIO(key, secret)
     order_status_rpc = OrderEventsRPC(key, secret)
+    private_rest = BitflyerRestAPI(credentials={'apiKey': key, 'secret': secret}, timeout=1)
     for i in range(10):
-        private_rest = BitflyerRestAPI(credentials={'apiKey': key, 'secret': secret}, timeout=1)
         best_bid = private_rest.ticker(ticker='FX_BTC_JPY')['best_bid']
         order = private_rest.create_limit_buy_order('FX_BTC_JPY', 0.01, price=best_bid - 100_000,
                                                     params={'minute_to_expire': 1})
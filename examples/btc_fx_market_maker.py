@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import os
 import sys
 import threading
-from time import sleep, time
+from time import time
 
+from bitflyer.aiotrading import AsyncBitflyerRestAPI
 from bitflyer.ord_status import OrderEventsSocketIO, OrderEventsRPC, OrderStatus
 from bitflyer.ticker import SocketIOFastTickerAPI
 from bitflyer.trading import BitflyerRestAPI
@@ -16,25 +18,16 @@ logger = logging.getLogger(__name__)
 
 def sadly_close_order(order_passing_api, order_events_api, order_id, text, market_func):
     logger.info(f'CANCEL: {text}.')
-    assert order_events_api.fetch_order_status(order_id).status != 'cancel'
+    assert order_events_api.fetch_order_status(order_id).status != OrderStatus.CANCEL
     order_passing_api.cancel_order(order_id, 'FX_BTC_JPY')
-    while True:
-        order_to_delete_info = order_events_api.fetch_order_status(order_id).status
-        if order_to_delete_info == order_events_api.FULLY_FILL:
-            logger.info('Eventually got executed.')
-            return
-        if order_to_delete_info == order_events_api.CANCEL:
-            break
-        if order_to_delete_info == order_events_api.CANCEL_FAILED:
-            break
-        sleep(0.001)
+    order_to_delete_info = order_events_api.wait_for(
+        order_id, [OrderStatus.FULLY_FILL, OrderStatus.CANCEL, OrderStatus.CANCEL_FAILED]).status
+    if order_to_delete_info == OrderStatus.FULLY_FILL:
+        logger.info('Eventually got executed.')
+        return
     logger.info(f'MARKET: {text}.')
     order_id = market_func(SYMBOL, QUANTITY)
-    while True:
-        market_status = order_events_api.fetch_order_status(order_id['id'])
-        if market_status is not None and market_status.status == 'full_fill':
-            break
-        sleep(0.001)
+    order_events_api.wait_for(order_id['id'], OrderStatus.FULLY_FILL)
 
 
 def main():
@@ -43,6 +36,19 @@ def main():
     bitflyer_secret = os.environ['BITFLYER_SECRET']
     credentials = {'apiKey': bitflyer_key, 'secret': bitflyer_secret}
     order_passing_api = BitflyerRestAPI(credentials, timeout=5)
+    # both legs of a quote are sent concurrently on warm keep-alive connections, from one event loop thread.
+    async_order_passing_api = AsyncBitflyerRestAPI(credentials, timeout=5)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def run(coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def quote(bid_price, ask_price):
+        return await asyncio.gather(async_order_passing_api.create_limit_buy_order(SYMBOL, QUANTITY, bid_price),
+                                    async_order_passing_api.create_limit_sell_order(SYMBOL, QUANTITY, ask_price))
+
+    run(async_order_passing_api.warm_up(2))
     logger.info(f'Collateral: {order_passing_api.getcollateral()["collateral"]} yen.')
     order_events_api = OrderEventsRPC(bitflyer_key, bitflyer_secret)
     market_data_api = SocketIOFastTickerAPI()
@@ -55,28 +61,16 @@ def main():
         ask_price = ask - 1
         logger.info(f'Limit BUY {QUANTITY}@{bid_price}.')
         logger.info(f'Limit SELL {QUANTITY}@{ask_price}.')
-        order_ids = {}
-
-        def buy():
-            order_ids['buy'] = order_passing_api.create_limit_buy_order(SYMBOL, QUANTITY, bid_price)
-
-        def sell():
-            order_ids['sell'] = order_passing_api.create_limit_sell_order(SYMBOL, QUANTITY, ask_price)
-
-        bt = threading.Thread(target=buy)
-        st = threading.Thread(target=sell)
-        bt.start()
-        st.start()
-        bt.join()
-        st.join()
-
-        buy_id = order_ids['buy']['id']
-        sell_id = order_ids['sell']['id']
+        buy_order, sell_order = run(quote(bid_price, ask_price))
+        buy_id = buy_order['id']
+        sell_id = sell_order['id']
         start_ref = time()
         while True:
+            version = order_events_api.store.version
             buy_order_info = order_events_api.fetch_order_status(buy_id)
             sell_order_info = order_events_api.fetch_order_status(sell_id)
             if buy_order_info is None or sell_order_info is None:
+                order_events_api.wait_for_update(timeout=0.1, version=version)
                 continue
             if (time() - start_ref) > time_to_wait_before_closing_the_step:
 
@@ -97,6 +91,10 @@ def main():
                 logger.info('All executed.')
                 break
 
+            # sleeps until the next order event or until it is time to close the step.
+            timeout = max(start_ref + time_to_wait_before_closing_the_step - time(), 0.1)
+            order_events_api.wait_for_update(timeout=timeout, version=version)
+
 
 if __name__ == '__main__':
     main()
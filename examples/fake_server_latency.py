@@ -0,0 +1,96 @@
+# End-to-end throughput and latency of ClientRPC + OrderBook against a local FakeLightstream,
+# no bitFlyer account needed.
+# Half-way through, half of the connections are dropped to rehearse a disconnect storm.
+#
+#   python examples/fake_server_latency.py --clients 4 --rate 5000 --messages 50000
+import argparse
+import os
+import random
+from threading import Thread
+from time import sleep, time
+
+import numpy as np
+
+from bitflyer.fake_lightstream import FakeLightstream
+from bitflyer.order_book import OrderBook
+from bitflyer.rpc import ClientRPC
+
+SNAPSHOT_CHANNEL = 'lightning_board_snapshot_FX_BTC_JPY'
+BOARD_CHANNEL = 'lightning_board_FX_BTC_JPY'
+
+
+def board_stream(n, snapshot_every=1_000, mid_price=1_000_000, seed=0):
+    # yields (channel, message). Each message carries its send time, the clients measure the latency from it.
+    rng = random.Random(seed)
+    for i in range(n):
+        mid_price += rng.randint(-5, 5)
+        if i % snapshot_every == 0:
+            message = {'mid_price': float(mid_price),
+                       'bids': [{'price': float(mid_price - j), 'size': 1.0} for j in range(1, 300)],
+                       'asks': [{'price': float(mid_price + j), 'size': 1.0} for j in range(1, 300)]}
+            channel = SNAPSHOT_CHANNEL
+        else:
+            message = {'mid_price': float(mid_price),
+                       'bids': [{'price': float(mid_price - rng.randint(1, 300)), 'size': rng.choice([0, 0.1, 1.5])}],
+                       'asks': [{'price': float(mid_price + rng.randint(1, 300)), 'size': rng.choice([0, 0.1, 1.5])}]}
+            channel = BOARD_CHANNEL
+        message['sent_at'] = time()
+        yield channel, message
+
+
+class LatencyClient:
+
+    def __init__(self, end_point):
+        self.order_book = OrderBook(enable_qos=False)
+        self.latencies = []
+        self.rpc = ClientRPC(end_point=end_point)
+        self.rpc.register_channels(public_channels=[SNAPSHOT_CHANNEL, BOARD_CHANNEL])
+        self.rpc.register_handler(self.on_snapshot, channel=SNAPSHOT_CHANNEL)
+        self.rpc.register_handler(self.on_board, channel=BOARD_CHANNEL)
+        self.rpc.register_disconnect_handler(self.order_book.on_disconnect)
+
+    def on_snapshot(self, message):
+        self.order_book.snapshot_update(message)
+        self.latencies.append(time() - message['sent_at'])
+
+    def on_board(self, message):
+        self.order_book.book_update(message)
+        self.latencies.append(time() - message['sent_at'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--rate', type=float, default=5_000, help='Messages per second. 0: as fast as possible.')
+    parser.add_argument('--storm', type=float, default=0.5, help='Fraction of the connections dropped half-way.')
+    args = parser.parse_args()
+
+    server = FakeLightstream(seed=0).start()
+    clients = [LatencyClient(server.rpc_url) for _ in range(args.clients)]
+    for client in clients:
+        client.rpc.start_and_wait_for_stream(timeout=10)
+
+    def storm():
+        sleep(args.messages / args.rate / 2 if args.rate > 0 else 1)
+        print(f'Disconnect storm: dropped {server.drop_connections(args.storm)} connections.')
+
+    Thread(target=storm, daemon=True).start()
+    start = time()
+    num_messages = server.play(board_stream(args.messages), rate=args.rate if args.rate > 0 else None)
+    sleep(1)  # lets the clients drain their sockets.
+    elapsed = time() - start
+
+    latencies = np.array([latency for client in clients for latency in client.latencies]) * 1e6
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+    print(f'{num_messages:,} messages sent to {args.clients} clients in {elapsed:.2f}s.')
+    print(f'{len(latencies):,} received ({len(latencies) / elapsed:,.0f} msg/s), '
+          f'{args.clients * num_messages - len(latencies):,} lost during the storm.')
+    print(f'latency: p50={p50:.0f}us p99={p99:.0f}us p99.9={p999:.0f}us max={latencies.max():.0f}us.')
+    for i, client in enumerate(clients):
+        print(f'client {i}: {client.rpc.reconnect.as_dict()}, book valid: {client.order_book.snapshot_received}.')
+    os._exit(0)  # the ClientRPC threads run forever.
+
+
+if __name__ == '__main__':
+    main()
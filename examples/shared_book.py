@@ -0,0 +1,32 @@
+import multiprocessing
+import time
+
+from bitflyer.shared_book import SharedBookReader, run_shared_book_feed
+
+
+def strategy(name):
+    # any number of these: they read the book of the feed process, without a connection of their own.
+    while True:
+        try:
+            reader = SharedBookReader('FX_BTC_JPY')
+            break
+        except FileNotFoundError:  # the feed is not up yet.
+            time.sleep(0.1)
+    while True:
+        top = reader.read(max_staleness=1)
+        if top is not None:
+            print(name, top.best_bid, top.best_ask, top.qos, top.bids[:3].tolist())
+        time.sleep(0.5)
+
+
+def main():
+    multiprocessing.Process(target=run_shared_book_feed, args=(['FX_BTC_JPY'],), daemon=True).start()
+    strategies = [multiprocessing.Process(target=strategy, args=(f'strategy-{i}',)) for i in range(3)]
+    for process in strategies:
+        process.start()
+    for process in strategies:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ from setuptools import setup
 setup(
     name='bitflyer-rt',
     version='2.25',
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     description='Bitflyer Realtime and Rest API',
     author='Philippe Remy',
     license='MIT',
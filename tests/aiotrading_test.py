@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import unittest
+
+from aiohttp import web
+
+from bitflyer.aiotrading import AsyncBitflyerRestAPI
+from bitflyer.trading import NOT_SENT
+
+
+class AsyncBitflyerRestAPITest(unittest.TestCase):
+
+    def test_signed_requests_share_connections(self):
+        asyncio.run(self._test_signed_requests_share_connections())
+
+    async def _test_signed_requests_share_connections(self):
+        connections = set()
+
+        async def handle(request):
+            connections.add(id(request.transport))
+            body = await request.text()
+            text = request.headers['ACCESS-TIMESTAMP'] + request.method + request.path_qs + body
+            expected = hmac.new(b'secret', text.encode('utf-8'), hashlib.sha256).hexdigest()
+            self.assertEqual(expected, request.headers['ACCESS-SIGN'])
+            if request.path == '/v1/me/sendchildorder':
+                order = json.loads(body)
+                return web.json_response({'child_order_acceptance_id': f'JRF-{order["side"]}'})
+            if request.path == '/v1/me/cancelchildorder':
+                if json.loads(body)['child_order_acceptance_id'] == 'JRF-unknown':
+                    return web.json_response({'status': -208, 'error_message': 'Order is not accepted.'})
+                return web.Response()
+            return web.json_response([{'side': 'BUY', 'size': 0.3}, {'side': 'SELL', 'size': 0.1}])
+
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncBitflyerRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'},
+                                            api_url=f'http://127.0.0.1:{port}', pool_size=2) as api:
+                await api.warm_up(2)
+                for _ in range(5):
+                    buy, sell = await asyncio.gather(api.create_limit_buy_order('FX_BTC_JPY', 0.01, 1_000_000),
+                                                     api.create_limit_sell_order('FX_BTC_JPY', 0.01, 1_000_100))
+                    self.assertEqual('JRF-BUY', buy['id'])
+                    self.assertEqual('JRF-SELL', sell['id'])
+                self.assertAlmostEqual(0.2, await api.get_positions())
+                result = await api.replace_quote('FX_BTC_JPY', 0.01, bid_price=100, ask_price=110,
+                                                 cancel_ids=['JRF-BUY', 'JRF-unknown'])
+                self.assertEqual(('JRF-BUY', 'JRF-SELL'), (result.bid.order_id, result.ask.order_id))
+                self.assertEqual(['JRF-unknown'], [r.order_id for r in result.errors])
+                result = await api.replace_quote('FX_BTC_JPY', 0.01, bid_price=101, cancel_ids=['JRF-unknown'],
+                                                 cancel_first=True)
+                self.assertEqual(NOT_SENT, result.bid.error)
+            self.assertLessEqual(len(connections), 2)
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import sys
+import unittest
+from threading import Thread
+from time import sleep
+
+from bitflyer.book_manager import BookFeed, BookManager
+
+PRODUCT = 'FX_BTC_JPY'
+
+
+def snapshot():
+    return {'mid_price': 1000, 'bids': [{'price': 999 - i, 'size': 1} for i in range(100)],
+            'asks': [{'price': 1001 + i, 'size': 1} for i in range(100)]}
+
+
+def update(i):
+    # moves the whole book up by one: the top levels stay contiguous and the spread is 2.
+    return {'mid_price': 1000 + i, 'bids': [{'price': 999 + i, 'size': 1}, {'price': 899 + i, 'size': 0}],
+            'asks': [{'price': 1000 + i, 'size': 0}, {'price': 1100 + i, 'size': 1}]}
+
+
+def check_top(test, top):
+    bids, asks = [price for price, _ in top.bids], [price for price, _ in top.asks]
+    test.assertEqual(list(range(bids[0], bids[0] - 10, -1)), bids)
+    test.assertEqual(list(range(asks[0], asks[0] + 10)), asks)
+    test.assertEqual((top.best_bid, top.best_ask, top.mid_price), (bids[0], asks[0], bids[0] + 1))
+
+
+class BookFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # the receive and flush threads interleave as much as possible.
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_receive_and_flush_threads(self):
+        tops = []
+        # the flush thread publishes.
+        feed = BookFeed([PRODUCT], tops.append, publish_interval=10, heartbeat_interval=None)
+        snapshot_handler, board_handler = (feed.rpc.handlers[f'lightning_board_snapshot_{PRODUCT}'],
+                                           feed.rpc.handlers[f'lightning_board_{PRODUCT}'])
+        snapshot_handler(snapshot())
+        stop = []
+
+        def flush_forever():
+            while not stop:
+                feed.flush()
+
+        flusher = Thread(target=flush_forever)
+        flusher.start()
+        try:
+            for i in range(1, 20000):
+                board_handler(update(i))
+        finally:
+            stop.append(True)
+            flusher.join()
+        self.assertGreater(len(tops), 10)
+        for top in tops:
+            check_top(self, top)
+        check_top(self, feed.top(PRODUCT))
+        self.assertEqual(999 + 19999, feed.top(PRODUCT).best_bid)
+
+    def test_heartbeat(self):
+        manager = BookManager([PRODUCT], publish_interval=0.01, heartbeat_interval=0.05)
+        manager._feed.rpc.handlers[f'lightning_board_snapshot_{PRODUCT}'](snapshot())
+        self.assertIsNotNone(manager.top(PRODUCT, max_staleness=0.1))
+        sleep(0.15)
+        self.assertIsNone(manager.top(PRODUCT, max_staleness=0.1))
+        manager._feed.flush()  # the book did not change, but is still valid.
+        check_top(self, manager.top(PRODUCT, max_staleness=0.1))
+        manager._feed._on_disconnect()
+        sleep(0.15)
+        manager._feed.flush()
+        self.assertIsNone(manager.top(PRODUCT, max_staleness=0.1))
+
+
+if __name__ == '__main__':
+    unittest.main()
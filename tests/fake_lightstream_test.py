@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+from time import sleep, time
+
+from bitflyer.aiorpc import AsyncClientRPC
+from bitflyer.book_manager import BookManager
+from bitflyer.fake_lightstream import FakeLightstream
+from bitflyer.reconnect import Backoff, ReconnectManager
+from bitflyer.socketio import WebSocketIO
+
+PRODUCT = 'FX_BTC_JPY'
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time() + timeout
+    while not predicate():
+        if time() > deadline:
+            raise AssertionError('Timed out.')
+        sleep(0.01)
+
+
+async def async_wait_until(predicate, timeout=10):
+    deadline = time() + timeout
+    while not predicate():
+        if time() > deadline:
+            raise AssertionError('Timed out.')
+        await asyncio.sleep(0.01)
+
+
+def snapshot(mid_price):
+    return {'mid_price': mid_price, 'bids': [{'price': mid_price - i, 'size': 1} for i in range(1, 4)],
+            'asks': [{'price': mid_price + i, 'size': 1} for i in range(1, 4)]}
+
+
+class FakeLightstreamTest(unittest.TestCase):
+    # end-to-end: the clients connect to a local server, receive the streams and reconnect after a drop.
+
+    def setUp(self):
+        self.server = FakeLightstream(seed=0).start()
+        self.addCleanup(self.server.stop)
+
+    def test_book_manager_reconnects(self):
+        manager = BookManager([PRODUCT], end_point=self.server.rpc_url, publish_interval=0, heartbeat_interval=None)
+        manager.start()
+        self.addCleanup(manager.stop)
+        rpc = manager._feed.rpc
+        self.assertTrue(rpc.ready)
+        snapshot_channel, board_channel = f'lightning_board_snapshot_{PRODUCT}', f'lightning_board_{PRODUCT}'
+        self.server.play([(snapshot_channel, snapshot(1000)),
+                          (board_channel, {'mid_price': 1000, 'bids': [], 'asks': [{'price': 1001, 'size': 0}]})])
+        wait_until(lambda: manager.best_bid_ask(PRODUCT) == (999, 1002))
+
+        self.server.drop_connections()
+        wait_until(lambda: rpc.reconnect.reconnects == 1 and rpc.ready)  # subscribed again.
+        self.assertFalse(manager.order_book(PRODUCT).snapshot_received)  # deltas were missed meanwhile.
+        self.server.play([(board_channel, {'mid_price': 1500, 'bids': [{'price': 1499, 'size': 1}], 'asks': []}),
+                          (snapshot_channel, snapshot(2000)),
+                          (board_channel, {'mid_price': 2000, 'bids': [{'price': 1999, 'size': 0}], 'asks': []})])
+        wait_until(lambda: manager.best_bid_ask(PRODUCT) == (1998, 2001))
+        self.assertEqual(1, manager.order_book(PRODUCT).discarded_updates)
+
+    def test_socketio_resubscribes(self):
+        ws = WebSocketIO(self.server.socketio_url, 'key', 'secret', backoff=Backoff(initial_delay=0.1))
+        self.addCleanup(ws.close)
+        received = []
+        channel = f'lightning_ticker_{PRODUCT}'
+        ws.register_handler(channel, received.append)
+
+        def publish_until_received(message):
+            # the subscription is acknowledged by nothing but the messages themselves.
+            deadline = time() + 10
+            while message not in received:
+                self.assertLess(time(), deadline)
+                self.server.publish(channel, message)
+                sleep(0.05)
+
+        publish_until_received({'ltp': 1000})
+        self.server.drop_connections()
+        wait_until(lambda: ws.reconnect.reconnects == 1)
+        publish_until_received({'ltp': 1001})
+
+    def test_async_client_rpc(self):
+        channel = f'lightning_ticker_{PRODUCT}'
+        received = []
+
+        def handler(message):
+            received.append(message)
+            if message['ltp'] == 1000:
+                raise ValueError('Handler bug.')
+
+        async def run():
+            client = AsyncClientRPC(end_point=self.server.rpc_url)
+            client.reconnect = ReconnectManager(Backoff(initial_delay=0.1))
+            client.register_channels(public_channels=[channel])
+            client.register_handler(handler, channel)
+            task = await client.start_and_wait_for_stream(timeout=10)
+            try:
+                self.assertTrue(client.subscriptions.done)
+                with self.assertLogs('bitflyer.aiorpc', 'ERROR'):
+                    self.server.publish(channel, {'ltp': 1000})
+                    await async_wait_until(lambda: len(received) == 1)
+                self.server.publish(channel, {'ltp': 1001})  # still dispatched after the handler failed.
+                await async_wait_until(lambda: len(received) == 2)
+
+                await asyncio.get_running_loop().run_in_executor(None, self.server.drop_connections)
+                await async_wait_until(lambda: client.reconnect.reconnects == 1 and client.ready.is_set())
+                self.server.publish(channel, {'ltp': 1002})  # subscribed again.
+                await async_wait_until(lambda: len(received) == 3)
+            finally:
+                await client.close()
+                await asyncio.wait_for(task, 5)
+
+        asyncio.run(run())
+        self.assertEqual([{'ltp': 1000}, {'ltp': 1001}, {'ltp': 1002}], received)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+import unittest
+from collections import deque
+from queue import Empty
+from threading import Thread, Timer
+from time import sleep, time
+
+from bitflyer.handoff import Handoff
+
+
+class HandoffTest(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        handoff = Handoff(capacity=3, overflow='drop_oldest')
+        for i in range(5):
+            handoff.put(i)
+        self.assertEqual([2, 3], handoff.drain(max_n=2))
+        self.assertEqual(4, handoff.get_nowait())
+        with self.assertRaises(Empty):
+            handoff.get(timeout=0.01)
+        self.assertEqual([], handoff.drain())
+        self.assertEqual({'occupancy': 0, 'size': 0, 'max_size': 3, 'capacity': 3, 'put': 5, 'dropped': 2,
+                          'conflated': 0, 'blocked': 0}, handoff.as_dict())
+
+    def test_conflate(self):
+        handoff = Handoff(capacity=2, overflow='conflate', key=lambda item: item[0])
+        for item in [('a', 1), ('b', 1), ('a', 2), ('c', 1)]:
+            handoff.put(item)
+        self.assertEqual([('b', 1), ('c', 1)], handoff.drain())  # a keeps its place, the oldest: dropped for c.
+        self.assertEqual((1, 1), (handoff.num_conflated, handoff.num_dropped))
+
+    def test_conflate_concurrent(self):
+        # the consumer drains while the producer drops the oldest item to make room.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+        handoff = Handoff(capacity=2, overflow='conflate', key=lambda item: item[0])
+        n = 100_000
+        received = []
+        done = []
+
+        def consume():
+            while not done or len(handoff) > 0:
+                received.extend(handoff.drain(timeout=0.01))
+
+        consumer = Thread(target=consume)
+        consumer.start()
+        try:
+            for i in range(n):
+                handoff.put((i % 5, i))
+        finally:
+            done.append(True)
+            consumer.join()
+        self.assertEqual(n, handoff.num_put)
+        self.assertEqual((4, n - 1), received[-1])  # the latest item is never dropped.
+        for key in range(5):
+            values = [i for k, i in received if k == key]
+            self.assertEqual(sorted(set(values)), values)  # the latest value of a key only moves forward.
+
+    def test_drop_oldest_drained_meanwhile(self):
+        handoff = Handoff(capacity=2, overflow='drop_oldest')
+        received = []
+
+        class DrainedBeforeAppend(deque):
+            # the consumer drains between the length check of put() and its append.
+            def append(self, item):
+                received.extend(handoff.drain())
+                super().append(item)
+
+        handoff.put(0)
+        handoff.put(1)
+        handoff._items = DrainedBeforeAppend(handoff._items, maxlen=2)
+        handoff.put(2)  # full when checked, but nothing is dropped.
+        received.extend(handoff.drain())
+        self.assertEqual([0, 1, 2], received)
+        self.assertEqual(0, handoff.num_dropped)
+        handoff._items = deque(handoff._items, maxlen=2)
+        for i in range(3, 6):
+            handoff.put(i)
+        self.assertEqual(1, handoff.num_dropped)
+
+    def test_block(self):
+        handoff = Handoff(capacity=2, overflow='block')
+        received = []
+
+        def consume():
+            while len(received) < 1000:
+                received.extend(handoff.drain(max_n=10, timeout=1))
+                sleep(0.0001)
+
+        consumer = Thread(target=consume)
+        consumer.start()
+        for i in range(1000):
+            handoff.put(i)
+        consumer.join()
+        self.assertEqual(list(range(1000)), received)
+        self.assertGreater(handoff.num_blocked, 0)
+        self.assertEqual(2, handoff.max_occupancy)
+
+    def test_wakes_up_consumer(self):
+        handoff = Handoff()
+        Timer(0.05, handoff.put, args=['message']).start()
+        start = time()
+        self.assertEqual(['message'], handoff.drain(timeout=5))
+        self.assertLess(time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
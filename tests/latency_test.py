@@ -0,0 +1,53 @@
+import json
+import unittest
+from datetime import datetime, timezone
+
+import numpy as np
+
+from bitflyer.latency import LatencyHistogram, LatencyTracker, exchange_time_ns
+from bitflyer.rpc import ClientRPC
+
+
+class LatencyTest(unittest.TestCase):
+
+    def test_histogram_percentiles(self):
+        values = np.random.RandomState(0).lognormal(mean=10, sigma=2, size=100_000).astype(np.int64)
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(int(value))
+        self.assertEqual(len(values), histogram.count)
+        self.assertEqual(values.max(), histogram.max)
+        sorted_values = np.sort(values)
+        for q in [50, 90, 99, 99.9]:
+            expected = sorted_values[int(np.ceil(q / 100 * len(values))) - 1]
+            self.assertAlmostEqual(expected, histogram.percentile(q), delta=expected / 60)
+        histogram.record(-5)
+        self.assertEqual(1, histogram.num_negatives)
+
+    def test_exchange_time(self):
+        expected = datetime(2020, 5, 1, 10, 0, 1, tzinfo=timezone.utc).timestamp()
+        expected = int(expected) * 1_000_000_000
+        self.assertEqual(expected + 123_456_700, exchange_time_ns('2020-05-01T10:00:01.1234567Z'))
+        self.assertEqual(expected + 500_000_000, exchange_time_ns('2020-05-01T10:00:01.5Z'))
+        self.assertEqual(expected, exchange_time_ns('2020-05-01T10:00:01Z'))
+        self.assertEqual(expected, exchange_time_ns('2020-05-01T10:00:01+00:00'))
+        self.assertEqual(expected + 500_000_000, exchange_time_ns('2020-05-01T19:00:01.5+09:00'))
+        self.assertEqual(expected + 123_456_000, exchange_time_ns('2020-05-01T05:00:01.123456-05:00'))
+
+    def test_client_rpc_stages(self):
+        latency = LatencyTracker()
+        client = ClientRPC(latency=latency)
+        client.register_handler(lambda message: latency.on_applied())
+        frame = json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {
+            'channel': 'child_order_events',
+            'message': [{'event_type': 'ORDER', 'event_date': '2020-05-01T10:00:01.1234567Z'}]}})
+        for _ in range(10):
+            client.on_message(None, frame)
+        stats = latency.as_dict()
+        for stage in ['wire', 'decode', 'apply', 'handler', 'total']:
+            self.assertEqual(10, stats[stage]['count'])
+        self.assertGreater(latency.percentile('wire', 99), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
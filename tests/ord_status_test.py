@@ -0,0 +1,134 @@
+import asyncio
+import json
+import math
+import random
+import unittest
+from threading import Timer
+
+from bitflyer.handoff import Handoff
+from bitflyer.ord_status import OrderEvents, OrderStateStore, OrderStatus, fetch_order_status, OrderFailed, \
+    to_records
+
+
+def _messages():
+    return [
+        {'child_order_acceptance_id': 'JRF1', 'event_type': 'ORDER', 'event_date': '2020-05-01T10:00:00.1000000Z',
+         'size': 0.03},
+        {'child_order_acceptance_id': 'JRF1', 'event_type': 'EXECUTION', 'event_date': '2020-05-01T10:00:01.2Z',
+         'size': 0.01, 'price': 955000, 'outstanding_size': 0.02},
+        {'child_order_acceptance_id': 'JRF1', 'event_type': 'EXECUTION', 'event_date': '2020-05-01T10:00:02.3Z',
+         'size': 0.01, 'price': 955010, 'outstanding_size': 0.01},
+    ]
+
+
+class OrderStateStoreTest(unittest.TestCase):
+
+    def test_matches_fetch_order_status(self):
+        messages = _messages()
+        for seed in range(10):
+            shuffled = list(messages)
+            random.Random(seed).shuffle(shuffled)
+            store = OrderStateStore()
+            store.update(shuffled)
+            self.assertEqual(fetch_order_status({'JRF1': messages}, 'JRF1'), store.status('JRF1'))
+        self.assertEqual(OrderStatus.PARTIAL_FILL, store.status('JRF1').status)
+        self.assertEqual(0.01, store.status('JRF1').outstanding_size)
+
+    def test_fetch_order_status_offset_dates(self):
+        messages = [dict(message, event_date=message['event_date'].replace('Z', '+00:00'))
+                    for message in _messages()]
+        messages[0]['event_date'] = '2020-05-01T19:00:00.1+09:00'  # the same time, another offset.
+        status = fetch_order_status({'JRF1': messages[::-1]}, 'JRF1')
+        self.assertEqual(OrderStatus.PARTIAL_FILL, status.status)
+        self.assertEqual('2020-05-01T10:00:02.3+00:00', status.event_date)
+
+    def test_full_fill_and_unknown(self):
+        store = OrderStateStore()
+        self.assertIsNone(store.status('JRF1'))
+        store.update(_messages())
+        store.update_one({'child_order_acceptance_id': 'JRF1', 'event_type': 'EXECUTION',
+                          'event_date': '2020-05-01T10:00:03Z', 'size': 0.01, 'price': 955020,
+                          'outstanding_size': 0})
+        status = store.status('JRF1')
+        self.assertEqual(OrderStatus.FULLY_FILL, status.status)
+        self.assertAlmostEqual(955010, status.avg_price)
+        self.assertIs(status, store.status('JRF1'))
+
+    def test_json_and_records(self):
+        store = OrderStateStore()
+        store.update(_messages())
+        store.update_one({'child_order_acceptance_id': 'JRF2', 'event_type': 'CANCEL',
+                          'event_date': '2020-05-01T10:00:05Z'})
+        status = store.status('JRF1')
+        self.assertEqual({'order_id': 'JRF1', 'status': 'partial_fill', 'event_date': '2020-05-01T10:00:02.3Z',
+                          'avg_price': status.avg_price, 'executed_quantity': status.executed_quantity,
+                          'outstanding_size': 0.01}, json.loads(status.json()))
+        self.assertIsNone(json.loads(store.status('JRF2').json())['outstanding_size'])
+
+        records = to_records([status, store.status('JRF2')])
+        self.assertEqual([b'JRF1', b'JRF2'], records.order_id.tolist())
+        self.assertEqual([OrderStatus.PARTIAL_FILL, OrderStatus.CANCEL], records.status.tolist())
+        self.assertEqual(1588327202300000000, records.event_time[0])
+        self.assertTrue(math.isnan(records.outstanding_size[1]))  # unknown.
+        self.assertEqual(['JRF1', 'JRF2'], [order_id.decode() for order_id in store.to_records().order_id])
+
+    def test_order_failed(self):
+        store = OrderStateStore()
+        store.update([{'child_order_acceptance_id': 'JRF2', 'event_type': 'ORDER_FAILED',
+                       'event_date': '2020-05-01T10:00:00Z', 'reason': 'EXCEED_MAXIMUM_POSITION_SIZE'}])
+        with self.assertRaises(OrderFailed):
+            store.status('JRF2')
+
+    def test_parent_order_events(self):
+        # parent_order_events come on the same handler: no size on ORDER, TRIGGER and COMPLETE event types.
+        events = OrderEvents(handoff=Handoff())
+        received = []
+        events.register_handler(received.append)
+        parent_events = [
+            {'parent_order_id': 'JCP1', 'parent_order_acceptance_id': 'JRF9', 'event_type': 'ORDER',
+             'event_date': '2020-05-01T10:00:00Z', 'parent_order_type': 'IFD'},
+            {'parent_order_id': 'JCP1', 'parent_order_acceptance_id': 'JRF9', 'event_type': 'TRIGGER',
+             'event_date': '2020-05-01T10:00:00.5Z', 'child_order_type': 'LIMIT', 'parameter_index': 1},
+            {'parent_order_id': 'JCP1', 'parent_order_acceptance_id': 'JRF9', 'event_type': 'COMPLETE',
+             'event_date': '2020-05-01T10:00:03Z', 'parameter_index': 1},
+        ]
+        messages = parent_events + _messages()
+        events.on_ord_status(messages)
+        self.assertEqual([messages], received)
+        self.assertEqual([messages], events.message_queue.drain())
+        self.assertNotIn('JRF9', events.store)
+        self.assertEqual(OrderStatus.PARTIAL_FILL, events.fetch_order_status('JRF1').status)
+
+        # a child ORDER without size does not break the batch either.
+        events.on_ord_status([{'child_order_acceptance_id': 'JRF2', 'event_type': 'ORDER',
+                               'event_date': '2020-05-01T10:00:04Z'}])
+        self.assertEqual(2, len(received))
+
+    def test_wait_for(self):
+        store = OrderStateStore()
+        transitions = []
+        store.add_listener(lambda order_id, previous, current: transitions.append(current.status))
+        self.assertIsNone(store.wait_for('JRF1', OrderStatus.FULLY_FILL, timeout=0.01))
+        messages = _messages()
+        timer = Timer(0.05, store.update, args=[messages])
+        timer.start()
+        status = store.wait_for('JRF1', [OrderStatus.PARTIAL_FILL, OrderStatus.FULLY_FILL], timeout=5)
+        timer.join()
+        self.assertEqual(OrderStatus.PARTIAL_FILL, status.status)
+        self.assertEqual([OrderStatus.PARTIAL_FILL], transitions)
+        # labels as in OrderStatus.json().
+        self.assertEqual(status, store.wait_for('JRF1', 'partial_fill', timeout=5))
+        self.assertEqual(status, store.wait_for('JRF1', ['full_fill', 'partial_fill'], timeout=5))
+        with self.assertRaises(ValueError):
+            store.wait_for('JRF1', 'filled', timeout=0.01)
+
+    def test_future(self):
+        store = OrderStateStore()
+
+        async def wait():
+            future = store.future('JRF1', 'cancel')
+            Timer(0.05, store.update, args=[[{'child_order_acceptance_id': 'JRF1', 'event_type': 'CANCEL',
+                                              'event_date': '2020-05-01T10:00:00Z'}]]).start()
+            return await asyncio.wait_for(future, 5)
+
+        self.assertEqual(OrderStatus.CANCEL, asyncio.run(wait()).status)
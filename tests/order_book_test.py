@@ -1,13 +1,101 @@
 import json
+import random
 import unittest
 
-from bitflyer.order_book import OrderBook
+import numpy as np
+
+from bitflyer.decoding import board_delta
+from bitflyer.order_book import OrderBook, ENGINES
 
 
 class OrderBookTest(unittest.TestCase):
 
     def test_1(self):
-        ob = OrderBook(enable_qos=False, enable_statistics=False)
+        self._test_1(engine='sorted_dict')
+
+    def test_1_ladder(self):
+        self._test_1(engine='ladder')
+
+    def test_engines_match(self):
+        rng = random.Random(0)
+        sorted_ob = OrderBook(enable_qos=False, enable_statistics=False, engine='sorted_dict')
+        ladder_ob = OrderBook(enable_qos=False, enable_statistics=False, engine='ladder')
+        for ob in [sorted_ob, ladder_ob]:
+            ob.bid_order_book = ob._book_side(is_bid=True)
+            ob.ask_order_book = ob._book_side(is_bid=False)
+            ob.snapshot_received = True
+        ladder_ob.bid_order_book.size = ladder_ob.ask_order_book.size = 256  # small ladders to overflow often.
+        ladder_ob.bid_order_book.sizes = np.zeros(256)
+        ladder_ob.ask_order_book.sizes = np.zeros(256)
+        mid = 1_000_000
+        for _ in range(5000):
+            mid += rng.randint(-20, 20)
+            update = {
+                'mid_price': mid,
+                'bids': [{'price': mid - rng.randint(1, 400), 'size': rng.choice([0, 0, 0.01, 0.5])}
+                         for _ in range(rng.randint(0, 3))],
+                'asks': [{'price': mid + rng.randint(1, 400), 'size': rng.choice([0, 0, 0.01, 0.5])}
+                         for _ in range(rng.randint(0, 3))]
+            }
+            for ob in [sorted_ob, ladder_ob]:
+                for bid in update['bids']:
+                    ob._single_book_update(bid['price'], bid['size'], is_bid=True)
+                for ask in update['asks']:
+                    ob._single_book_update(ask['price'], ask['size'], is_bid=False)
+                if ob.bid_order_book.needs_recenter(mid):
+                    ob.bid_order_book.recenter(mid)
+                if ob.ask_order_book.needs_recenter(mid):
+                    ob.ask_order_book.recenter(mid)
+            self.assertEqual(sorted_ob.bid_order_book.best, ladder_ob.bid_order_book.best)
+            self.assertEqual(sorted_ob.ask_order_book.best, ladder_ob.ask_order_book.best)
+        self.assertEqual(sorted_ob.bid_order_book.levels(), ladder_ob.bid_order_book.levels())
+        self.assertEqual(sorted_ob.ask_order_book.levels(), ladder_ob.ask_order_book.levels())
+
+    def test_set_levels_matches_set_level(self):
+        # bulk deltas, large enough for the vectorised ladder path, with repeated prices and overflows.
+        rng = np.random.RandomState(0)
+        for is_bid in [True, False]:
+            reference = ENGINES['sorted_dict'](is_bid=is_bid)
+            sides = [ENGINES['sorted_dict'](is_bid=is_bid), ENGINES['ladder'](is_bid=is_bid, size=256)]
+            for side in sides:
+                side.set_level(1_000_000, 1.0)
+            reference.set_level(1_000_000, 1.0)
+            for _ in range(500):
+                n = rng.randint(0, 80)
+                prices = 1_000_000 + rng.randint(-200, 200, size=n).astype(np.int64)
+                sizes = rng.choice([0, 0, 0.01, 0.5], size=n)
+                for price, size in zip(prices.tolist(), sizes.tolist()):
+                    reference.set_level(price, size)
+                for side in sides:
+                    side.set_levels(prices, sizes)
+                    self.assertEqual(reference.best, side.best)
+                    self.assertEqual(len(reference), len(side))
+            for side in sides:
+                self.assertEqual(reference.levels(), side.levels())
+
+    def test_apply_delta(self):
+        snapshot = {
+            'mid_price': 955367.0,
+            'bids': [{'price': 955328.0, 'size': 0.04}, {'price': 955324.0, 'size': 0.02},
+                     {'price': 955301.0, 'size': 1.5}, {'price': 1.0, 'size': 0.5}],  # far: out of the ladder.
+            'asks': [{'price': 955406.0, 'size': 0.1}, {'price': 955420.0, 'size': 0.3},
+                     {'price': 955451.0, 'size': 2.0}, {'price': 5000000.0, 'size': 0.5}]
+        }
+        update = {'mid_price': 955360, 'bids': [{'price': 955330.0, 'size': 1.210}],
+                  'asks': [{'price': 955398.0, 'size': 1.621}, {'price': 955406.0, 'size': 0}]}
+        for engine in ENGINES:
+            ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
+            typed_ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
+            ob.snapshot_update(snapshot)
+            typed_ob.snapshot_update(board_delta(snapshot))
+            ob.book_update(update)
+            typed_ob.apply_delta(board_delta(update))
+            self.assertEqual((955330, 955398), (typed_ob.best_bid, typed_ob.best_ask))
+            self.assertEqual(ob.bid_order_book.levels(), typed_ob.bid_order_book.levels())
+            self.assertEqual(ob.ask_order_book.levels(), typed_ob.ask_order_book.levels())
+
+    def _test_1(self, engine):
+        ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
         with open('../ob.json', 'r') as r:
             snapshot = json.load(r)
         ob.snapshot_update(snapshot)
@@ -78,3 +166,56 @@ class OrderBookTest(unittest.TestCase):
         })
         self.assertEqual(955324, ob.best_bid)
         self.assertEqual(955406, ob.best_ask)
+
+    def test_liquidity_for(self):
+        for engine in ENGINES:
+            ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
+            self.assertEqual((0, 0, 0, 0), ob.liquidity_for(1))
+            ob.snapshot_update({
+                'mid_price': 1000,
+                'bids': [{'price': 999, 'size': 1}, {'price': 998, 'size': 2}],
+                'asks': [{'price': 1001, 'size': 1}, {'price': 1004, 'size': 1}]
+            })
+            self.assertEqual((999, 1001, 999, 1001), ob.liquidity_for(0.5))
+            self.assertEqual((998, 1002, 998, 1004), ob.liquidity_for(2))
+            # too thin: the whole side is used.
+            self.assertEqual((998, 1002, 998, 1004), ob.liquidity_for(100))
+            bid_average_price, ask_average_price, bid_lowest_price, ask_highest_price = ob.liquidity_for([0.5, 2, 100])
+            self.assertEqual([999, 998, 998], bid_average_price.tolist())
+            self.assertEqual([1001, 1002, 1002], ask_average_price.tolist())
+            self.assertEqual([999, 998, 998], bid_lowest_price.tolist())
+            self.assertEqual([1001, 1004, 1004], ask_highest_price.tolist())
+            asks = [{'price': 1001, 'size': 0}, {'price': 1004, 'size': 0}, {'price': 1010, 'size': 1}]
+            ob.book_update({'mid_price': 1000, 'bids': [], 'asks': asks})
+            self.assertEqual((998, 1010, 998, 1010), ob.liquidity_for(2))
+
+    def test_updates_without_snapshot(self):
+        snapshot = {'mid_price': 1000, 'bids': [{'price': 999, 'size': 1}], 'asks': [{'price': 1001, 'size': 1}]}
+        update = {'mid_price': 1000, 'bids': [{'price': 998, 'size': 1}], 'asks': []}
+        for engine in ENGINES:
+            ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
+            ob.book_update(update)
+            ob.snapshot_update(snapshot)
+            ob.on_disconnect()
+            ob.book_update(update)
+            ob.snapshot_update(snapshot)
+            self.assertEqual(2, ob.discarded_updates)
+            self.assertEqual([(999, 1)], ob.bid_order_book.levels())  # the snapshot alone.
+
+    def test_snapshot_diff(self):
+        for engine in ENGINES:
+            ob = OrderBook(enable_qos=False, enable_statistics=False, engine=engine)
+            ob.snapshot_update({
+                'mid_price': 1000,
+                'bids': [{'price': 999, 'size': 1}, {'price': 998, 'size': 2}],
+                'asks': [{'price': 1001, 'size': 1}, {'price': 1004, 'size': 1}]
+            })
+            changes = ob.snapshot_update({
+                'mid_price': 1000,
+                'bids': [{'price': 999, 'size': 1}, {'price': 997, 'size': 2}],
+                'asks': [{'price': 1001, 'size': 3}, {'price': 1004, 'size': 1}]
+            }, diff=True)
+            self.assertEqual([{'price': 997, 'size': 2}, {'price': 998, 'size': 0}], changes['bids'])
+            self.assertEqual([{'price': 1001, 'size': 3}], changes['asks'])
+            self.assertEqual([(999, 1), (997, 2)], ob.bid_order_book.levels())
+            self.assertEqual([(1001, 3), (1004, 1)], ob.ask_order_book.levels())
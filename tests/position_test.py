@@ -0,0 +1,61 @@
+import unittest
+
+from bitflyer.position import PositionTracker
+
+
+def execution(exec_id, side, price, size, product_code='FX_BTC_JPY'):
+    return {'product_code': product_code, 'child_order_acceptance_id': 'JRF-1', 'event_type': 'EXECUTION',
+            'event_date': '2020-05-01T10:00:00.0000000Z', 'exec_id': exec_id, 'side': side, 'price': price,
+            'size': size, 'commission': 0, 'sfd': 0, 'outstanding_size': 0}
+
+
+class FakeRestAPI:
+
+    def __init__(self, positions):
+        self.positions = positions
+
+    def fetch_positions(self, symbol):
+        return self.positions
+
+
+class PositionTrackerTest(unittest.TestCase):
+
+    def test_pnl(self):
+        tracker = PositionTracker('FX_BTC_JPY')
+        tracker.update([execution(1, 'BUY', 100, 0.1), execution(2, 'BUY', 200, 0.1),
+                        {'event_type': 'ORDER', 'product_code': 'FX_BTC_JPY'},
+                        execution(3, 'BUY', 1000, 1, product_code='BTC_JPY')])
+        self.assertAlmostEqual(0.2, tracker.position)
+        self.assertAlmostEqual(150, tracker.average_price)
+        self.assertAlmostEqual(0.2 * 50, tracker.unrealized_pnl(mid_price=200))
+
+        tracker.update([execution(4, 'SELL', 250, 0.1), execution(4, 'SELL', 250, 0.1)])  # duplicated.
+        self.assertAlmostEqual(0.1, tracker.position)
+        self.assertAlmostEqual(10, tracker.realized_pnl)
+
+        tracker.update([execution(5, 'SELL', 120, 0.3)])  # flips to short.
+        self.assertAlmostEqual(-0.2, tracker.position)
+        self.assertAlmostEqual(120, tracker.average_price)
+        self.assertAlmostEqual(10 - 3, tracker.realized_pnl)
+        self.assertAlmostEqual(-0.2 * -20, tracker.unrealized_pnl(mid_price=100))
+
+        tracker.update([execution(6, 'BUY', 100, 0.2)])
+        self.assertEqual(0, tracker.position)
+        self.assertAlmostEqual(10 - 3 + 4, tracker.realized_pnl)
+        self.assertEqual(0, tracker.unrealized_pnl(mid_price=100))
+
+    def test_reconcile(self):
+        tracker = PositionTracker('FX_BTC_JPY')
+        tracker.update([execution(1, 'BUY', 100, 0.1)])
+        self.assertEqual(0, tracker.reconcile(FakeRestAPI([{'side': 'BUY', 'size': 0.1, 'price': 100}])))
+        self.assertEqual(0, tracker.num_corrections)
+        drift = tracker.reconcile(FakeRestAPI([{'side': 'BUY', 'size': 0.1, 'price': 100},
+                                               {'side': 'BUY', 'size': 0.2, 'price': 130}]))
+        self.assertAlmostEqual(0.2, drift)
+        self.assertAlmostEqual(0.3, tracker.position)
+        self.assertAlmostEqual(120, tracker.average_price)
+        self.assertEqual(1, tracker.num_corrections)
+
+
+if __name__ == '__main__':
+    unittest.main()
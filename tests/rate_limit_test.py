@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Event
+from time import sleep, time
+from unittest import mock
+
+import pybitflyer
+
+from bitflyer.rate_limit import CANCEL, ORDER, QUERY, RequestScheduler, TokenBucket
+from bitflyer.trading import BitflyerRestAPI
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(capacity=10, period=5, clock=lambda: now[0])
+        bucket.take(10)
+        self.assertAlmostEqual(0.5, bucket.wait_time())
+        now[0] += 1
+        self.assertAlmostEqual(2, bucket.tokens)
+        now[0] += 100
+        self.assertEqual(10, bucket.tokens)
+
+    def test_priorities(self):
+        scheduler = RequestScheduler(buckets={'api': TokenBucket(capacity=1, period=0.02),
+                                              'order': TokenBucket(capacity=1, period=0.02)})
+        scheduler.buckets['api'].take()  # empty: the next requests queue up.
+        granted = []
+        futures = []
+        for priority in [QUERY, QUERY, ORDER, CANCEL, QUERY, CANCEL]:
+            future = scheduler.acquire(priority, ('api',))
+            future.add_done_callback(lambda _, priority=priority: granted.append(priority))
+            futures.append(future)
+        wait(futures, timeout=5)
+        self.assertEqual([CANCEL, CANCEL, ORDER, QUERY, QUERY, QUERY], granted)
+        self.assertEqual({'cancel': 2, 'order': 1, 'query': 3}, scheduler.as_dict()['sent'])
+        self.assertGreater(scheduler.as_dict()['wait_p99_ms']['query'], 0)
+
+    def test_coalescing(self):
+        calls = []
+        release = Event()
+
+        def slow_request(api, endpoint, method='GET', params=None):
+            calls.append(endpoint)
+            release.wait(5)  # in flight until every caller has joined it.
+            return {'best_bid': 100}
+
+        api = BitflyerRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'}, scheduler=RequestScheduler())
+        with mock.patch.object(pybitflyer.API, 'request', slow_request), ThreadPoolExecutor(5) as executor:
+            futures = [executor.submit(api.ticker, product_code='FX_BTC_JPY') for _ in range(5)]
+            deadline = time() + 5
+            while api.scheduler.num_coalesced < 4 and time() < deadline:
+                sleep(0.001)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual([{'best_bid': 100}] * 5, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(4, api.scheduler.num_coalesced)
+
+    def test_cancelled_caller(self):
+        scheduler = RequestScheduler(buckets={'api': TokenBucket(capacity=1, period=0.2)})
+        scheduler.buckets['api'].take()  # the first request waits for 0.2s.
+
+        async def request():
+            return {'best_bid': 100}
+
+        async def run():
+            first = asyncio.ensure_future(scheduler.call_async(request, key='ticker'))
+            await asyncio.sleep(0.01)
+            joined = asyncio.ensure_future(scheduler.call_async(request, key='ticker'))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):  # does not wait forever.
+                await asyncio.wait_for(joined, 5)
+            self.assertEqual({}, scheduler._in_flight)
+            return await asyncio.wait_for(scheduler.call_async(request, key='ticker'), 5)
+
+        self.assertEqual({'best_bid': 100}, asyncio.run(run()))
+        self.assertEqual(1, scheduler.as_dict()['sent']['query'])  # no token was taken by the cancelled call.
+        self.assertEqual(0, scheduler.as_dict()['queue_depth']['query'])
+
+        permit = scheduler.acquire()
+        permit.result(timeout=5)
+        scheduler.release(permit)  # granted but not sent: the token is given back.
+        self.assertAlmostEqual(1, scheduler.buckets['api'].tokens, places=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
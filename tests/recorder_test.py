@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bitflyer.order_book import OrderBook
+from bitflyer.recorder import FrameRecorder, FrameReplayer
+
+
+class RecorderTest(unittest.TestCase):
+
+    def test_record_and_replay(self):
+        snapshot = {
+            'mid_price': 1000,
+            'bids': [{'price': 999, 'size': 1}, {'price': 998, 'size': 2}],
+            'asks': [{'price': 1001, 'size': 1}, {'price': 1004, 'size': 1}]
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'frames.rec')
+            with FrameRecorder(path, chunk_size=256) as recorder:
+                recorder.record(json.dumps([{'jsonrpc': '2.0', 'id': i, 'result': True} for i in range(2)]),
+                                timestamp=0.5)  # subscribe acks of a batch.
+                recorder.record(json.dumps({'jsonrpc': '2.0', 'method': 'channelMessage', 'params': {
+                    'channel': 'lightning_board_snapshot_FX_BTC_JPY', 'message': snapshot}}), timestamp=1.0)
+                for i in range(100):
+                    update = {'mid_price': 1000, 'bids': [{'price': 999, 'size': i + 1}], 'asks': []}
+                    recorder.record(json.dumps(update), channel='lightning_board_FX_BTC_JPY', timestamp=1.0 + i)
+            replayer = FrameReplayer(path)
+            frames = list(replayer.frames())
+            self.assertEqual(102, len(frames))
+            self.assertEqual((100.0, 'lightning_board_FX_BTC_JPY'), frames[-1][:2])
+            ob = OrderBook(enable_qos=False, enable_statistics=False)
+            self.assertEqual(101, replayer.replay_order_book(ob))
+            self.assertEqual([(999, 100), (998, 2)], ob.bid_order_book.levels())
@@ -0,0 +1,64 @@
+import json
+import unittest
+
+from bitflyer.rpc import ClientRPC, SubscribeFailed
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, frame):
+        self.sent.append(json.loads(frame))
+
+
+class ClientRPCTest(unittest.TestCase):
+
+    def _open(self):
+        client = ClientRPC()
+        client.register_channels(public_channels=['lightning_board_FX_BTC_JPY', 'lightning_ticker_FX_BTC_JPY'])
+        ws = FakeWebSocket()
+        client.on_open(ws)
+        ids = [request['id'] for request in ws.sent[0]]
+        self.assertEqual(2, len(ids))
+        return client, ws, ids
+
+    def test_single_acks(self):
+        client, ws, ids = self._open()
+        client.on_message(ws, json.dumps({'jsonrpc': '2.0', 'id': ids[0], 'result': True}))
+        self.assertFalse(client.ready)
+        client.on_message(ws, json.dumps({'jsonrpc': '2.0', 'id': ids[1], 'result': True}))
+        self.assertTrue(client.ready)
+        self.assertTrue(client._ready_event.is_set())
+
+    def test_batch_acks(self):
+        client, ws, ids = self._open()
+        client.on_message(ws, json.dumps([{'jsonrpc': '2.0', 'id': i, 'result': True} for i in ids]))
+        self.assertTrue(client.ready)
+        client.subscriptions.check()
+
+    def test_backoff_reset_once_subscribed(self):
+        client = ClientRPC()
+        client.register_channels(public_channels=['lightning_board_FX_BTC_JPY'])
+        client.reconnect.next_delay()
+        client.reconnect.next_delay()
+        ws = FakeWebSocket()
+        client.on_open(ws)
+        self.assertEqual(2, client.reconnect.backoff.attempts)  # connected but not subscribed yet.
+        client.on_message(ws, json.dumps({'jsonrpc': '2.0', 'id': ws.sent[0][0]['id'], 'result': True}))
+        self.assertEqual(0, client.reconnect.backoff.attempts)
+
+    def test_subscribe_error(self):
+        client, ws, ids = self._open()
+        client.on_message(ws, json.dumps([{'jsonrpc': '2.0', 'id': ids[0], 'result': True},
+                                          {'jsonrpc': '2.0', 'id': ids[1],
+                                           'error': {'code': -32602, 'message': 'Invalid params.'}}]))
+        self.assertFalse(client.ready)
+        self.assertTrue(client._ready_event.is_set())  # the waiter does not block forever.
+        with self.assertRaises(SubscribeFailed):
+            client.subscriptions.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
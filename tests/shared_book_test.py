@@ -0,0 +1,103 @@
+import os
+import unittest
+from threading import Thread
+from time import time
+
+from bitflyer.book_manager import BookFeed, BookTop
+from bitflyer.shared_book import SharedBookReader, SharedBookWriter
+
+
+def top(i, depth=3):
+    return BookTop(product='FX_BTC_JPY', best_bid=1000 + i, best_ask=1001 + i, mid_price=1000.5 + i,
+                   bids=[(1000 + i - j, 0.1 * (i % 7 + 1)) for j in range(depth)],
+                   asks=[(1001 + i + j, 0.1 * (i % 7 + 1)) for j in range(depth)], timestamp=time(), qos=None)
+
+
+class SharedBookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.name = f'bitflyer_test_{os.getpid()}'
+        self.writer = SharedBookWriter('FX_BTC_JPY', depth=5, name=self.name)
+        self.reader = SharedBookReader('FX_BTC_JPY', name=self.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_read(self):
+        self.assertIsNone(self.reader.read())
+        self.assertEqual((None, None), self.reader.best_bid_ask())
+        self.writer.write(top(0, depth=10))
+        snapshot = self.reader.read(max_staleness=1)
+        self.assertEqual((1000, 1001, 1000.5, None), (snapshot.best_bid, snapshot.best_ask, snapshot.mid_price,
+                                                      snapshot.qos))
+        self.assertEqual([[1000, 0.1], [999, 0.1], [998, 0.1], [997, 0.1], [996, 0.1]], snapshot.bids.tolist())
+        self.assertEqual((1000, 1001), self.reader.best_bid_ask())
+        self.writer.write(top(1, depth=2))
+        self.assertEqual(2, len(self.reader.read().asks))
+        self.assertEqual(1000, snapshot.best_bid)  # snapshots are copies.
+        self.assertIsNone(self.reader.read(max_staleness=-1))
+
+    def test_consistent_while_writing(self):
+        stop = []
+
+        def write_forever():
+            i = 0
+            while not stop:
+                i += 1
+                self.writer.write(top(i))
+
+        writer = Thread(target=write_forever)
+        writer.start()
+        try:
+            for _ in range(20_000):
+                snapshot = self.reader.read()
+                if snapshot is None:
+                    continue
+                self.assertEqual(snapshot.best_bid, snapshot.bids[0, 0])
+                self.assertEqual(snapshot.best_ask, snapshot.asks[0, 0])
+                self.assertEqual(snapshot.bids[0, 1], snapshot.asks[-1, 1])
+        finally:
+            stop.append(True)
+            writer.join()
+
+    def test_feed_threads_and_reader(self):
+        # the receive thread publishes the changes and the flush thread the heartbeats, to one writer.
+        feed = BookFeed(['FX_BTC_JPY'], self.writer.write, depth=5, publish_interval=0, heartbeat_interval=0)
+        feed.rpc.handlers['lightning_board_snapshot_FX_BTC_JPY']({
+            'mid_price': 1000, 'bids': [{'price': 999 - i, 'size': 1} for i in range(20)],
+            'asks': [{'price': 1001 + i, 'size': 1} for i in range(20)]})
+        stop = []
+        errors = []
+
+        def flush_forever():
+            while not stop:
+                feed.flush()
+
+        def read_forever():
+            while not stop:
+                snapshot = self.reader.read()
+                bids, asks = snapshot.bids[:, 0].tolist(), snapshot.asks[:, 0].tolist()
+                if bids != list(range(int(bids[0]), int(bids[0]) - 5, -1)) or asks[0] != bids[0] + 2 or \
+                        snapshot.best_bid != bids[0]:
+                    errors.append(snapshot)
+
+        threads = [Thread(target=flush_forever), Thread(target=read_forever)]
+        for thread in threads:
+            thread.start()
+        try:
+            board_handler = feed.rpc.handlers['lightning_board_FX_BTC_JPY']
+            for i in range(1, 5000):
+                board_handler({'mid_price': 1000 + i,
+                               'bids': [{'price': 999 + i, 'size': 1}, {'price': 979 + i, 'size': 0}],
+                               'asks': [{'price': 1000 + i, 'size': 0}, {'price': 1020 + i, 'size': 1}]})
+        finally:
+            stop.append(True)
+            for thread in threads:
+                thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(999 + 4999, self.reader.read().best_bid)
+
+
+if __name__ == '__main__':
+    unittest.main()
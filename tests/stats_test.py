@@ -0,0 +1,34 @@
+import unittest
+
+from bitflyer.order_book import NumUpdatesPerSeconds
+from bitflyer.stats import EwmaRate, RollingMean
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_rolling_mean(self):
+        mean = RollingMean(window=4)
+        for value in [1, 1, 0, 0, 0, 0]:
+            mean.append(value)
+        self.assertTrue(mean.full)
+        self.assertEqual(0, mean.mean)
+        mean.append(1)
+        self.assertEqual(0.25, mean.mean)
+
+    def test_ewma_rate(self):
+        now = [0.0]
+        rate = EwmaRate(half_life=1.0, clock=lambda: now[0])
+        self.assertEqual(0, rate.rate)
+        for _ in range(5000):
+            now[0] += 0.001
+            rate.count()
+        self.assertAlmostEqual(1000, rate.rate, delta=10)
+        now[0] += 1.0  # one half life without updates.
+        self.assertAlmostEqual(500, rate.rate, delta=10)
+
+    def test_num_updates_per_seconds(self):
+        # former signature: the first argument is still max_num_updates, not the half life.
+        rate = NumUpdatesPerSeconds(500)
+        self.assertEqual((500, 1.0), (rate.max_num_updates, rate.half_life))
+        rate.count()
+        self.assertGreater(rate.rate, 0)
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from bitflyer.trades import RingArray, TradeAggregator
+
+
+def execution(exec_id, second, side, price, size):
+    return {'id': exec_id, 'side': side, 'price': price, 'size': size,
+            'exec_date': f'2020-05-01T10:00:{second:06.3f}Z'}
+
+
+class TradesTest(unittest.TestCase):
+
+    def test_ring_array(self):
+        ring = RingArray(capacity=4, width=1)
+        ring.extend(np.arange(3, dtype=np.float64).reshape(-1, 1))
+        ring.extend(np.arange(3, 6, dtype=np.float64).reshape(-1, 1))
+        self.assertEqual([2, 3, 4, 5], ring.last()[:, 0].tolist())
+        self.assertEqual([4, 5], ring.last(2)[:, 0].tolist())
+        self.assertIs(ring.data, ring.last().base)  # a view.
+        ring.append([6])
+        self.assertEqual([3, 4, 5, 6], ring.last()[:, 0].tolist())
+
+    def test_aggregator(self):
+        aggregator = TradeAggregator(capacity=4, bar_intervals=(1,), windows=(2,))
+        aggregator.update([execution(1, 0.1, 'BUY', 100, 1), execution(2, 0.5, 'SELL', 90, 1),
+                           execution(3, 0.9, 'BUY', 110, 2)])
+        self.assertEqual(0, len(aggregator.bars[1].last()))
+        current = aggregator.bars[1].current
+        self.assertEqual((100, 110, 90, 110, 4), (current.open, current.high, current.low, current.close,
+                                                  current.volume))
+        self.assertAlmostEqual(102.5, current.vwap)
+        self.assertEqual((3, 1), (current.buy_volume, current.sell_volume))
+
+        aggregator.update([execution(3, 0.9, 'BUY', 110, 2), execution(4, 1.2, 'SELL', 120, 1)])  # 3 replayed.
+        bars = aggregator.bars[1].last()
+        self.assertEqual(1, len(bars))
+        self.assertEqual([100, 110, 90, 110, 4, 102.5, 3, 1, 3], bars[0, 1:].tolist())
+        self.assertEqual(0, bars[0, 0] % 1)
+        window = aggregator.windows[2]
+        self.assertEqual(4, window.count)
+        self.assertAlmostEqual(5, window.volume)
+        self.assertAlmostEqual(1, window.flow)
+
+        aggregator.update([execution(5, 2.7, '', 130, 1)])  # 1 and 2 leave the window.
+        self.assertEqual(3, window.count)
+        self.assertAlmostEqual((110 * 2 + 120 + 130) / 4, window.vwap)
+        self.assertAlmostEqual(1, window.flow)
+        self.assertEqual([3, 4, 5], window.trades()[:, 1].tolist())
+
+        aggregator.update([execution(i, 2.8, 'BUY', 130, 1) for i in range(6, 10)])  # overflows the ring.
+        self.assertEqual(4, window.count)
+        self.assertAlmostEqual(4, window.flow)
+        self.assertEqual(130, aggregator.last_price)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from threading import Lock
+from time import sleep
+
+from bitflyer.trading import NOT_SENT, BitflyerRestAPI, ExecutionCache
+
+
+class FakeRestAPI(BitflyerRestAPI):
+    # answers every request after 50ms. Cancelling 'JRF-unknown' fails like the real API.
+    # executions: of 'JRF-1', newest first like getexecutions.
+    # calls: (endpoint, requests in flight when it started, once it ended) for the overlap of the requests.
+
+    executions = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+        self.in_flight = 0
+        self._lock = Lock()
+
+    def request(self, endpoint, method='GET', params=None):
+        with self._lock:
+            self.in_flight += 1
+            self.calls.append((endpoint, self.in_flight, 'start'))
+        try:
+            sleep(0.05)
+            return self._respond(endpoint, params)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.calls.append((endpoint, self.in_flight, 'end'))
+
+    def max_in_flight(self):
+        return max(in_flight for _, in_flight, _ in self.calls)
+
+    def _respond(self, endpoint, params):
+        if endpoint == '/v1/me/getexecutions':
+            self.requests.append(params)
+            executions = [e for e in self.executions if e['id'] > params.get('after', 0)
+                          and e['id'] < params.get('before', float('inf'))]
+            return executions[:params['count']]
+        if endpoint == '/v1/me/getchildorders':
+            return []
+        if endpoint == '/v1/me/cancelchildorder':
+            if params['child_order_acceptance_id'] == 'JRF-unknown':
+                return {'status': -208, 'error_message': 'Order is not accepted.'}
+            return ''
+        if endpoint == '/v1/me/sendchildorder':
+            return {'child_order_acceptance_id': f'JRF-{params["side"]}-{params["price"]}'}
+        raise ValueError(endpoint)
+
+
+class TradingTest(unittest.TestCase):
+
+    def test_replace_quote(self):
+        api = FakeRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'})
+        result = api.replace_quote('FX_BTC_JPY', 0.01, bid_price=100, ask_price=110,
+                                   cancel_ids=['JRF-1', 'JRF-2', 'JRF-unknown'])
+        self.assertEqual(5, api.max_in_flight())  # one round-trip, not five.
+        self.assertEqual('JRF-BUY-100', result.bid.order_id)
+        self.assertEqual('JRF-SELL-110', result.ask.order_id)
+        self.assertFalse(result.ok)
+        self.assertEqual(['JRF-unknown'], [r.order_id for r in result.errors])
+        self.assertEqual('-208: Order is not accepted.', result.errors[0].error)
+
+        api.calls = []
+        result = api.replace_quote('FX_BTC_JPY', 0.01, bid_price=101, cancel_ids=['JRF-BUY-100'], cancel_first=True)
+        self.assertEqual([('/v1/me/cancelchildorder', 'start'), ('/v1/me/cancelchildorder', 'end'),
+                          ('/v1/me/sendchildorder', 'start'), ('/v1/me/sendchildorder', 'end')],
+                         [(endpoint, event) for endpoint, _, event in api.calls])
+        self.assertTrue(result.ok)
+        self.assertIsNone(result.ask)
+
+    def test_replace_quote_failed_cancel(self):
+        # cancel_first: the old order may still be live, the new ones are not sent.
+        api = FakeRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'})
+        result = api.replace_quote('FX_BTC_JPY', 0.01, bid_price=101, ask_price=111,
+                                   cancel_ids=['JRF-1', 'JRF-unknown'], cancel_first=True)
+        self.assertEqual({'/v1/me/cancelchildorder'}, {endpoint for endpoint, _, _ in api.calls})
+        self.assertEqual(['JRF-unknown', None, None], [r.order_id for r in result.errors])
+        self.assertEqual([NOT_SENT, NOT_SENT], [result.bid.error, result.ask.error])
+
+    def test_fetch_executions(self):
+        api = FakeRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'},
+                          execution_cache=ExecutionCache(page_size=2))
+        api.requests = []
+        api.executions = [{'id': i, 'size': 0.01, 'price': 100 + i} for i in (5, 4, 3)]
+        self.assertEqual([3, 4, 5], [e['id'] for e in api.fetch_executions('JRF-1', 'FX_BTC_JPY')])
+        self.assertEqual([{}, {'before': 4}],
+                         [{k: v for k, v in p.items() if k in ('after', 'before')} for p in api.requests])
+
+        api.requests = []
+        api.executions = [{'id': 7, 'size': 0.02, 'price': 110}] + api.executions
+        size, average_price = api.fetch_executed_quantity_and_average_price('JRF-1', 'FX_BTC_JPY')
+        self.assertAlmostEqual(0.05, size)
+        self.assertAlmostEqual((0.01 * (104 + 103 + 105) + 0.02 * 110) / 0.05, average_price)
+        self.assertEqual([5], [p['after'] for p in api.requests])  # only the new executions.
+
+        api.calls = []
+        self.assertEqual('COMPLETED', api.fetch_order_status('JRF-1', 'FX_BTC_JPY'))
+        self.assertEqual(2, api.max_in_flight())  # getchildorders and getexecutions at once.
+
+    def test_cancel_orders(self):
+        api = FakeRestAPI(credentials={'apiKey': 'key', 'secret': 'secret'})
+        results = api.cancel_orders(['JRF-1', 'JRF-unknown', 'JRF-3'], 'FX_BTC_JPY')
+        self.assertEqual([True, False, True], [r.ok for r in results])
+
+
+if __name__ == '__main__':
+    unittest.main()